@@ -1,5 +1,5 @@
 from agents import Agent
-from ai_agent.tools.profit_margin import calculate_profit_marginn
+from ai_agent.tools.profit_margin import calculate_profit_marginn, calculate_profit_margins
 from ai_agent.models.agent_output_model import SimplifiedAnalysisReport, FinalOutput
 
 agent = Agent(
@@ -17,7 +17,7 @@ agent = Agent(
     
 
     2. `total_units_sold`: 
-    - Sum all `quantity` fields from `delivered_orders`.
+    - Use `product_details.order_summary.total_units`.
 
     3. `total_units_returned`: 
     - Use `product_details.total_returns`.
@@ -41,8 +41,9 @@ agent = Agent(
     - Sum all numeric fields in `user.fixed_costs`.
 
     10. `order_details`:
-    - Extract all price-quantity pairs from `delivered_orders` and format them as a list of dictionaries.
-    - This is important because some orders have discounts and different prices.
+    - Pass every group of `product_details.order_summary.price_groups` with its `price`, `quantity` and `discount`.
+    - Each group holds all the orders sold at one price, some of them discounted, so do not add or merge groups.
+    - `order_summary.monthly_series` gives the units and revenue of the last months, use it for trends only.
 
 
     First, explicitly show your calculations for each of these input values with explanations.
@@ -63,16 +64,55 @@ agent = Agent(
 
     Make sure to:
     1. Double-check all calculations
-    2. Account for ALL orders in delivered_orders
+    2. Account for ALL price groups in order_summary
     4. Use 'DA' as price currency in all price fields in the report
     5. Include the exact numerical values you're passing to the calculate_profit_margin function
 
 
     Make sure all insights refer to the actual values shown in the calculation results.
+
+    If `financial_data` holds several products, compute all their margins with one call to the
+    `calculate_profit_margins` tool instead of one `calculate_profit_margin` call per product:
+    pass the products' values as lists in the same order, and their price groups as the
+    parallel lists `order_product_ids`, `order_prices` and `order_quantities`.
     """,
 
     #model="gpt-4o-mini",
-    tools=[calculate_profit_marginn],
+    tools=[calculate_profit_marginn, calculate_profit_margins],
     output_type=FinalOutput
 )
 
+
+# Variant for the runs whose calculation was done in Python before the run (see agents_runners):
+# it gets the tool's inputs and results in its input and only writes the report, in a single model turn
+precomputed_agent = agent.clone(
+    name="Margin Analysis Agent (precomputed)",
+
+    instructions="""
+    You're a profit margin analysis agent.
+
+    Your input holds the `financial_data` of a product and its `margin_calculation`, already computed:
+    - `margin_calculation.inputs`: the inputs of the calculation (selling price, units sold and returned,
+      per unit costs, fixed cost total and the order details)
+    - the results: `total_revenue`, `total_costs`, `total_profit`, `profit_margin`, `fixed_cost_per_unit`
+      and `return_rate`
+
+    Always remember : The prices unit is 'DA'. Do not recompute or change these values, use them as they are.
+
+    Create a SimplifiedAnalysisReport with:
+    - `calculation_inputs`: Create a CalculationInputs object with the values of `margin_calculation.inputs`
+    - `calculation_results`: Create a CalculationResults object with the results of `margin_calculation`
+    - `margin_insights`: 2-3 insights about the profit margin
+    - `cost_insights`: 2-3 insights about the cost structure
+    - `recommendation_insights`: 2-3 actionable recommendations
+
+    Then create a FinalOutput dictionary with:
+    - `report`: The SimplifiedAnalysisReport you created
+    - `flag`: Set to "ALERT" if profit margin < 15%, otherwise "OKAY"
+
+    Use 'DA' as price currency in all price fields in the report, and make sure all insights refer
+    to the actual values of the calculation.
+    """,
+
+    tools=[],
+)
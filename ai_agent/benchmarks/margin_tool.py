@@ -0,0 +1,105 @@
+"""
+Benchmark of the margin tools: the per-product calculate_profit_marginn loop against the
+vectorized calculate_profit_margins, on the same random orders.
+
+Run from the repository root:
+    python -m ai_agent.benchmarks.margin_tool --orders 1000000 --products 1000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from backend.products.margin import calculate_margin
+from ai_agent.tools.margin_batch import calculate_margins
+from ai_agent.tools.profit_margin import OrderDetail
+
+
+def make_data(orders, products, seed):
+    rng = np.random.default_rng(seed)
+    return {
+        "product_ids": [str(i) for i in range(products)],
+        "order_product_ids": rng.integers(0, products, orders).astype(str),
+        "order_prices": np.round(rng.uniform(500, 5000, orders), 2),
+        "order_quantities": rng.integers(1, 5, orders).astype(np.float64),
+        "total_units_returned": rng.integers(0, 50, products),
+        "product_cost_per_unit": np.round(rng.uniform(100, 2000, products), 2),
+        "packaging_cost_per_unit": np.full(products, 50.0),
+        "confirmation_fees_per_unit": np.full(products, 100.0),
+        "marketing_cost_per_unit": np.round(rng.uniform(0, 300, products), 2),
+        "return_cost_per_unit": np.full(products, 400.0),
+        "fixed_cost_total": 100000.0,
+    }
+
+
+def per_object_loop(data):
+    """
+    What the agent does today: one calculate_profit_marginn call per product, on OrderDetail objects.
+    """
+    orders = {product_id: [] for product_id in data["product_ids"]}
+    for product_id, price, quantity in zip(
+        data["order_product_ids"].tolist(), data["order_prices"].tolist(), data["order_quantities"].tolist()
+    ):
+        orders[product_id].append(OrderDetail(price=price, quantity=quantity))
+
+    rows = []
+    for i, product_id in enumerate(data["product_ids"]):
+        order_details = orders[product_id]
+        result = calculate_margin(
+            selling_price=0,
+            total_units_sold=sum(order.quantity for order in order_details),
+            total_units_returned=data["total_units_returned"][i],
+            product_cost_per_unit=data["product_cost_per_unit"][i],
+            packaging_cost_per_unit=data["packaging_cost_per_unit"][i],
+            confirmation_fees_per_unit=data["confirmation_fees_per_unit"][i],
+            marketing_cost_per_unit=data["marketing_cost_per_unit"][i],
+            return_cost_per_unit=data["return_cost_per_unit"][i],
+            fixed_cost_total=data["fixed_cost_total"],
+            order_details=[(order.price, order.quantity) for order in order_details],
+        )
+        rows.append([float(result[column]) for column in ("total_revenue", "total_costs", "profit_margin")])
+    return rows
+
+
+def vectorized(data):
+    table = calculate_margins(**data)
+    columns = [table["columns"].index(column) for column in ("total_revenue", "total_costs", "profit_margin")]
+    return [[row[column] for column in columns] for row in table["rows"]]
+
+
+def measure(function, data, repeat):
+    """
+    Return the best time of ``repeat`` runs, and the result of the last one.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1_000_000, help="Number of orders")
+    parser.add_argument("--products", type=int, default=1_000, help="Number of products the orders belong to")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each case, the best is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = make_data(args.orders, args.products, args.seed)
+    loop_time, loop_rows = measure(per_object_loop, data, args.repeat)
+    vector_time, vector_rows = measure(vectorized, data, args.repeat)
+
+    print(f"{args.orders} orders of {args.products} products:")
+    print(f"    Per-object loop: {loop_time * 1000:.1f} ms")
+    print(f"    Vectorized:      {vector_time * 1000:.1f} ms ({loop_time / vector_time:.1f}x faster)")
+    # Floats against Decimals rounded to the hundredth
+    difference = np.abs(np.array(loop_rows) - np.array(vector_rows)).max() if loop_rows else 0.0
+    print(f"    Max difference:  {difference:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,212 @@
+import asyncio
+import os
+import time
+
 from fastapi import APIRouter, Request
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from ai_agent.runners.agents_runners import profit_recomm_forcast_agent_run
 from ai_agent.runners.agents_runners import tracking_costs_calculating_margin_agent_run
-import json
+from ai_agent.runners.agents_runners import profit_recomm_forcast_agent_run_streamed
+from ai_agent.runners.agents_runners import tracking_costs_calculating_margin_agent_run_streamed
+from ai_agent.utils.response_cache import get_response_cache
+from ai_agent.utils.single_flight import canonical_json
+from ai_agent.utils.streaming import sse_event, stream_run_events
+import orjson
+
+# Number of products of a batch analysed at the same time, to stay within the LLM rate limits
+BATCH_CONCURRENCY = int(os.getenv("AGENT_BATCH_CONCURRENCY", "4"))
+
+# Responses are serialized with orjson instead of the stdlib json module
+router = APIRouter(default_response_class=ORJSONResponse)
+
 
-router = APIRouter()
+async def read_json(request: Request):
+    """
+    Parse the request body with orjson, which is faster than request.json().
+    """
+    return orjson.loads(await request.body())
 
 
 @router.post("/agents/profit-margin-recommendation-forcast-agent")
 async def profit_margin_recomm_forcast_agent(request: Request):
     
-    data = await request.json()
+    data = await read_json(request)
     analysis_report = data.get("report")
 
     if not analysis_report:
         return {"status": "ERROR", "message": "Missing 'report' in request body."}
 
-    result = await profit_recomm_forcast_agent_run(analysis_report)
+    result, meta = await profit_recomm_forcast_agent_run(analysis_report)
 
     result_json = jsonable_encoder(result)
     
-    return {"status": "OK", "data": result_json}
+    return {"status": "OK", "data": result_json, "meta": meta}
 
 
 @router.post("/agents/profit-margin-analysis")
 async def profit_margin_analysis_agent(request: Request):
     try:
 
-        data= await request.json()
+        data = await read_json(request)
         financial_data = data.get("financial_data")
 
         if not financial_data:
             return {"status": "ERROR", "message" : "Missing 'financial data' in request body."}
         
-        financial_data_json_str = json.dumps(financial_data)
+        financial_data_json_str = canonical_json(financial_data)
         
         
-        result = await tracking_costs_calculating_margin_agent_run(financial_data_json_str)
+        result, meta = await tracking_costs_calculating_margin_agent_run(financial_data_json_str)
 
-        return {"status" : "OK", "data": result}
+        return {"status" : "OK", "data": result, "meta": meta}
     
     except Exception as e:
         return {"status": "ERROR", "message": str(e)}
+
+
+# Streaming variants: the same input, but the progress of the run is sent as Server-Sent Events,
+# see ai_agent/utils/streaming.py. Proxies must not buffer the response.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_error(message):
+    async def events():
+        yield sse_event("error", {"status": "ERROR", "message": message})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/agents/profit-margin-recommendation-forcast-agent/stream")
+async def profit_margin_recomm_forcast_agent_stream(request: Request):
+
+    data = await read_json(request)
+    analysis_report = data.get("report")
+
+    if not analysis_report:
+        return sse_error("Missing 'report' in request body.")
+
+    result = profit_recomm_forcast_agent_run_streamed(analysis_report)
+
+    return StreamingResponse(stream_run_events(result), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/agents/profit-margin-analysis/stream")
+async def profit_margin_analysis_agent_stream(request: Request):
+
+    data = await read_json(request)
+    financial_data = data.get("financial_data")
+
+    if not financial_data:
+        return sse_error("Missing 'financial data' in request body.")
+
+    result, calculation = tracking_costs_calculating_margin_agent_run_streamed(canonical_json(financial_data))
+
+    return StreamingResponse(
+        stream_run_events(result, calculation), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+async def margin_report(financial_data):
+    """
+    Run the margin analysis agent, then the recommendation agent on its report, in-process.
+
+    Returns both reports shaped like the responses of the two endpoints above, and the duration of
+    each stage in milliseconds. The FinalOutput of the analysis is encoded once, as the input of the
+    recommendation agent, instead of going through an HTTP response and request. It is encoded with
+    canonical_json, as the report the backend sends to the recommendation endpoint ends up, so both
+    paths share their runs and cached outputs.
+    """
+    started = time.perf_counter()
+    financial_data_json_str = canonical_json(financial_data)
+    analysis, meta_1 = await tracking_costs_calculating_margin_agent_run(financial_data_json_str)
+    report_1 = jsonable_encoder({"status": "OK", "data": analysis})
+    analysed = time.perf_counter()
+
+    recommendations, meta_2 = await profit_recomm_forcast_agent_run(canonical_json(report_1))
+    report_2 = {"status": "OK", "data": jsonable_encoder(recommendations), "meta": meta_2}
+    finished = time.perf_counter()
+
+    return {
+        "report_1": {**report_1, "meta": meta_1},
+        "report_2": report_2,
+        "timings": {
+            "analysis_ms": round((analysed - started) * 1000),
+            "recommendation_ms": round((finished - analysed) * 1000),
+            "total_ms": round((finished - started) * 1000),
+        },
+    }
+
+
+@router.post("/agents/pipeline")
+async def profit_margin_pipeline(request: Request):
+    """
+    Run both agents on the financial data of a product in one request.
+
+    The body is {"financial_data": {...}}, as for the analysis endpoint. The response is
+    {"status": "OK", "report_1": ..., "report_2": ..., "timings": {"analysis_ms", "recommendation_ms", "total_ms"}}
+    where the reports are the bodies the analysis and recommendation endpoints return.
+    """
+    try:
+        data = await read_json(request)
+        financial_data = data.get("financial_data")
+
+        if not financial_data:
+            return {"status": "ERROR", "message": "Missing 'financial data' in request body."}
+
+        return {"status": "OK", **(await margin_report(financial_data))}
+
+    except Exception as e:
+        return {"status": "ERROR", "message": str(e)}
+
+
+@router.get("/agents/cache")
+async def agent_cache_stats():
+    """
+    Hit counters of the agent response cache: memory and disk hits, misses, the hit rate and the
+    number of entries.
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return {"status": "ERROR", "message": "The agent response cache is disabled."}
+    return {"status": "OK", "data": response_cache.metrics()}
+
+
+@router.post("/agents/profit-margin-report/batch")
+async def profit_margin_report_batch(request: Request):
+    """
+    Run both agents on a batch of financial data, BATCH_CONCURRENCY items at a time.
+
+    The body is {"items": [{"id": ..., "financial_data": {...}}, ...]}. The response is streamed as
+    newline-delimited JSON, one line per item as soon as it completes:
+    {"id": ..., "status": "OK", "report_1": ..., "report_2": ..., "timings": ...} or {"id": ..., "status": "ERROR", "message": ...}
+    """
+    data = await read_json(request)
+    items = data.get("items")
+
+    if not items or not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return {"status": "ERROR", "message": "Missing 'items' in request body."}
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(item):
+        async with semaphore:
+            try:
+                financial_data = item.get("financial_data")
+                if not financial_data:
+                    return {"id": item.get("id"), "status": "ERROR", "message": "Missing 'financial data' in item."}
+                return {"id": item.get("id"), "status": "OK", **(await margin_report(financial_data))}
+            except Exception as e:
+                return {"id": item.get("id"), "status": "ERROR", "message": str(e)}
+
+    async def results():
+        tasks = [asyncio.create_task(run(item)) for item in items]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield orjson.dumps(await task) + b"\n"
+        finally:
+            # The client went away: stop the agent runs still queued or in progress
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
@@ -1,26 +1,149 @@
+import os
+import time
+
+import orjson
 from agents import Runner
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
 from ai_agent.ai_agents.profit_margin_recommendation_forcast_agent import profit_margin_recommendation_forcast_agent
-from ai_agent.ai_agents.tracking_costs_calculating_margin_agent import agent
+from ai_agent.ai_agents.tracking_costs_calculating_margin_agent import agent, precomputed_agent
+from ai_agent.utils.response_cache import get_response_cache
+from ai_agent.utils.single_flight import agent_runs, canonical_input, canonical_json
+from backend.products.margin import convert_numbers, product_margin
+
+# Compute the margin tool's inputs and results in Python before the margin agent runs, so that it
+# writes its report in one model turn instead of deriving the inputs and calling the tool first
+PRECOMPUTE_MARGIN = os.getenv("AGENT_PRECOMPUTE_MARGIN", "1") != "0"
+
+
+def run_meta(result, started: float):
+    """
+    Describe a finished run: the model, the tokens used by all its LLM requests and its duration.
+
+    Args:
+        result: The RunResult (or RunResultStreaming once consumed)
+        started: time.perf_counter() when the run started
+    """
+    usage = result.context_wrapper.usage
+    model = result.last_agent.model
+    return {
+        "model": model if isinstance(model, str) or model is None else getattr(model, "model", str(model)),
+        "usage": {
+            "requests": usage.requests,
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "total_tokens": usage.total_tokens,
+        },
+        "latency_ms": round((time.perf_counter() - started) * 1000),
+    }
+
+
+def margin_agent_input(financial_data: str, precompute: bool):
+    """
+    Choose the margin agent and its input.
+
+    Args:
+        financial_data: The financial data, as a JSON string
+        precompute: Whether to compute the margin in Python and give it to the agent
+
+    Returns:
+        (agent, input, calculation): the calculation (inputs and results of the margin tool, as
+        floats) is None when it was not precomputed, in which case the agent calls the tool itself.
+        That is also the case when the financial data is not in the form the backend sends.
+    """
+    if not precompute:
+        return agent, financial_data, None
+    try:
+        data = orjson.loads(financial_data)
+        calculation = convert_numbers(product_margin(data), float)
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        return agent, financial_data, None
+    agent_input = canonical_json({"financial_data": data, "margin_calculation": calculation})
+    return precomputed_agent, agent_input, calculation
+
+
+async def run_agent(agent_to_run, agent_input: str):
+    """
+    Run an agent, unless its output for the same input is in the response cache (see get_response_cache).
+
+    A cached output is parsed back into the agent's output type (FinalOutput or RecommendationOutput)
+    without calling the model. Its run metadata then has "cached": true and no token usage.
+
+    Returns:
+        The final output from the agent, and the run metadata (see run_meta)
+    """
+    started = time.perf_counter()
+    response_cache = get_response_cache()
+    key = response_cache.key(agent_to_run, agent_input) if response_cache is not None else None
+    cached = await response_cache.aget(key) if key is not None else None
+    if cached is not None:
+        meta = {
+            "model": cached["meta"]["model"],
+            "usage": {name: 0 for name in cached["meta"]["usage"]},
+            "latency_ms": round((time.perf_counter() - started) * 1000),
+            "cached": True,
+        }
+        return TypeAdapter(agent_to_run.output_type).validate_python(cached["output"]), meta
+
+    result = await Runner.run(agent_to_run, agent_input)
+    meta = run_meta(result, started)
+    if key is not None:
+        await response_cache.aset(key, {"output": jsonable_encoder(result.final_output), "meta": meta})
+    return result.final_output, meta
+
 
 async def profit_recomm_forcast_agent_run(report: str):
-    result = await Runner.run(profit_margin_recommendation_forcast_agent, report)
+    """
+    Concurrent calls with the same report share one run (see agent_runs), and outputs are
+    cached (see run_agent). A JSON report is serialized again with canonical_json first, so
+    the same report gets the same key however the caller serialized it.
 
-    return result.final_output
+    Returns:
+        The final output from the agent, and the run metadata (see run_meta)
+    """
+    report = canonical_input(report)
 
-async def tracking_costs_calculating_margin_agent_run(financial_data):
+    async def run():
+        return await run_agent(profit_margin_recommendation_forcast_agent, report)
+
+    return await agent_runs.do(agent_runs.key(profit_margin_recommendation_forcast_agent.name, report), run)
+
+async def tracking_costs_calculating_margin_agent_run(financial_data, precompute: bool = PRECOMPUTE_MARGIN):
     """
     Run the margin calculation agent with the provided financial data.
     
     Args:
         agent: The margin calculation agent
         financial_data: Dictionary containing financial data structure
+        precompute: Give the agent the margin computed in Python, see margin_agent_input
         
+    Concurrent calls with the same financial data share one run (see agent_runs), and outputs
+    are cached (see run_agent).
+
     Returns:
-        The final output from the agent
+        The final output from the agent, and the run metadata (see run_meta)
     """
-    result = await Runner.run(
-        agent, 
-       financial_data
-    )
-    
-    return result.final_output
\ No newline at end of file
+    margin_agent, agent_input, _ = margin_agent_input(financial_data, precompute)
+
+    async def run():
+        return await run_agent(margin_agent, agent_input)
+
+    return await agent_runs.do(agent_runs.key(margin_agent.name, agent_input), run)
+
+
+def profit_recomm_forcast_agent_run_streamed(report: str):
+    """
+    Start the recommendation agent in streaming mode; the events are read from the returned result.
+    """
+    return Runner.run_streamed(profit_margin_recommendation_forcast_agent, canonical_input(report))
+
+
+def tracking_costs_calculating_margin_agent_run_streamed(financial_data, precompute: bool = PRECOMPUTE_MARGIN):
+    """
+    Start the margin calculation agent in streaming mode; the events are read from the returned result.
+
+    Returns:
+        The streamed result, and the precomputed calculation or None (see margin_agent_input)
+    """
+    margin_agent, agent_input, calculation = margin_agent_input(financial_data, precompute)
+    return Runner.run_streamed(margin_agent, agent_input), calculation
@@ -0,0 +1,335 @@
+"""
+Tests of the agent service helpers which do not need the agents SDK.
+
+Run from the repository root:
+    python -m unittest ai_agent.tests
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+from decimal import Decimal
+from unittest import IsolatedAsyncioTestCase, TestCase, mock, skipUnless
+
+from ai_agent.utils import response_cache
+from ai_agent.utils.response_cache import ResponseCache, get_response_cache
+from ai_agent.utils.single_flight import SingleFlight, canonical_input, canonical_json
+from backend.products.margin import calculate_margin
+
+try:
+    import numpy
+except ImportError:  # The margin tools need NumPy, the margin engine does not
+    numpy = None
+
+if numpy is not None:
+    from ai_agent.tools.margin_batch import COLUMNS, calculate_margins
+
+
+class CanonicalJsonTests(TestCase):
+    report = {"summary": "Marge nette réduite", "profit_margin": 12.5, "costs": {"total": 1e16, "fixed": 3000}}
+
+    def test_canonical_json(self):
+        self.assertEqual(
+            canonical_json(self.report),
+            '{"costs":{"fixed":3000,"total":1e16},"profit_margin":12.5,"summary":"Marge nette réduite"}',
+        )
+
+    def test_canonical_input(self):
+        # The backend sends the report with the stdlib json module, the pipeline passes it in-process
+        backend_report = json.dumps(self.report, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        self.assertEqual(canonical_input(backend_report), canonical_json(self.report))
+        self.assertEqual(canonical_input(json.dumps(self.report, indent=2)), canonical_json(self.report))
+        self.assertEqual(canonical_input("Not a JSON report"), "Not a JSON report")
+
+
+class SingleFlightTests(IsolatedAsyncioTestCase):
+    async def test_concurrent_identical_runs(self):
+        flights = SingleFlight()
+        started = []
+        release = asyncio.Event()
+
+        async def run(report):
+            started.append(report)
+            await release.wait()
+            return {"report": report}
+
+        key = SingleFlight.key("agent", canonical_json({"b": 1, "a": 2}))
+        same_key = SingleFlight.key("agent", canonical_input('{"a": 2, "b": 1}'))
+        other_key = SingleFlight.key("agent", canonical_json({"a": 3}))
+        tasks = [
+            asyncio.ensure_future(flights.do(key, lambda: run("first"))),
+            asyncio.ensure_future(flights.do(same_key, lambda: run("second"))),
+            asyncio.ensure_future(flights.do(other_key, lambda: run("other"))),
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        self.assertEqual(started, ["first", "other"])
+        self.assertEqual(results, [{"report": "first"}, {"report": "first"}, {"report": "other"}])
+        self.assertEqual(flights.shared, 1)
+        self.assertEqual(flights.runs, {})
+
+    async def test_cancelled_caller(self):
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def run():
+            await release.wait()
+            return "done"
+
+        first = asyncio.ensure_future(flights.do("key", run))
+        second = asyncio.ensure_future(flights.do("key", run))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+
+        self.assertEqual(await second, "done")
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+
+    async def test_failed_run(self):
+        flights = SingleFlight()
+
+        async def run():
+            raise RuntimeError("Agent run failed")
+
+        with self.assertRaises(RuntimeError):
+            await flights.do("key", run)
+        # A failed run is not kept, the next caller runs the agent again
+        self.assertEqual(flights.runs, {})
+
+
+def margin_batch_data(products, orders, seed=0):
+    """
+    Random orders of ``products`` products, in the columns calculate_margins takes.
+    """
+    rng = random.Random(seed)
+    product_ids = [f"product-{i}" for i in range(products)]
+    return {
+        "product_ids": product_ids,
+        "order_product_ids": [rng.choice(product_ids) for _ in range(orders)],
+        "order_prices": [rng.randint(50000, 500000) / 100 for _ in range(orders)],
+        "order_quantities": [rng.randint(1, 5) for _ in range(orders)],
+        "total_units_returned": [rng.randint(0, 20) for _ in range(products)],
+        "product_cost_per_unit": [rng.randint(10000, 200000) / 100 for _ in range(products)],
+        "packaging_cost_per_unit": [50.0] * products,
+        "confirmation_fees_per_unit": [100.0] * products,
+        "marketing_cost_per_unit": [rng.randint(0, 30000) / 100 for _ in range(products)],
+        "return_cost_per_unit": [400.0] * products,
+        "fixed_cost_total": [rng.randint(0, 10000000) / 100 for _ in range(products)],
+    }
+
+
+@skipUnless(numpy, "NumPy is not installed")
+class MarginBatchTests(TestCase):
+    def assert_margin_parity(self, data):
+        """
+        Compare every row of calculate_margins to calculate_margin run on the orders of its product.
+        """
+        table = calculate_margins(**data)
+        self.assertEqual(table["columns"], list(COLUMNS))
+        self.assertEqual([row[0] for row in table["rows"]], list(data["product_ids"]))
+
+        for i, row in enumerate(table["rows"]):
+            product_id = data["product_ids"][i]
+            order_details = [
+                (price, quantity)
+                for order_product_id, price, quantity in zip(
+                    data["order_product_ids"], data["order_prices"], data["order_quantities"]
+                )
+                if order_product_id == product_id
+            ]
+            expected = calculate_margin(
+                selling_price=0,
+                total_units_sold=sum(quantity for _, quantity in order_details),
+                total_units_returned=data["total_units_returned"][i],
+                product_cost_per_unit=data["product_cost_per_unit"][i],
+                packaging_cost_per_unit=data["packaging_cost_per_unit"][i],
+                confirmation_fees_per_unit=data["confirmation_fees_per_unit"][i],
+                marketing_cost_per_unit=data["marketing_cost_per_unit"][i],
+                return_cost_per_unit=data["return_cost_per_unit"][i],
+                fixed_cost_total=data["fixed_cost_total"][i],
+                order_details=order_details,
+            )
+            result = dict(zip(COLUMNS, row))
+            self.assertEqual(result["total_units_sold"], expected["inputs"]["total_units_sold"])
+            self.assertEqual(result["total_units_returned"], expected["inputs"]["total_units_returned"])
+            for column in COLUMNS[3:]:
+                # Floats against Decimals, both rounded to the hundredth: at most a cent apart on half cents
+                difference = abs(Decimal(str(result[column])) - expected[column])
+                self.assertLessEqual(difference, Decimal("0.01"), f"{column} of {product_id}")
+
+    def test_parity(self):
+        self.assert_margin_parity(margin_batch_data(products=50, orders=5000))
+
+    def test_unknown_product_ids(self):
+        data = margin_batch_data(products=3, orders=30)
+        data["order_product_ids"][:10] = ["unknown"] * 10
+        self.assert_margin_parity(data)
+
+        only_unknown = calculate_margins(**{**data, "order_product_ids": ["unknown"] * 30})
+        self.assertEqual([row[1] for row in only_unknown["rows"]], [0, 0, 0])
+        self.assertEqual([row[3] for row in only_unknown["rows"]], [0.0, 0.0, 0.0])
+
+    def test_empty_orders(self):
+        data = margin_batch_data(products=3, orders=0)
+        self.assert_margin_parity(data)
+        table = calculate_margins(**data)
+        result = dict(zip(COLUMNS, table["rows"][0]))
+        self.assertEqual(result["total_profit"], -result["total_costs"])
+        self.assertEqual((result["profit_margin"], result["fixed_cost_per_unit"], result["return_rate"]), (0, 0, 0))
+
+        self.assertEqual(calculate_margins(**margin_batch_data(products=0, orders=0))["rows"], [])
+
+    def test_zero_units_sold(self):
+        # The second product has returns but no orders
+        data = margin_batch_data(products=2, orders=10)
+        data["order_product_ids"] = ["product-0"] * 10
+        data["total_units_returned"] = [1, 5]
+        self.assert_margin_parity(data)
+        result = dict(zip(COLUMNS, calculate_margins(**data)["rows"][1]))
+        self.assertEqual((result["total_units_sold"], result["total_units_returned"]), (0, 5))
+        self.assertEqual((result["fixed_cost_per_unit"], result["return_rate"]), (0, 0))
+
+    def test_mismatched_lengths(self):
+        data = margin_batch_data(products=3, orders=10)
+        with self.assertRaises(ValueError):
+            calculate_margins(**{**data, "order_prices": data["order_prices"][:-1]})
+        with self.assertRaises(ValueError):
+            calculate_margins(**{**data, "order_quantities": data["order_quantities"] + [1]})
+        with self.assertRaises(ValueError):
+            calculate_margins(**{**data, "product_cost_per_unit": data["product_cost_per_unit"][:-1]})
+        # One fixed cost for all the products
+        self.assert_margin_parity({**data, "fixed_cost_total": [1000.0] * 3})
+        self.assertEqual(
+            calculate_margins(**{**data, "fixed_cost_total": 1000.0}),
+            calculate_margins(**{**data, "fixed_cost_total": [1000.0] * 3}),
+        )
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResponseCacheTests(IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "responses.sqlite3")
+        self.clock = FakeClock()
+
+    def make_cache(self, **kwargs):
+        cache = ResponseCache(**{"path": self.path, "ttl": 60, "clock": self.clock, **kwargs})
+        self.addCleanup(lambda: cache.db is not None and cache.db.close())
+        return cache
+
+    def test_lru(self):
+        cache = self.make_cache(path=None, memory_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        # "b" is the least recently used
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(
+            cache.metrics(),
+            {
+                "memory_hits": 3,
+                "disk_hits": 0,
+                "misses": 1,
+                "hit_rate": 0.75,
+                "memory_entries": 2,
+                "disk_entries": None,
+            },
+        )
+
+    def test_ttl(self):
+        cache = self.make_cache()
+        cache.set("a", {"output": "report"})
+        self.clock.now += 59
+        self.assertEqual(cache.get("a"), {"output": "report"})
+        self.clock.now += 1
+        self.assertIsNone(cache.get("a"))
+        # Expired on disk too
+        self.assertIsNone(self.make_cache().get("a"))
+
+        # Expired rows are deleted on the next writes
+        cache.set("b", 2)
+        self.assertEqual(cache.disk_entries, 1)
+        self.assertIsNone(self.make_cache(ttl=0).get("a"))
+
+    def test_persistence(self):
+        cache = self.make_cache()
+        cache.set("a", {"output": "report", "meta": {"model": "gpt"}})
+        self.clock.now += 30
+
+        restarted = self.make_cache()
+        self.assertEqual(restarted.get("a"), {"output": "report", "meta": {"model": "gpt"}})
+        self.assertEqual(restarted.get("a"), {"output": "report", "meta": {"model": "gpt"}})
+        self.assertEqual((restarted.stats["disk_hits"], restarted.stats["memory_hits"]), (1, 1))
+        # The entry keeps its age: it expires 60 seconds after it was first stored
+        self.clock.now += 30
+        self.assertIsNone(self.make_cache().get("a"))
+
+    def test_disk_size(self):
+        cache = self.make_cache(path=self.path, ttl=0, memory_size=1, disk_size=10)
+        for i in range(10):
+            cache.set(str(i), i)
+            self.clock.now += 1
+        cache.set("0", 0)
+        self.assertEqual(cache.disk_entries, 10)
+
+        # Over the limit, the oldest rows are deleted, a tenth more than the excess
+        self.clock.now += 1
+        cache.set("10", 10)
+        self.assertEqual(cache.disk_entries, 9)
+        with sqlite3.connect(self.path) as db:
+            keys = {key for (key,) in db.execute("SELECT key FROM responses")}
+        self.assertEqual(keys, {"0", *map(str, range(3, 11))})
+        restarted = self.make_cache(ttl=0)
+        self.assertIsNone(restarted.get("2"))
+        self.assertEqual(restarted.disk_entries, 9)
+
+    def test_lazy_database(self):
+        cache = self.make_cache()
+        self.assertFalse(os.path.exists(self.path))
+        cache.get("a")
+        self.assertTrue(os.path.exists(self.path))
+
+        with mock.patch.dict(os.environ, {"AGENT_CACHE_ENABLED": "1"}), mock.patch.object(
+            response_cache, "_response_cache", None
+        ):
+            os.environ.pop("AGENT_CACHE_PATH", None)
+            cache = get_response_cache()
+            self.assertIsNone(cache.path)
+            self.assertIs(get_response_cache(), cache)
+            with mock.patch.dict(os.environ, {"AGENT_CACHE_ENABLED": "0"}):
+                self.assertIsNone(get_response_cache())
+
+    def test_database_error(self):
+        cache = self.make_cache()
+        cache.set("a", 1)
+        cache.db.close()
+        cache.db = sqlite3.connect(":memory:", check_same_thread=False)
+
+        with self.assertLogs("ai_agent.utils.response_cache", "ERROR"):
+            cache.set("b", 2)
+        # The cache goes on in memory only
+        self.assertFalse(cache.disk_enabled)
+        self.assertIsNone(cache.db)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, 2, None))
+
+    async def test_async(self):
+        cache = self.make_cache(memory_size=1)
+        await cache.aset("a", 1)
+        await cache.aset("b", 2)
+        self.assertEqual((await cache.aget("b"), await cache.aget("a"), await cache.aget("c")), (2, 1, None))
+        self.assertEqual(cache.metrics()["disk_hits"], 1)
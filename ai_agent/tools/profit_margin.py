@@ -1,12 +1,15 @@
 import json
-from typing import Dict, List
+from typing import Dict, List, Union
 from agents import function_tool
 from pydantic import BaseModel
+from backend.products.margin import calculate_margin, convert_numbers
+from ai_agent.tools.margin_batch import calculate_margins
 
-# Define a model for order details
+# Define a model for order details: the orders at one price, see order_summary.price_groups
 class OrderDetail(BaseModel):
     price: float
     quantity: float
+    discount: bool = False
 
 @function_tool
 def calculate_profit_marginn(
@@ -35,63 +38,80 @@ def calculate_profit_marginn(
     - marketing_cost_per_unit: Marketing cost per unit.
     - fixed_cost_total: Total fixed cost (allocated once).
     - return_cost_per_unit: Return handling cost per unit returned.
-    - order_details: List of OrderDetail objects with price and quantity for each order.
+    - order_details: List of OrderDetail objects with the price and total quantity of each price group
+      (order_summary.price_groups), or of each order.
 
     Returns:
     - JSON string with input parameters, total_revenue, total_costs, total_profit, and profit_margin.
     """
-    # Revenue
-    total_units_sold_and_returned = total_units_sold + total_units_returned
-    total_revenue = sum(order.price * order.quantity for order in order_details)
-
-    # Total variable cost per unit
-    unit_variable_cost = (
-        product_cost_per_unit +
-        packaging_cost_per_unit +
-        confirmation_fees_per_unit +
-        marketing_cost_per_unit
+    # Same formulas as the backend, computed with Decimal by the shared margin engine
+    result = calculate_margin(
+        selling_price=selling_price,
+        total_units_sold=total_units_sold,
+        total_units_returned=total_units_returned,
+        product_cost_per_unit=product_cost_per_unit,
+        packaging_cost_per_unit=packaging_cost_per_unit,
+        confirmation_fees_per_unit=confirmation_fees_per_unit,
+        marketing_cost_per_unit=marketing_cost_per_unit,
+        return_cost_per_unit=return_cost_per_unit,
+        fixed_cost_total=fixed_cost_total,
+        order_details=[(order.price, order.quantity) for order in order_details],
     )
 
-    # Total costs
-    total_product_cost = unit_variable_cost * total_units_sold_and_returned
-    total_return_cost = return_cost_per_unit * total_units_returned
-    total_cost = (
-        total_product_cost +
-        fixed_cost_total +
-        total_return_cost
-    )
+    # Return inputs and calculated values
+    return json.dumps(convert_numbers(result, float))
 
-    # Profit & Margin
-    total_profit = total_revenue - total_cost
-    profit_margin = 100 * (total_profit / total_revenue) if total_revenue > 0 else 0
 
-    # Calculate fixed cost allocation per unit
-    fixed_cost_per_unit = fixed_cost_total / total_units_sold if total_units_sold > 0 else 0
-    
-    # Convert order details to dict for JSON serialization
-    order_details_dict = [{"price": order.price, "quantity": order.quantity} for order in order_details]
-    
-    # Return inputs and calculated values
-    return json.dumps({
+@function_tool
+def calculate_profit_margins(
+    product_ids: List[str],
+    order_product_ids: List[str],
+    order_prices: List[float],
+    order_quantities: List[float],
+    total_units_returned: List[int],
+    product_cost_per_unit: List[float],
+    packaging_cost_per_unit: List[float],
+    confirmation_fees_per_unit: List[float],
+    marketing_cost_per_unit: List[float],
+    return_cost_per_unit: List[float],
+    fixed_cost_total: Union[float, List[float]],
+) -> str:
+    """
+    Calculates the profit margin of many products in one call, from columnar arrays.
+
+    Parameters:
+    - product_ids: The products. The per-product lists below have one value per product, in this order.
+    - order_product_ids: Product of each order (or price group).
+    - order_prices: Price of each order.
+    - order_quantities: Quantity of each order.
+    - total_units_returned: Quantity returned, per product.
+    - product_cost_per_unit: Cost per unit of product, per product.
+    - packaging_cost_per_unit: Packaging cost per unit, per product.
+    - confirmation_fees_per_unit: Confirmation/transaction fees per unit, per product.
+    - marketing_cost_per_unit: Marketing cost per unit, per product.
+    - return_cost_per_unit: Return handling cost per unit returned, per product.
+    - fixed_cost_total: Total fixed cost of each product, or a single value for all of them.
 
-        "inputs": {
-            "selling_price": selling_price,
-            "total_units_sold": total_units_sold,
-            "total_units_returned": total_units_returned,
-            "product_cost_per_unit": product_cost_per_unit,
-            "packaging_cost_per_unit": packaging_cost_per_unit,
-            "confirmation_fees_per_unit": confirmation_fees_per_unit,
-            "marketing_cost_per_unit": marketing_cost_per_unit,
-            "return_cost_per_unit": return_cost_per_unit,
-            "fixed_cost_total": fixed_cost_total,
-            "order_details": order_details_dict
-        },
-        # Calculated results
-        "total_revenue": total_revenue,
-        "total_costs": total_cost,
-        "total_profit": total_profit,
-        "profit_margin": profit_margin,
-        "fixed_cost_per_unit": fixed_cost_per_unit,
-        "return_rate": 100 * (total_units_returned / total_units_sold_and_returned)  if total_units_sold > 0 else 0
-    })
+    Returns:
+    - JSON table {"columns": [...], "rows": [...]} with, per product, the units sold and returned,
+      total_revenue, total_costs, total_profit, profit_margin, fixed_cost_per_unit and return_rate.
+    """
+    try:
+        result = calculate_margins(
+            product_ids=product_ids,
+            order_product_ids=order_product_ids,
+            order_prices=order_prices,
+            order_quantities=order_quantities,
+            total_units_returned=total_units_returned,
+            product_cost_per_unit=product_cost_per_unit,
+            packaging_cost_per_unit=packaging_cost_per_unit,
+            confirmation_fees_per_unit=confirmation_fees_per_unit,
+            marketing_cost_per_unit=marketing_cost_per_unit,
+            return_cost_per_unit=return_cost_per_unit,
+            fixed_cost_total=fixed_cost_total,
+        )
+    except ValueError as e:
+        # Let the agent fix its call
+        return json.dumps({"error": str(e)})
 
+    return json.dumps(result)
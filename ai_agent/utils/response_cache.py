@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Cache of the outputs of agent runs, so that an identical prompt is not sent to the model again.
+
+    Entries are kept in an in-memory LRU in front of an optional SQLite database, which survives
+    restarts and is shared by the workers of the service. Both are bounded in number of entries,
+    and entries expire after ``ttl`` seconds.
+
+    The database is opened on first use, and read and written in a thread (see aget and aset) so
+    that its I/O does not block the event loop. If it fails, the error is logged and the cache
+    goes on in memory only.
+
+    Args:
+        path: SQLite database file, None to only cache in memory
+        ttl: Seconds an entry is served for, 0 for no expiry
+        memory_size: Number of entries of the in-memory LRU
+        disk_size: Number of entries kept in the database, the oldest are deleted first
+        clock: Wall clock, entries must expire across restarts
+    """
+
+    def __init__(self, path=None, ttl=86400, memory_size=256, disk_size=10000, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.clock = clock
+        self.memory = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        # The memory lock is only held for dict operations, the database lock around its I/O
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.db = None
+        self.disk_enabled = bool(path)
+        # Running count of the rows of the database, see store
+        self.disk_entries = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.getenv("AGENT_CACHE_PATH") or None,
+            ttl=float(os.getenv("AGENT_CACHE_TTL", "86400")),
+            memory_size=int(os.getenv("AGENT_CACHE_MEMORY_SIZE", "256")),
+            disk_size=int(os.getenv("AGENT_CACHE_DISK_SIZE", "10000")),
+        )
+
+    @staticmethod
+    def key(agent, agent_input: str) -> str:
+        """
+        Identify a run by the agent name, its model, a hash of its instructions and the input.
+        """
+        instructions = agent.instructions if isinstance(agent.instructions, str) else repr(agent.instructions)
+        parts = (
+            agent.name,
+            str(agent.model),
+            hashlib.sha256(instructions.encode()).hexdigest(),
+            agent_input,
+        )
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def expired(self, created_at):
+        return bool(self.ttl) and self.clock() - created_at >= self.ttl
+
+    def get(self, key):
+        """
+        Look up an entry, in memory then on disk.
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        found, value = self.recall(key)
+        if not found:
+            value = self.load(key)
+        return value
+
+    def set(self, key, value):
+        """
+        Store a JSON-serializable value.
+        """
+        created_at = self.clock()
+        with self.lock:
+            self.remember(key, value, created_at)
+        self.store(key, value, created_at)
+
+    async def aget(self, key):
+        """
+        Same as get, with the database read in a thread.
+        """
+        found, value = self.recall(key)
+        if not found:
+            value = await asyncio.to_thread(self.load, key)
+        return value
+
+    async def aset(self, key, value):
+        """
+        Same as set, with the database written in a thread.
+        """
+        created_at = self.clock()
+        with self.lock:
+            self.remember(key, value, created_at)
+        await asyncio.to_thread(self.store, key, value, created_at)
+
+    def recall(self, key):
+        """
+        Look up an entry in memory.
+
+        Returns:
+            (True, value) on a hit, (False, None) on a miss
+        """
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and self.expired(entry[1]):
+                del self.memory[key]
+                entry = None
+            if entry is None:
+                return False, None
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return True, entry[0]
+
+    def load(self, key):
+        """
+        Look up an entry in the database, after a miss in memory.
+        """
+        row = self.execute_db(
+            lambda db: db.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        )
+        with self.lock:
+            if row is not None and not self.expired(row[1]):
+                value = orjson.loads(row[0])
+                self.remember(key, value, row[1])
+                self.stats["disk_hits"] += 1
+                return value
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, key, value, created_at):
+        """
+        Write an entry to the database, and delete the expired entries and the oldest ones over disk_size.
+        """
+
+        def write(db):
+            # The running count spares a COUNT(*) of the table on every write
+            replaced = db.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+            db.execute(
+                "INSERT INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                (key, orjson.dumps(value), created_at),
+            )
+            self.disk_entries += 1 - replaced
+            if self.ttl:
+                expired = db.execute("DELETE FROM responses WHERE created_at <= ?", (created_at - self.ttl,))
+                self.disk_entries -= expired.rowcount
+            if self.disk_entries > self.disk_size:
+                # The other workers write to the database too: count its rows again, and delete a tenth
+                # more than the excess so that it is not counted again on the next writes
+                self.disk_entries = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                excess = self.disk_entries - self.disk_size
+                if excess > 0:
+                    deleted = db.execute(
+                        "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY created_at LIMIT ?)",
+                        (excess + self.disk_size // 10,),
+                    )
+                    self.disk_entries -= deleted.rowcount
+            db.commit()
+
+        self.execute_db(write)
+
+    def execute_db(self, operation):
+        """
+        Run operation(db) on the database, opened on first use.
+
+        Returns:
+            What operation returns, or None if the cache is in memory only or the database failed
+        """
+        if not self.disk_enabled:
+            return None
+        with self.db_lock:
+            if not self.disk_enabled:
+                return None
+            try:
+                if self.db is None:
+                    self.db = self.connect()
+                return operation(self.db)
+            except sqlite3.Error:
+                logger.exception("Agent response cache database %s failed, caching in memory only", self.path)
+                self.disk_enabled = False
+                if self.db is not None:
+                    self.db.close()
+                    self.db = None
+                return None
+
+    def connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+        db.commit()
+        self.disk_entries = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return db
+
+    def remember(self, key, value, created_at):
+        # In-memory LRU, the caller holds the lock
+        self.memory[key] = (value, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def metrics(self):
+        """
+        Return the hit counters and the hit rate of the cache.
+        """
+        with self.lock:
+            lookups = sum(self.stats.values())
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            return {
+                **self.stats,
+                "hit_rate": hits / lookups if lookups else None,
+                "memory_entries": len(self.memory),
+                "disk_entries": self.disk_entries if self.disk_enabled else None,
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the cache shared by the runners of the process, created on first use.
+
+    It is configured with the AGENT_CACHE_* environment variables: outputs are only persisted when
+    AGENT_CACHE_PATH names the SQLite database file, and AGENT_CACHE_ENABLED=0 disables the cache.
+
+    Returns:
+        ResponseCache, or None if the cache is disabled
+    """
+    global _response_cache
+    if os.getenv("AGENT_CACHE_ENABLED", "1") == "0":
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache.from_env()
+        return _response_cache
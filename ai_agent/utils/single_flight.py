@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+
+import orjson
+
+
+def canonical_json(value) -> str:
+    """
+    Serialize to JSON with sorted keys and no whitespace, so that equal data gives equal text.
+
+    Agent inputs are serialized with it wherever they are built, so that the same data gets the
+    same single-flight and response cache keys whichever endpoint it came through.
+    """
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode()
+
+
+def canonical_input(text: str) -> str:
+    """
+    Re-serialize a JSON agent input received as a string with canonical_json.
+
+    The backend sends Agent 1's report as a string serialized by the stdlib json module, whose
+    formatting differs from orjson's (e.g. of floats): it is parsed and serialized again, so the
+    two-hop path and the pipeline (which passes the report in-process) share their runs.
+    Text which is not JSON is returned unchanged.
+    """
+    try:
+        return canonical_json(orjson.loads(text))
+    except orjson.JSONDecodeError:
+        return text
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical agent runs: callers with the same key share one in-flight run.
+
+    The run is awaited through asyncio.shield, so a caller that goes away (e.g. a cancelled batch)
+    does not cancel the run the other callers are waiting for.
+
+    The runs in flight are only known to the event loop of one process: with several uvicorn
+    workers (--workers N), identical requests handled by different workers each run the agent.
+    The backend coalesces report requests across its processes with the ReportJob table, and the
+    response cache (see response_cache.py) is shared by the workers through its SQLite database
+    when AGENT_CACHE_PATH is set.
+    """
+
+    def __init__(self):
+        self.runs = {}
+        self.shared = 0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    async def do(self, key: str, run):
+        """
+        Await run() unless a run with the same key is in flight, in which case await that one.
+
+        Args:
+            key: Identifies the inputs of the run, see SingleFlight.key
+            run: Coroutine function starting the run
+        """
+        task = self.runs.get(key)
+        if task is None:
+            task = asyncio.ensure_future(run())
+            self.runs[key] = task
+            task.add_done_callback(lambda _: self.runs.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+# Shared by all the routes of the process
+agent_runs = SingleFlight()
@@ -0,0 +1,56 @@
+import time
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from openai.types.responses import ResponseTextDeltaEvent
+
+from ai_agent.runners.agents_runners import run_meta
+
+
+def sse_event(event: str, data) -> bytes:
+    """
+    Format one Server-Sent Event, with its data as a single line of JSON.
+    """
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(jsonable_encoder(data)) + b"\n\n"
+
+
+async def stream_run_events(result, calculation=None):
+    """
+    Turn the events of a streamed agent run (``Runner.run_streamed``) into Server-Sent Events.
+
+    Args:
+        result: The streamed run
+        calculation: The margin calculation given to the agent, if it was computed before the run
+
+    Events:
+        tool_call_started: {"tool": name} when the agent calls a tool
+        calculation_results: the output of the tool, e.g. the margin figures of calculate_profit_marginn,
+            or the precomputed calculation, sent first
+        partial_output: {"delta": text}, the output of the agent as it is generated (partial JSON)
+        final_output: {"status": "OK", "data": output, "meta": ...}, the same body as the non-streaming endpoint
+        error: {"status": "ERROR", "message": ...} if the run failed
+    """
+    started = time.perf_counter()
+    if calculation is not None:
+        yield sse_event("calculation_results", calculation)
+    try:
+        async for event in result.stream_events():
+            if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                yield sse_event("partial_output", {"delta": event.data.delta})
+            elif event.type == "run_item_stream_event":
+                item = event.item
+                if item.type == "tool_call_item":
+                    yield sse_event("tool_call_started", {"tool": getattr(item.raw_item, "name", None)})
+                elif item.type == "tool_call_output_item":
+                    output = item.output
+                    try:
+                        output = orjson.loads(output)
+                    except (TypeError, orjson.JSONDecodeError):
+                        pass
+                    yield sse_event("calculation_results", output)
+
+        yield sse_event(
+            "final_output", {"status": "OK", "data": result.final_output, "meta": run_meta(result, started)}
+        )
+    except Exception as e:
+        yield sse_event("error", {"status": "ERROR", "message": str(e)})
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Serve the product detail endpoint with its async view, see core/asgi_urls.py
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'core.asgi_urls')
 
 application = get_asgi_application()
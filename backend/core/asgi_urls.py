@@ -0,0 +1,17 @@
+"""
+URL configuration used when the project is served under ASGI (see core/asgi.py).
+
+Same as core.urls, except that the product detail endpoint is served by the
+async view, which does not hold a worker while the agent services respond.
+"""
+
+from django.urls import path
+
+from products.async_views import product_detail
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path("api/products/<int:pk>/", product_detail, name="products-detail-async"),
+    *sync_urlpatterns,
+]
@@ -0,0 +1,36 @@
+"""
+Request parsers used by all the API views.
+
+``ORJSONParser`` replaces DRF's ``JSONParser`` and falls back to it when orjson
+is not installed.
+"""
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from .renderers import ORJSONRenderer, orjson
+
+
+class ORJSONParser(JSONParser):
+    """
+    Parses JSON-serialized data with orjson.
+    """
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """
+        Parses the incoming bytestream as JSON and returns the resulting data.
+        """
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        # orjson only reads UTF-8, the encoding of JSON (RFC 8259); other charsets take the stdlib path
+        encoding = (parser_context or {}).get("encoding", "utf-8")
+        if encoding.lower().replace("_", "-") not in ("utf-8", "utf8"):
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -0,0 +1,108 @@
+"""
+Response renderers used by all the API views.
+
+``ORJSONRenderer`` replaces DRF's ``JSONRenderer``: orjson serializes the
+dicts, lists, strings and numbers of a response natively, several times faster
+than the stdlib ``json`` module. Everything else (datetimes, stray Decimals,
+UUIDs, lazy translations, ...) goes through DRF's own ``JSONEncoder.default``,
+so the output is the same as with ``JSONRenderer``. Serializer
+``DecimalField`` values are already strings (``COERCE_DECIMAL_TO_STRING``), so
+amounts never lose precision.
+
+``MessagePackRenderer`` is selected with ``Accept: application/msgpack`` and
+is only registered in the settings when ``msgpack`` is installed.
+
+``EventStreamRenderer`` lets views streaming Server-Sent Events be selected
+with ``Accept: text/event-stream``; the events themselves are written by the
+view with ``format_event``.
+
+Both optional dependencies are imported lazily: without orjson,
+``ORJSONRenderer`` falls back to ``JSONRenderer``.
+"""
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+
+# Values that neither orjson nor msgpack handle natively are converted the way DRF's JSONRenderer does
+encode_default = JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Renderer which serializes to JSON with orjson.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Render `data` into JSON, returning a bytestring.
+        """
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+
+        # Datetimes are passed through so that they are formatted like DRF does (e.g. "Z" for UTC). Non-string
+        # keys are converted to strings like json.dumps does, e.g. the indexes of the errors of a ListField
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        # orjson only supports an indent of 2, used for any requested indent
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        ret = orjson.dumps(data, default=encode_default, option=option)
+
+        # Like JSONRenderer, escape U+2028 and U+2029 so that the output is a strict javascript subset
+        return ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renderer which serializes to MessagePack.
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Render `data` into MessagePack, returning a bytestring.
+        """
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+def format_event(event, data):
+    """
+    Format one Server-Sent Event, with its data as a single line of JSON.
+    """
+    return b"event: " + event.encode() + b"\ndata: " + ORJSONRenderer().render(data) + b"\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renderer of the Server-Sent Events endpoints.
+
+    The events are streamed by the view; this renderer only handles the responses
+    the view returns before streaming (errors), which are sent as an "error" event.
+    """
+
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return format_event("error", data)
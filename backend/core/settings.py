@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import importlib.util
 import os
 from datetime import timedelta
 from pathlib import Path
@@ -41,6 +42,48 @@ ALLOWED_HOSTS = ["*"]
 AGENT1_SERVICE_URL = os.getenv("AGENT1_SERVICE_URL", "https://api.agent1.example.com/analyze")
 AGENT2_SERVICE_URL = os.getenv("AGENT2_SERVICE_URL", "https://api.agent2.example.com/report")
 
+# HTTP client of the agent services, see products/agent_client.py: keep-alive connections per service,
+# retries with exponential backoff (seconds) and circuit breaker (failed calls in a row, seconds open)
+AGENT_HTTP_POOL_SIZE = int(os.getenv("AGENT_HTTP_POOL_SIZE", "10"))
+AGENT_HTTP_RETRIES = int(os.getenv("AGENT_HTTP_RETRIES", "2"))
+AGENT_HTTP_BACKOFF = float(os.getenv("AGENT_HTTP_BACKOFF", "0.5"))
+AGENT_HTTP_BACKOFF_MAX = float(os.getenv("AGENT_HTTP_BACKOFF_MAX", "5"))
+AGENT_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("AGENT_CIRCUIT_FAILURE_THRESHOLD", "5"))
+AGENT_CIRCUIT_RESET_TIMEOUT = float(os.getenv("AGENT_CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Maximum number of products analysed by one request to the batch report endpoint
+AGENT_BATCH_MAX_PRODUCTS = int(os.getenv("AGENT_BATCH_MAX_PRODUCTS", "200"))
+
+# Number of delivered orders written per bulk_create by the bulk order endpoints
+ORDER_INGESTION_BATCH_SIZE = int(os.getenv("ORDER_INGESTION_BATCH_SIZE", "5000"))
+
+# Cache of the agent reports, keyed on a hash of the financial data they were computed from.
+# Any Django cache backend works, e.g. django.core.cache.backends.filebased.FileBasedCache with a
+# directory as location, or django.core.cache.backends.db.DatabaseCache with a table name as location
+# (create it with `manage.py createcachetable`). MAX_ENTRIES bounds the size of the locmem, file and
+# database backends, which evict entries beyond it.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "agent_reports": {
+        "BACKEND": os.getenv("AGENT_REPORT_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("AGENT_REPORT_CACHE_LOCATION", "agent-reports"),
+        "TIMEOUT": int(os.getenv("AGENT_REPORT_CACHE_TTL", str(24 * 60 * 60))),
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("AGENT_REPORT_CACHE_MAX_ENTRIES", "10000"))},
+    },
+}
+
+# How the background jobs generating the agent reports are run, see products/report_jobs.py:
+# "thread" (a pool of REPORT_JOB_WORKERS threads in the web process), "queue" (the run_report_jobs
+# management command) or "immediate" (in the request, for debugging)
+REPORT_JOB_BACKEND = os.getenv("REPORT_JOB_BACKEND", "thread")
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "4"))
+# A job still pending or running this long after its last update was lost (e.g. the web process running it
+# restarted): the next request for the same reports queues it again
+REPORT_JOB_STALE_AFTER = timedelta(minutes=int(os.getenv("REPORT_JOB_STALE_MINUTES", "15")))
+
+# Where the files uploaded to the catalog import endpoint are kept, so that failed imports can be resumed
+CATALOG_IMPORT_DIR = Path(os.getenv("CATALOG_IMPORT_DIR", BASE_DIR / "media" / "catalog_imports"))
+
 
 # Application definition
 
@@ -75,7 +118,8 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
-ROOT_URLCONF = "core.urls"
+# core/asgi.py switches to core.asgi_urls, which serves the product detail endpoint with an async view
+ROOT_URLCONF = os.getenv("DJANGO_ROOT_URLCONF", "core.urls")
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 # Optional: Allow cookies / sessions
@@ -173,8 +217,22 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": ("rest_framework_simplejwt.authentication.JWTAuthentication",),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "EXCEPTION_HANDLER": "core.exception_handler.global_exception_handler",
+    # JSON is rendered and parsed with orjson when it is installed, see core.renderers
+    "DEFAULT_RENDERER_CLASSES": [
+        "core.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "core.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
+# MessagePack responses (Accept: application/msgpack) are only offered when msgpack is installed
+if importlib.util.find_spec("msgpack"):
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"].insert(1, "core.renderers.MessagePackRenderer")
+
 # JWT Settings
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
@@ -199,4 +257,6 @@ SPECTACULAR_SETTINGS = {
     "DESCRIPTION": "API documentation for the project",
     "VERSION": "1.0.0",
     "SERVE_INCLUDE_SCHEMA": False,
+    # The report job status appears both in the product detail and in the report job
+    "ENUM_NAME_OVERRIDES": {"ReportStatusEnum": "products.models.ReportJob.STATUS_CHOICES"},
 }
@@ -1,6 +1,14 @@
 from django.contrib import admin
 
-from .models import DeliveredOrder, Product, ProductCost
+from .models import (
+    CatalogImport,
+    DeliveredOrder,
+    Product,
+    ProductCost,
+    ProductReport,
+    ProductSalesRollup,
+    ReportJob,
+)
 
 
 @admin.register(Product)
@@ -10,6 +18,10 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ("product_name", "product_description", "product_category")
     readonly_fields = ("created_at", "updated_at")
 
+    def get_queryset(self, request):
+        # Annotate has_product_costs to avoid one query per row in the changelist
+        return super().get_queryset(request).with_cost_flag()
+
 
 @admin.register(ProductCost)
 class ProductCostAdmin(admin.ModelAdmin):
@@ -24,3 +36,57 @@ class DeliveredOrderAdmin(admin.ModelAdmin):
     list_filter = ("discount", "created_at")
     search_fields = ("product__product_name",)
     readonly_fields = ("created_at",)
+
+    def delete_queryset(self, request, queryset):
+        # Bulk deletes bypass DeliveredOrder.delete, recompute the affected rollups instead
+        product_ids = set(queryset.values_list("product_id", flat=True))
+        super().delete_queryset(request, queryset)
+        ProductSalesRollup.rebuild(product_ids)
+
+
+@admin.register(ProductSalesRollup)
+class ProductSalesRollupAdmin(admin.ModelAdmin):
+    list_display = ("product", "units_sold", "revenue", "discounted_units", "order_count", "last_order_at")
+    search_fields = ("product__product_name",)
+    readonly_fields = (
+        "product",
+        "units_sold",
+        "revenue",
+        "discounted_units",
+        "discounted_revenue",
+        "order_count",
+        "first_order_at",
+        "last_order_at",
+        "updated_at",
+    )
+
+
+@admin.register(CatalogImport)
+class CatalogImportAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "user",
+        "status",
+        "products_done",
+        "product_costs_done",
+        "delivered_orders_done",
+        "updated_at",
+    )
+    list_filter = ("status",)
+    search_fields = ("user__username",)
+    readonly_fields = ("created_at", "updated_at")
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "product", "status", "created_at", "started_at", "finished_at")
+    list_filter = ("status",)
+    search_fields = ("product__product_name",)
+    readonly_fields = ("payload_key", "created_at", "started_at", "finished_at", "updated_at")
+
+
+@admin.register(ProductReport)
+class ProductReportAdmin(admin.ModelAdmin):
+    list_display = ("product", "version", "model_name", "total_tokens", "latency_ms", "created_at")
+    search_fields = ("product__product_name", "model_name")
+    readonly_fields = ("payload_key", "created_at")
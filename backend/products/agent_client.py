@@ -0,0 +1,397 @@
+"""
+HTTP client for the agent services.
+
+All the agent calls of a process go through one ``AgentClient``, which keeps:
+- a ``requests.Session`` with a pool of keep-alive connections per service
+  (``AGENT_HTTP_POOL_SIZE``), instead of a new connection per call
+- retries with exponential backoff and full jitter (``AGENT_HTTP_RETRIES``,
+  ``AGENT_HTTP_BACKOFF``, ``AGENT_HTTP_BACKOFF_MAX``) on connection errors
+  and 429/503 responses, i.e. when the service did not start working on the
+  request. Each request starts a paid LLM run which goes on after the client
+  gave up, so read timeouts, errors reading the response and other 5xx
+  responses are not retried.
+- a circuit breaker per service: after ``AGENT_CIRCUIT_FAILURE_THRESHOLD``
+  failed calls in a row, calls fail right away for
+  ``AGENT_CIRCUIT_RESET_TIMEOUT`` seconds, then a single trial call decides
+  whether the service is back. Calls answered 200 with a failed status in
+  the body (the agents report their errors this way) count as failures
+- single-flight coalescing of ``post`` calls: concurrent calls with the same
+  URL and body, e.g. the same product opened in several tabs, share one
+  request and its response
+- latency and outcome metrics per service, see ``AgentClient.metrics``
+
+Across processes, identical report requests are coalesced by the ReportJob
+table instead, which holds at most one queued or running job per product and
+financial data (see ``report_jobs.enqueue``).
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: the service refused the request as it is overloaded or restarting
+RETRY_STATUSES = {429, 503}
+
+# Status of the JSON body of a call that failed, although answered 200
+FAILED_BODY_STATUSES = {"ERROR", "failed"}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of calling a service whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one service.
+
+    Closed: calls go through, and consecutive failures are counted. Open: calls are
+    refused until ``reset_timeout`` seconds passed. Half-open: one trial call goes
+    through, and closes the circuit if it succeeds or opens it again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a call may be made now.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                # Let a single trial call through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time: the callers arriving while it runs wait for it
+    and get its result, or its exception.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """
+        Call ``function(*args)``, or wait for the call in flight with the same key.
+
+        Returns:
+            tuple: (result, shared) where shared tells whether the result came from another caller's call
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(function(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result(), False
+
+
+class AgentClient:
+    """
+    Pooled, retrying and circuit breaking client of the agent services.
+
+    Args:
+        pool_size (int): Number of keep-alive connections kept per service
+        retries (int): Number of retries after a failed attempt
+        backoff (float): Base of the exponential backoff, in seconds
+        backoff_max (float): Upper bound of a backoff delay, in seconds
+        failure_threshold (int): Number of failed calls in a row opening the circuit of a service
+        reset_timeout (float): Seconds before a trial call is let through an open circuit
+        timeout (float): Seconds to wait for each attempt
+        clock (callable): Monotonic clock of the circuit breakers
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        retries=2,
+        backoff=0.5,
+        backoff_max=5.0,
+        failure_threshold=5,
+        reset_timeout=30.0,
+        timeout=10,
+        clock=time.monotonic,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.clock = clock
+
+        self.session = requests.Session()
+        # Retries are handled by post(), which also counts them
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.breakers = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.flights = SingleFlight()
+
+    @classmethod
+    def from_settings(cls):
+        from .utils import AGENT_TIMEOUT
+
+        return cls(
+            pool_size=settings.AGENT_HTTP_POOL_SIZE,
+            retries=settings.AGENT_HTTP_RETRIES,
+            backoff=settings.AGENT_HTTP_BACKOFF,
+            backoff_max=settings.AGENT_HTTP_BACKOFF_MAX,
+            failure_threshold=settings.AGENT_CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=settings.AGENT_CIRCUIT_RESET_TIMEOUT,
+            timeout=AGENT_TIMEOUT,
+        )
+
+    def close(self):
+        self.session.close()
+
+    def service(self, url):
+        # Circuits and metrics are per service, i.e. per host
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def breaker(self, service):
+        with self.lock:
+            if service not in self.breakers:
+                self.breakers[service] = CircuitBreaker(self.failure_threshold, self.reset_timeout, self.clock)
+            return self.breakers[service]
+
+    def count(self, service, **increments):
+        with self.lock:
+            stats = self.stats.setdefault(
+                service,
+                {
+                    "calls": 0,
+                    "attempts": 0,
+                    "retries": 0,
+                    "failures": 0,
+                    "short_circuited": 0,
+                    "coalesced": 0,
+                    "latency": 0.0,
+                    "max_latency": 0.0,
+                },
+            )
+            for name, value in increments.items():
+                stats[name] += value
+            if "latency" in increments:
+                stats["max_latency"] = max(stats["max_latency"], increments["latency"])
+
+    def backoff_delay(self, attempt):
+        # Full jitter: spreads the retries of concurrent callers over the whole interval
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2**attempt))
+
+    def send(self, url, data, stream=False, timeout=None, decode=None):
+        """
+        POST a JSON body to an agent service, retrying the attempts the service did not start on.
+
+        Args:
+            url (str): The URL of the service
+            data (dict): The JSON body
+            stream (bool): Return as soon as the headers are received, leaving the body to be read
+            timeout (float or tuple, optional): Replaces the client's timeout for this call
+            decode (callable, optional): Decodes a successful response, a decoded body with a failed
+                status counts as a failure of the service
+
+        Returns:
+            requests.Response: The response of the last attempt, whose status was checked, or what
+                decode returned for it
+
+        Raises:
+            CircuitOpenError: If the circuit of the service is open
+            requests.exceptions.RequestException: If the last attempt failed
+            ValueError: If decode failed
+        """
+        service = self.service(url)
+        breaker = self.breaker(service)
+        if not breaker.allow():
+            self.count(service, short_circuited=1)
+            raise CircuitOpenError(f"Circuit open for {service}, not calling {url}")
+
+        self.count(service, calls=1)
+        response = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                if response is not None:
+                    # Give the connection back to the pool
+                    response.close()
+                time.sleep(self.backoff_delay(attempt - 1))
+                self.count(service, retries=1)
+            start = time.perf_counter()
+            error, response = None, None
+            try:
+                response = self.session.post(url, json=data, timeout=timeout or self.timeout, stream=stream)
+            except requests.exceptions.RequestException as e:
+                error = e
+            latency = time.perf_counter() - start
+            self.count(service, attempts=1, latency=latency)
+            logger.info("POST %s attempt %d: %s in %.3fs", url, attempt + 1, error or response.status_code, latency)
+            # Only the attempts which did not reach the service are retried. A read timeout means the request was
+            # sent: the agent run goes on, another one would be paid for. ConnectTimeout is a ConnectionError
+            if error is not None and not isinstance(error, requests.exceptions.ConnectionError):
+                break
+            if error is None and response.status_code not in RETRY_STATUSES:
+                break
+
+        # Client errors say nothing about the health of the service
+        failed = error is not None or response.status_code >= 500 or response.status_code in RETRY_STATUSES
+        result, decode_error = response, None
+        if not failed and response.ok and decode is not None:
+            try:
+                result = decode(response)
+            except (ValueError, requests.exceptions.RequestException) as e:
+                # Reading the body can fail too, e.g. with a ChunkedEncodingError
+                decode_error = e
+            failed = decode_error is not None or (
+                isinstance(result, dict) and result.get("status") in FAILED_BODY_STATUSES
+            )
+        if failed:
+            self.count(service, failures=1)
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        if error is not None:
+            raise error
+        response.raise_for_status()
+        if decode_error is not None:
+            raise decode_error
+        return result
+
+    def post(self, url, data):
+        """
+        POST a JSON body to an agent service and return the decoded JSON response.
+
+        A call made while an identical one (same URL and body) is in flight waits for it and
+        returns the same response instead of sending another request. A response whose status
+        is "ERROR" or "failed" counts as a failure of the service for its circuit breaker.
+
+        Raises:
+            CircuitOpenError: If the circuit of the service is open
+            requests.exceptions.RequestException: If the last attempt failed
+            ValueError: If the response is not JSON
+        """
+        body = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        key = hashlib.sha256(f"{url}\0{body}".encode()).hexdigest()
+        response, shared = self.flights.do(key, lambda: self.send(url, data, decode=requests.Response.json))
+        if shared:
+            self.count(self.service(url), coalesced=1)
+            # Each caller gets its own copy of the decoded response
+            response = copy.deepcopy(response)
+        return response
+
+    def post_lines(self, url, data, read_timeout=None):
+        """
+        POST a JSON body to an agent service and yield the lines of its response as they arrive.
+
+        Args:
+            read_timeout (float, optional): Seconds to wait for the next bytes of the body, unbounded by default
+
+        Raises:
+            The exceptions of ``send``, before the first line is yielded
+        """
+        response = self.send(url, data, stream=True, timeout=(self.timeout, read_timeout))
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield line
+
+    def metrics(self):
+        """
+        Return the metrics of each service called so far.
+
+        Returns:
+            dict: Per service: the calls, the attempts, retries, failed calls, calls refused by the
+                circuit breaker and calls coalesced with an identical one in flight, the mean and
+                max attempt latency in seconds and the circuit state
+        """
+        with self.lock:
+            services = {}
+            for service, stats in self.stats.items():
+                breaker = self.breakers.get(service)
+                services[service] = {
+                    **{name: value for name, value in stats.items() if name != "latency"},
+                    "mean_latency": stats["latency"] / stats["attempts"] if stats["attempts"] else None,
+                    "circuit": breaker.state if breaker else CircuitBreaker.CLOSED,
+                }
+            return services
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the client shared by the process, created from the settings on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AgentClient.from_settings()
+        return _client
+
+
+def reset_client():
+    """
+    Drop the shared client, e.g. after the settings changed.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
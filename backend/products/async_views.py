@@ -0,0 +1,102 @@
+"""
+Async version of the product detail endpoint, served when the API runs under ASGI.
+
+Under ASGI (see ``core/asgi.py``), ``GET /api/products/{id}/`` is routed to
+``product_detail`` instead of ``ProductViewSet.retrieve``: the database work
+runs in a thread through ``sync_to_async``, and the agent reports are looked
+up in the cache or queued as a background job (see ``report_jobs``), so the
+event loop never waits for the agents.
+
+The response is the same as the one of ``ProductViewSet.retrieve``, including
+the conditional GET validators.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from core.renderers import ORJSONRenderer
+
+from . import report_jobs
+from .conditional import add_validators, conditional_response, product_validators
+from .fast_serializers import product_rows, serialize_product_detail
+from .margin import margin_summary
+from .models import Product
+from .utils import agent_financial_data, order_summaries
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(ORJSONRenderer().render(data), status=status_code, content_type=ORJSONRenderer.media_type)
+
+
+def load_product_detail(request, pk):
+    """
+    Authenticate the request and load everything the detail response needs.
+
+    Runs in a thread, as the ORM and the JWT user lookup are synchronous.
+
+    Returns:
+        HttpResponse or dict: The response if the view must answer right away (error or 304), else
+            a dict with the product data, the report fields and cache status (see
+            ``report_jobs.report_fields``) and the validator headers
+    """
+    authentication = JWTAuthentication()
+    try:
+        user_auth = authentication.authenticate(request)
+    except APIException as exc:
+        response = json_response({"detail": exc.detail}, exc.status_code)
+        response["WWW-Authenticate"] = authentication.authenticate_header(request)
+        return response
+    if user_auth is None:
+        response = json_response(
+            {"detail": "Authentication credentials were not provided."}, status.HTTP_401_UNAUTHORIZED
+        )
+        response["WWW-Authenticate"] = authentication.authenticate_header(request)
+        return response
+    user = user_auth[0]
+
+    state = product_validators(user, pk)
+    if state is None:
+        return json_response({"detail": "Not found."}, status.HTTP_404_NOT_FOUND)
+    not_modified, headers = conditional_response(request, state)
+    if not_modified:
+        return not_modified
+
+    products = Product.objects.filter(user=user).with_financials().with_cost_flag()
+    row = product_rows(products, with_costs=True).filter(pk=pk).first()
+    if row is None:
+        return json_response({"detail": "Not found."}, status.HTTP_404_NOT_FOUND)
+
+    include_orders = request.GET.get("include_orders", "").lower() in ("1", "true", "yes")
+    product_data = serialize_product_detail(row, include_orders=include_orders)
+    financial_data = agent_financial_data(user, product_data, order_summaries([row])[row["id"]])
+    report_fields, cache_status = report_jobs.report_fields(product_data["id"], financial_data)
+    return {
+        "product_data": {**product_data, "margin": margin_summary(financial_data)},
+        "report_fields": report_fields,
+        "cache_status": cache_status,
+        "headers": headers,
+    }
+
+
+async def product_detail(request, pk):
+    """
+    Get detailed information about a specific product, with the reports of the two agent services.
+
+    Same contract as ``ProductViewSet.retrieve``.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return json_response({"detail": f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    detail = await sync_to_async(load_product_detail)(request, pk)
+    if isinstance(detail, HttpResponse):
+        return detail
+
+    response_data = dict(detail["product_data"])
+    response_data.update(detail["report_fields"])
+
+    response = add_validators(json_response(response_data), detail["headers"])
+    response["X-Report-Cache"] = detail["cache_status"]
+    return response
@@ -0,0 +1,398 @@
+import csv
+import io
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .ingestion import parse_order
+from .models import CatalogImport, DeliveredOrder, Product, ProductCost, ProductSalesRollup
+
+# Columns expected in each CSV file, the first ones of each list are required
+PRODUCT_COLUMNS = [
+    "external_ref",
+    "product_name",
+    "product_selling_price",
+    "product_category",
+    "product_image",
+    "product_description",
+    "total_returns",
+]
+PRODUCT_COST_COLUMNS = [
+    "product_ref",
+    "product_cost",
+    "confirmation_fees",
+    "packaging_fees",
+    "return_cost",
+    "ads_cost",
+]
+DELIVERED_ORDER_COLUMNS = ["product_ref", "price", "quantity", "discount", "created_at"]
+
+# (stage, CatalogImport file field, CatalogImport progress field, CSV columns, required columns)
+STAGES = [
+    ("products", "products_file", "products_done", PRODUCT_COLUMNS, 3),
+    ("product_costs", "product_costs_file", "product_costs_done", PRODUCT_COST_COLUMNS, 1),
+    ("delivered_orders", "delivered_orders_file", "delivered_orders_done", DELIVERED_ORDER_COLUMNS, 3),
+]
+
+COST_FIELDS = PRODUCT_COST_COLUMNS[1:]
+
+STAGING_TABLES = {
+    "products": """
+        CREATE TEMP TABLE catalog_import_products (
+            line bigserial,
+            external_ref varchar(100),
+            product_name varchar(255),
+            product_selling_price numeric(10, 2),
+            product_category varchar(100),
+            product_image varchar(255),
+            product_description text,
+            total_returns integer
+        ) ON COMMIT DROP
+    """,
+    "product_costs": """
+        CREATE TEMP TABLE catalog_import_product_costs (
+            line bigserial,
+            product_ref varchar(100),
+            product_cost numeric(10, 2),
+            confirmation_fees numeric(10, 2),
+            packaging_fees numeric(10, 2),
+            return_cost numeric(10, 2),
+            ads_cost numeric(10, 2)
+        ) ON COMMIT DROP
+    """,
+    "delivered_orders": """
+        CREATE TEMP TABLE catalog_import_delivered_orders (
+            line bigserial,
+            product_ref varchar(100),
+            price numeric(10, 2),
+            quantity integer,
+            discount boolean,
+            created_at timestamptz
+        ) ON COMMIT DROP
+    """,
+}
+
+
+class CatalogImportError(Exception):
+    """
+    Raised when a catalogue file cannot be imported.
+    """
+
+
+class CatalogImporter:
+    """
+    Load the files of a CatalogImport into the Product, ProductCost and DeliveredOrder tables.
+
+    Products are matched on ``(user, external_ref)``: importing a product that
+    already exists updates it, and costs and orders refer to their product
+    through its external reference.
+
+    The files are processed in chunks of ``chunk_size`` rows. Each chunk is
+    written in its own transaction together with the import's progress, so a
+    failed or interrupted import resumes after the last committed chunk.
+
+    On PostgreSQL each chunk is sent with ``COPY FROM STDIN`` into a temporary
+    staging table, then merged with ``INSERT ... SELECT ... ON CONFLICT``. Other
+    databases fall back to validating the rows in Python and batched
+    ``bulk_create`` calls.
+
+    Attributes:
+        catalog_import (CatalogImport): The import to run
+        chunk_size (int): Number of rows per chunk
+        progress (callable): Called with (stage, rows done) after each chunk
+    """
+
+    def __init__(self, catalog_import, chunk_size=50000, progress=None):
+        self.catalog_import = catalog_import
+        self.user_id = catalog_import.user_id
+        self.chunk_size = chunk_size
+        self.progress = progress or (lambda stage, done: None)
+        self.use_copy = connection.vendor == "postgresql"
+
+    def run(self):
+        """
+        Run, or resume, the import.
+
+        Returns:
+            CatalogImport: The import, with its final status and progress
+        """
+        catalog_import = self.catalog_import
+        catalog_import.status = CatalogImport.STATUS_RUNNING
+        catalog_import.error = ""
+        catalog_import.save(update_fields=["status", "error", "updated_at"])
+
+        try:
+            for stage, file_field, done_field, columns, required in STAGES:
+                path = getattr(catalog_import, file_field)
+                if path:
+                    self.import_file(stage, path, done_field, columns, columns[:required])
+        except (CatalogImportError, DatabaseError, OSError, UnicodeDecodeError) as e:
+            catalog_import.status = CatalogImport.STATUS_FAILED
+            catalog_import.error = str(e)
+        else:
+            catalog_import.status = CatalogImport.STATUS_COMPLETED
+        catalog_import.save(update_fields=["status", "error", "updated_at"])
+        return catalog_import
+
+    def import_file(self, stage, path, done_field, columns, required_columns):
+        """
+        Import one CSV file, chunk by chunk, starting after the rows already imported.
+        """
+        # utf-8-sig drops the byte order mark spreadsheets write at the start of their CSV exports
+        with open(path, newline="", encoding="utf-8-sig") as csv_file:
+            reader = csv.DictReader(csv_file)
+            missing = [column for column in required_columns if column not in (reader.fieldnames or [])]
+            if missing:
+                raise CatalogImportError(f"{stage}: missing columns {', '.join(missing)}")
+
+            done = getattr(self.catalog_import, done_field)
+            rows = islice(reader, done, None)
+            while True:
+                chunk = [[row.get(column) or "" for column in columns] for row in islice(rows, self.chunk_size)]
+                if not chunk:
+                    break
+                # The header is line 1 of the file
+                first_line = done + 2
+                with transaction.atomic():
+                    if self.use_copy:
+                        self.copy_chunk(stage, columns, chunk, first_line)
+                    else:
+                        getattr(self, f"load_{stage}")(chunk, first_line)
+                    done += len(chunk)
+                    setattr(self.catalog_import, done_field, done)
+                    self.catalog_import.save(update_fields=[done_field, "updated_at"])
+                self.progress(stage, done)
+
+    # PostgreSQL: COPY into a staging table, then merge
+
+    def copy_chunk(self, stage, columns, chunk, first_line):
+        """
+        Copy a chunk into its staging table and merge it into the application tables.
+        """
+        staging_table = f"catalog_import_{stage}"
+        buffer = io.StringIO()
+        # Empty values are written unquoted, which COPY reads as NULL
+        csv.writer(buffer).writerows(chunk)
+
+        with connection.cursor() as cursor:
+            cursor.execute(STAGING_TABLES[stage])
+            sql = f"COPY {staging_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+            raw_cursor = cursor.cursor
+            if hasattr(raw_cursor, "copy_expert"):
+                # psycopg2
+                buffer.seek(0)
+                raw_cursor.copy_expert(sql, buffer)
+            else:
+                # psycopg 3
+                with raw_cursor.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+            if stage != "products":
+                self.check_product_refs(cursor, staging_table, first_line)
+            getattr(self, f"merge_{stage}")(cursor, staging_table)
+
+    def check_product_refs(self, cursor, staging_table, first_line):
+        cursor.execute(
+            f"""
+            SELECT s.line, s.product_ref FROM {staging_table} s
+            LEFT JOIN {Product._meta.db_table} p ON p.user_id = %s AND p.external_ref = s.product_ref
+            WHERE p.id IS NULL ORDER BY s.line LIMIT 1
+            """,
+            [self.user_id],
+        )
+        unknown = cursor.fetchone()
+        if unknown:
+            line, ref = unknown
+            raise CatalogImportError(f"line {first_line + line - 1}: unknown product_ref {ref!r}")
+
+    def merge_products(self, cursor, staging_table):
+        # DISTINCT ON keeps the last row of each reference, ON CONFLICT cannot update a row twice
+        cursor.execute(
+            f"""
+            INSERT INTO {Product._meta.db_table} (
+                user_id, external_ref, product_name, product_category, product_image,
+                product_selling_price, product_description, total_returns, created_at, updated_at
+            )
+            SELECT DISTINCT ON (external_ref)
+                %s, external_ref, product_name, COALESCE(product_category, ''), COALESCE(product_image, ''),
+                product_selling_price, COALESCE(product_description, ''), COALESCE(total_returns, 0), NOW(), NOW()
+            FROM {staging_table}
+            ORDER BY external_ref, line DESC
+            ON CONFLICT (user_id, external_ref) DO UPDATE SET
+                product_name = EXCLUDED.product_name,
+                product_category = EXCLUDED.product_category,
+                product_image = EXCLUDED.product_image,
+                product_selling_price = EXCLUDED.product_selling_price,
+                product_description = EXCLUDED.product_description,
+                total_returns = EXCLUDED.total_returns,
+                updated_at = NOW()
+            """,
+            [self.user_id],
+        )
+
+    def merge_product_costs(self, cursor, staging_table):
+        values = ", ".join(f"COALESCE(s.{field}, 0)" for field in COST_FIELDS)
+        updates = ", ".join(f"{field} = EXCLUDED.{field}" for field in COST_FIELDS)
+        cursor.execute(
+            f"""
+            INSERT INTO {ProductCost._meta.db_table} (product_id, {', '.join(COST_FIELDS)}, created_at, updated_at)
+            SELECT DISTINCT ON (p.id) p.id, {values}, NOW(), NOW()
+            FROM {staging_table} s
+            JOIN {Product._meta.db_table} p ON p.user_id = %s AND p.external_ref = s.product_ref
+            ORDER BY p.id, s.line DESC
+            ON CONFLICT (product_id) DO UPDATE SET {updates}, updated_at = NOW()
+            """,
+            [self.user_id],
+        )
+
+    def merge_delivered_orders(self, cursor, staging_table):
+        product_table = Product._meta.db_table
+        rollup_table = ProductSalesRollup._meta.db_table
+        # Orders without a timestamp are stamped a microsecond apart in file order, not all at NOW()
+        cursor.execute(f"""
+            UPDATE {staging_table} SET
+                discount = COALESCE(discount, FALSE),
+                created_at = COALESCE(created_at, NOW() + (line - 1) * INTERVAL '1 microsecond')
+            """)
+        cursor.execute(
+            f"""
+            INSERT INTO {DeliveredOrder._meta.db_table} (product_id, price, quantity, discount, created_at)
+            SELECT p.id, s.price, s.quantity, s.discount, s.created_at
+            FROM {staging_table} s
+            JOIN {product_table} p ON p.user_id = %s AND p.external_ref = s.product_ref
+            """,
+            [self.user_id],
+        )
+        # Add the chunk to the sales rollups, as ProductSalesRollup.add_orders does
+        cursor.execute(
+            f"""
+            INSERT INTO {rollup_table} (
+                product_id, units_sold, revenue, discounted_units, discounted_revenue,
+                order_count, first_order_at, last_order_at, updated_at
+            )
+            SELECT
+                p.id,
+                SUM(s.quantity),
+                SUM(s.price * s.quantity),
+                SUM(CASE WHEN s.discount THEN s.quantity ELSE 0 END),
+                SUM(CASE WHEN s.discount THEN s.price * s.quantity ELSE 0 END),
+                COUNT(*),
+                MIN(s.created_at),
+                MAX(s.created_at),
+                NOW()
+            FROM {staging_table} s
+            JOIN {product_table} p ON p.user_id = %s AND p.external_ref = s.product_ref
+            GROUP BY p.id
+            ON CONFLICT (product_id) DO UPDATE SET
+                units_sold = {rollup_table}.units_sold + EXCLUDED.units_sold,
+                revenue = {rollup_table}.revenue + EXCLUDED.revenue,
+                discounted_units = {rollup_table}.discounted_units + EXCLUDED.discounted_units,
+                discounted_revenue = {rollup_table}.discounted_revenue + EXCLUDED.discounted_revenue,
+                order_count = {rollup_table}.order_count + EXCLUDED.order_count,
+                first_order_at = LEAST({rollup_table}.first_order_at, EXCLUDED.first_order_at),
+                last_order_at = GREATEST({rollup_table}.last_order_at, EXCLUDED.last_order_at),
+                updated_at = NOW()
+            """,
+            [self.user_id],
+        )
+
+    # Other databases: validate in Python and use batched bulk_create
+
+    def product_ids(self, chunk, first_line):
+        """
+        Map the product references of a chunk to product ids, failing on unknown references.
+        """
+        refs = {row[0] for row in chunk}
+        ids = dict(
+            Product.objects.filter(user_id=self.user_id, external_ref__in=refs).values_list("external_ref", "pk")
+        )
+        for offset, row in enumerate(chunk):
+            if row[0] not in ids:
+                raise CatalogImportError(f"line {first_line + offset}: unknown product_ref {row[0]!r}")
+        return ids
+
+    def load_products(self, chunk, first_line):
+        products = {}
+        for offset, (ref, name, price, category, image, description, total_returns) in enumerate(chunk):
+            line = first_line + offset
+            if not ref or not name:
+                raise CatalogImportError(f"line {line}: external_ref and product_name are required")
+            products[ref] = Product(
+                user_id=self.user_id,
+                external_ref=ref,
+                product_name=name,
+                product_selling_price=parse_decimal(price, line, "product_selling_price", required=True),
+                product_category=category,
+                product_image=image,
+                product_description=description,
+                total_returns=parse_integer(total_returns, line, "total_returns"),
+            )
+        Product.objects.bulk_create(
+            products.values(),
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["user", "external_ref"],
+            update_fields=[
+                "product_name",
+                "product_selling_price",
+                "product_category",
+                "product_image",
+                "product_description",
+                "total_returns",
+                "updated_at",
+            ],
+        )
+
+    def load_product_costs(self, chunk, first_line):
+        ids = self.product_ids(chunk, first_line)
+        costs = {}
+        for offset, (ref, *values) in enumerate(chunk):
+            line = first_line + offset
+            costs[ids[ref]] = ProductCost(
+                product_id=ids[ref],
+                **{field: parse_decimal(value, line, field) for field, value in zip(COST_FIELDS, values)},
+            )
+        ProductCost.objects.bulk_create(
+            costs.values(),
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=[*COST_FIELDS, "updated_at"],
+        )
+
+    def load_delivered_orders(self, chunk, first_line):
+        ids = self.product_ids(chunk, first_line)
+        now = timezone.now()
+        orders = []
+        for offset, (ref, *values) in enumerate(chunk):
+            row = dict(zip(DELIVERED_ORDER_COLUMNS[1:], values))
+            order, errors = parse_order(row, ids[ref])
+            if errors:
+                details = "; ".join(f"{field}: {' '.join(messages)}" for field, messages in errors.items())
+                raise CatalogImportError(f"line {first_line + offset}: {details}")
+            if not row["created_at"]:
+                # As merge_delivered_orders: a microsecond apart in file order
+                order.created_at = now + timedelta(microseconds=offset)
+            orders.append(order)
+        ProductSalesRollup.add_orders(DeliveredOrder.objects.bulk_create(orders, batch_size=1000))
+
+
+def parse_decimal(value, line, field, required=False):
+    if value == "" and not required:
+        return Decimal("0")
+    try:
+        return Decimal(value).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise CatalogImportError(f"line {line}: {field} must be a number")
+
+
+def parse_integer(value, line, field):
+    if value == "":
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        raise CatalogImportError(f"line {line}: {field} must be an integer")
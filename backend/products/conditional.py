@@ -0,0 +1,116 @@
+"""
+Conditional GET support (ETag / Last-Modified) for the product endpoints.
+
+Each response is given validators computed with one aggregate query over the
+timestamps of everything it is built from: the products, their costs, their
+sales rollups (touched whenever an order is added, changed or deleted) and,
+for the detail endpoint, the user's fixed costs and the last finished report job.
+When the client sends back a matching ``If-None-Match`` or a recent enough
+``If-Modified-Since``, the view answers ``304 Not Modified`` before
+serializing anything or looking up the agent reports.
+
+The ETags are weak: the detail response embeds the agent reports, which are
+equivalent but not byte-identical from one run to the next.
+"""
+
+import hashlib
+
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import Product, ReportJob
+
+
+def product_validators(user, pk):
+    """
+    Read the state the detail representation of a product depends on.
+
+    Returns:
+        tuple: The values identifying the state, or None if the user has no such product
+    """
+    # The detail embeds the reports once the job generating them finished. Queuing a job does not count:
+    # it happens after this check, and the response already says the reports are pending
+    finished_job = (
+        ReportJob.objects.filter(product=OuterRef("pk"), finished_at__isnull=False)
+        .order_by("-finished_at")
+        .values("finished_at")[:1]
+    )
+    try:
+        return (
+            Product.objects.filter(user=user, pk=pk)
+            .annotate(report_job_finished_at=Subquery(finished_job))
+            .values_list(
+                "updated_at",
+                "product_cost__updated_at",
+                "sales_rollup__updated_at",
+                "sales_rollup__last_order_at",
+                "sales_rollup__order_count",
+                "user__fixed_costs__updated_at",
+                "report_job_finished_at",
+            )
+            .first()
+        )
+    except (TypeError, ValueError):
+        # Invalid pk, the view answers 404
+        return None
+
+
+def product_list_validators(products):
+    """
+    Read the state the list representations of a set of products depend on.
+
+    Counting the products and costs catches deletions, which do not leave any timestamp behind.
+
+    Returns:
+        tuple: The values identifying the state
+    """
+    state = products.aggregate(
+        product_count=Count("id"),
+        updated_at=Max("updated_at"),
+        cost_count=Count("product_cost"),
+        cost_updated_at=Max("product_cost__updated_at"),
+        sales_updated_at=Max("sales_rollup__updated_at"),
+    )
+    return tuple(state.values())
+
+
+def conditional_response(request, state):
+    """
+    Compute the validators of a response and check the request's preconditions against them.
+
+    Args:
+        request (Request): The current request
+        state (tuple): Values identifying the state of the resource; the timestamps among them
+            give Last-Modified
+
+    Returns:
+        tuple: (response, headers) where response is a 304 (or 412) response to return as is,
+            or None if the view must build the full response and add the headers to it
+    """
+    # The representation also depends on the query string (cursor, include_orders, ...) and the renderer
+    key = repr((request.get_full_path(), request.META.get("HTTP_ACCEPT", ""), state))
+    etag = f'W/"{hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()}"'
+    timestamps = [value for value in state if hasattr(value, "timestamp")]
+    last_modified = int(max(timestamps).timestamp()) if timestamps else None
+
+    headers = HttpResponse()
+    headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    # Authenticated data: clients and shared caches must revalidate every time
+    patch_cache_control(headers, private=True, no_cache=True)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified, response=headers)
+    return (None if response is headers else response), headers
+
+
+def add_validators(response, headers):
+    """
+    Copy the validators returned by ``conditional_response`` to the full response.
+    """
+    for header in ("ETag", "Last-Modified", "Cache-Control"):
+        if header in headers:
+            response[header] = headers[header]
+    return response
@@ -0,0 +1,198 @@
+"""
+Fast, read-only serialization of products for the list and detail endpoints.
+
+``ProductSerializer`` builds a tree of DRF fields and runs each value through
+them, which dominates the CPU time of a response once it holds thousands of
+products or nested orders. The functions below work on ``.values()`` rows
+instead of model instances and build the plain dicts directly.
+
+They produce the same JSON as ``ProductSerializer`` and
+``ProductDetailSerializer`` (decimals as fixed-point strings, datetimes in
+ISO 8601 with a ``Z`` suffix for UTC, the same key order); the serializers
+remain the reference for the API schema and are still used by the write
+endpoints.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import DeliveredOrder
+
+PRODUCT_VALUES = (
+    "id",
+    "product_name",
+    "product_category",
+    "product_image",
+    "product_selling_price",
+    "product_description",
+    "total_returns",
+    "has_product_costs",
+    "revenue",
+    "units_sold",
+    "discounted_units",
+    "order_count",
+    "created_at",
+    "updated_at",
+)
+
+PRODUCT_COST_FIELDS = (
+    "id",
+    "product_cost",
+    "confirmation_fees",
+    "packaging_fees",
+    "return_cost",
+    "ads_cost",
+    "created_at",
+    "updated_at",
+)
+PRODUCT_COST_VALUES = tuple(f"product_cost__{field}" for field in PRODUCT_COST_FIELDS)
+
+CENTS = Decimal("0.01")
+TEN_THOUSANDTHS = Decimal("0.0001")
+
+
+def format_decimal(value, exponent=CENTS):
+    """
+    Format a decimal the way DRF's DecimalField does: quantized, as a fixed-point string.
+    """
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return f"{value.quantize(exponent):f}"
+
+
+def format_datetime(value):
+    """
+    Format a datetime the way DRF's DateTimeField does: ISO 8601 in the current time zone.
+    """
+    if value is None:
+        return None
+    value = timezone.localtime(value).isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def product_rows(queryset, with_costs=False):
+    """
+    Select the columns the fast serializers need.
+
+    Args:
+        queryset (ProductQuerySet): Products annotated with ``with_financials()`` and ``with_cost_flag()``
+        with_costs (bool): Also join the product costs, for ``serialize_product_detail``
+
+    Returns:
+        QuerySet: A ``.values()`` queryset, which can be paginated like the original one
+    """
+    return queryset.values(*PRODUCT_VALUES, *(PRODUCT_COST_VALUES if with_costs else ()))
+
+
+def delivered_orders_by_product(product_ids):
+    """
+    Load the delivered orders of several products in one query.
+
+    Returns:
+        dict: Product id to its serialized orders, newest first
+    """
+    orders = defaultdict(list)
+    rows = (
+        DeliveredOrder.objects.filter(product_id__in=product_ids)
+        .order_by("-created_at", "-id")
+        .values_list("product_id", "price", "quantity", "discount", "created_at")
+    )
+    for product_id, price, quantity, discount, created_at in rows:
+        orders[product_id].append(
+            {
+                "price": format_decimal(price),
+                "quantity": quantity,
+                "discount": discount,
+                "created_at": format_datetime(created_at),
+            }
+        )
+    return orders
+
+
+def serialize_product(row, delivered_orders=None):
+    """
+    Build the ProductSerializer representation of one row.
+
+    Args:
+        row (dict): A row from ``product_rows``
+        delivered_orders (list, optional): The serialized orders, only included when given
+
+    Returns:
+        dict: The product
+    """
+    units_sold = row["units_sold"]
+    if units_sold:
+        average_realized_price = row["revenue"] / units_sold
+        discount_share = Decimal(row["discounted_units"]) / Decimal(units_sold)
+    else:
+        average_realized_price = discount_share = Decimal("0")
+
+    data = {
+        "id": row["id"],
+        "product_name": row["product_name"],
+        "product_category": row["product_category"],
+        "product_image": row["product_image"],
+        "product_selling_price": format_decimal(row["product_selling_price"]),
+        "product_description": row["product_description"],
+        "total_returns": row["total_returns"],
+        "has_product_costs": bool(row["has_product_costs"]),
+        "revenue": format_decimal(row["revenue"]),
+        "units_sold": units_sold,
+        "average_realized_price": format_decimal(average_realized_price),
+        "discount_share": format_decimal(discount_share, TEN_THOUSANDTHS),
+        "order_count": row["order_count"],
+    }
+    if delivered_orders is not None:
+        data["delivered_orders"] = delivered_orders
+    data["created_at"] = format_datetime(row["created_at"])
+    data["updated_at"] = format_datetime(row["updated_at"])
+    return data
+
+
+def serialize_products(rows, include_orders=False):
+    """
+    Build the ProductSerializer representation of several rows.
+
+    Args:
+        rows (iterable of dict): Rows from ``product_rows``, e.g. a page of them
+        include_orders (bool): Whether to nest the delivered orders, loaded with one extra query
+
+    Returns:
+        list: The products
+    """
+    rows = list(rows)
+    if not include_orders:
+        return [serialize_product(row) for row in rows]
+    orders = delivered_orders_by_product([row["id"] for row in rows])
+    return [serialize_product(row, orders.get(row["id"], [])) for row in rows]
+
+
+def serialize_product_detail(row, include_orders=False, delivered_orders=None):
+    """
+    Build the ProductDetailSerializer representation of one row, without the agent reports.
+
+    Args:
+        row (dict): A row from ``product_rows(..., with_costs=True)``
+        include_orders (bool): Whether to nest the delivered orders, loaded with one extra query
+        delivered_orders (list, optional): The serialized orders, if already loaded
+
+    Returns:
+        dict: The product, with its product costs or None
+    """
+    if include_orders and delivered_orders is None:
+        delivered_orders = delivered_orders_by_product([row["id"]]).get(row["id"], [])
+    data = serialize_product(row, delivered_orders)
+    data["product_cost"] = None
+    if row["product_cost__id"] is not None:
+        cost = {field: row[f"product_cost__{field}"] for field in PRODUCT_COST_FIELDS}
+        data["product_cost"] = {
+            "id": cost["id"],
+            **{field: format_decimal(cost[field]) for field in PRODUCT_COST_FIELDS[1:6]},
+            "created_at": format_datetime(cost["created_at"]),
+            "updated_at": format_datetime(cost["updated_at"]),
+        }
+    return data
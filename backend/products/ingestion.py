@@ -0,0 +1,236 @@
+import codecs
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+
+from .models import DeliveredOrder, Product, ProductSalesRollup
+
+JSON_MEDIA_TYPES = ("application/json",)
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+CSV_MEDIA_TYPES = ("text/csv",)
+
+# Only the first errors are listed in the response, the others are only counted
+MAX_REPORTED_ERRORS = 100
+
+TRUE_VALUES = {"true", "1", "yes", "y", "t"}
+FALSE_VALUES = {"false", "0", "no", "n", "f", ""}
+
+MAX_PRICE = Decimal("1e8")  # DeliveredOrder.price has 10 digits, 2 of them decimal
+
+
+def read_rows(request):
+    """
+    Iterate over the rows of a bulk order request body.
+
+    NDJSON and CSV bodies are read line by line from the request stream, so the
+    whole body never has to be held in memory. JSON bodies must be an array and
+    are parsed at once.
+
+    Args:
+        request (Request): The DRF request, whose body must not have been parsed yet
+
+    Yields:
+        dict: One order row, with the raw (unvalidated) values
+
+    Raises:
+        UnsupportedMediaType: If the content type is not JSON, NDJSON or CSV
+        ParseError: If the body is malformed
+    """
+    media_type = request.content_type.split(";")[0].strip().lower()
+    stream = request.stream
+    if stream is None:
+        return
+
+    if media_type in JSON_MEDIA_TYPES:
+        try:
+            rows = json.load(stream, parse_float=Decimal)
+        except ValueError as e:
+            raise ParseError(f"JSON parse error - {e}")
+        if not isinstance(rows, list):
+            raise ParseError("Expected a JSON array of orders.")
+        yield from rows
+
+    elif media_type in NDJSON_MEDIA_TYPES:
+        # utf-8-sig drops the byte order mark some editors and spreadsheets write at the start of the file
+        for line_number, line in enumerate(codecs.iterdecode(stream, "utf-8-sig"), start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line, parse_float=Decimal)
+            except ValueError as e:
+                raise ParseError(f"NDJSON parse error on line {line_number} - {e}")
+
+    elif media_type in CSV_MEDIA_TYPES:
+        yield from csv.DictReader(codecs.iterdecode(stream, "utf-8-sig"))
+
+    else:
+        raise UnsupportedMediaType(media_type)
+
+
+def parse_order(row, product_id=None):
+    """
+    Validate one order row and build the corresponding DeliveredOrder.
+
+    This is deliberately a plain function rather than a DRF serializer: it runs
+    once per row on bodies of tens of thousands of rows.
+
+    Args:
+        row (dict): The raw row, with price, quantity, and optionally discount,
+            created_at and (when product_id is not given) product
+        product_id (int, optional): The product all rows belong to
+
+    Returns:
+        tuple: (DeliveredOrder, None) if the row is valid, (None, errors dict) otherwise
+    """
+    if not isinstance(row, dict):
+        return None, {"non_field_errors": ["Expected an object."]}
+
+    errors = {}
+
+    try:
+        price = Decimal(str(row.get("price", ""))).quantize(Decimal("0.01"))
+        if not 0 <= price < MAX_PRICE:
+            errors["price"] = ["Ensure this value is between 0 and 99999999.99."]
+    except InvalidOperation:
+        errors["price"] = ["A valid number is required."]
+
+    try:
+        # Parsed as a Decimal, so that a fractional quantity (JSON numbers are Decimals) is rejected, not truncated
+        quantity = Decimal(str(row.get("quantity", "")))
+        if quantity != quantity.to_integral_value():
+            raise ValueError
+        quantity = int(quantity)
+        if quantity < 0:
+            errors["quantity"] = ["Ensure this value is greater than or equal to 0."]
+    except (InvalidOperation, OverflowError, ValueError):
+        errors["quantity"] = ["A valid integer is required."]
+
+    discount = row.get("discount", False)
+    if not isinstance(discount, bool):
+        value = str(discount).strip().lower()
+        if value in TRUE_VALUES:
+            discount = True
+        elif value in FALSE_VALUES:
+            discount = False
+        else:
+            errors["discount"] = ["Must be a valid boolean."]
+
+    created_at = row.get("created_at")
+    if created_at in (None, ""):
+        created_at = timezone.now()
+    else:
+        try:
+            created_at = parse_datetime(str(created_at))
+        except ValueError:
+            created_at = None
+        if created_at is None:
+            errors["created_at"] = ["Datetime has wrong format."]
+        elif timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+
+    if product_id is None:
+        try:
+            product_id = int(row.get("product", ""))
+        except (TypeError, ValueError):
+            errors["product"] = ["A valid product id is required."]
+
+    if errors:
+        return None, errors
+    return (
+        DeliveredOrder(product_id=product_id, price=price, quantity=quantity, discount=discount, created_at=created_at),
+        None,
+    )
+
+
+class OrderIngestion:
+    """
+    Validate and store a stream of delivered order rows.
+
+    Rows are validated as they are read and written in chunks with
+    ``bulk_create``, all inside a single transaction. If any row is invalid,
+    nothing is stored: the remaining rows are still validated so that all the
+    errors can be reported at once, and the transaction is rolled back.
+
+    Attributes:
+        user (User): The user the orders' products must belong to
+        product (Product): The product all rows belong to, or None if each row names its product
+        batch_size (int): Number of rows per bulk_create
+    """
+
+    def __init__(self, user, product=None, batch_size=None):
+        self.user = user
+        self.product = product
+        self.batch_size = batch_size or settings.ORDER_INGESTION_BATCH_SIZE
+        self.known_product_ids = {product.pk} if product else set()
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, row_number, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "errors": errors})
+
+    def run(self, rows):
+        """
+        Ingest the rows.
+
+        Args:
+            rows (iterable of dict): The raw rows, e.g. from ``read_rows``
+
+        Returns:
+            dict: The number of created orders, and the error count and errors if any row was invalid
+        """
+        product_id = self.product.pk if self.product else None
+        with transaction.atomic():
+            chunk = []
+            row_number = 0
+            for row_number, row in enumerate(rows, start=1):
+                order, errors = parse_order(row, product_id)
+                if errors:
+                    self.add_error(row_number, errors)
+                else:
+                    chunk.append((row_number, order))
+                if len(chunk) >= self.batch_size:
+                    self.flush(chunk)
+                    chunk = []
+            self.flush(chunk)
+
+            if row_number == 0:
+                raise ParseError("The request body does not contain any order.")
+            if self.error_count:
+                transaction.set_rollback(True)
+                return {"created": 0, "error_count": self.error_count, "errors": self.errors}
+        return {"created": self.created}
+
+    def flush(self, chunk):
+        """
+        Check the products of a chunk of valid rows and write them, unless an error was already found.
+        """
+        if not self.product:
+            self.check_products(chunk)
+        if self.error_count or not chunk:
+            return
+
+        orders = DeliveredOrder.objects.bulk_create([order for _, order in chunk], batch_size=self.batch_size)
+        ProductSalesRollup.add_orders(orders)
+        self.created += len(orders)
+
+    def check_products(self, chunk):
+        """
+        Report the rows of the chunk whose product does not exist or belongs to another user.
+        """
+        unknown_ids = {order.product_id for _, order in chunk} - self.known_product_ids
+        if unknown_ids:
+            self.known_product_ids.update(
+                Product.objects.filter(user=self.user, pk__in=unknown_ids).values_list("pk", flat=True)
+            )
+        for row_number, order in chunk:
+            if order.product_id not in self.known_product_ids:
+                self.add_error(row_number, {"product": [f'Invalid pk "{order.product_id}" - object does not exist.']})
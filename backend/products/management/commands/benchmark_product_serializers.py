@@ -0,0 +1,69 @@
+import time
+
+from products.fast_serializers import product_rows, serialize_product_detail, serialize_products
+from products.models import Product
+from products.serializers import ProductDetailSerializer, ProductSerializer
+
+from .explain_product_queries import BENCHMARK_USERNAME
+from .explain_product_queries import Command as ExplainCommand
+
+
+class Command(ExplainCommand):
+    help = (
+        "Seeds a large dataset and compares the time taken to load and serialize products with the DRF "
+        "serializers and with the fast .values() read path"
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.set_defaults(products=10000, orders=100, users=0)
+        parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each case, the best is kept")
+
+    def handle(self, *args, **options):
+        self.check_database()
+        user = self.seed(options["products"], options["orders"], options["users"], options["reseed"])
+        products = Product.objects.filter(user=user).with_financials().with_cost_flag().order_by("-updated_at", "-id")
+        product = products.first()
+
+        cases = [
+            (
+                f"{BENCHMARK_USERNAME} products",
+                lambda: ProductSerializer(products, many=True, context={"include_orders": False}).data,
+                lambda: serialize_products(product_rows(products)),
+            ),
+            (
+                f"{BENCHMARK_USERNAME} products with orders",
+                lambda: ProductSerializer(products.with_orders(), many=True, context={"include_orders": True}).data,
+                lambda: serialize_products(product_rows(products), include_orders=True),
+            ),
+            (
+                "product detail with orders",
+                lambda: ProductDetailSerializer(
+                    products.select_related("product_cost").with_orders().get(pk=product.pk),
+                    context={"include_orders": True},
+                ).data,
+                lambda: serialize_product_detail(
+                    product_rows(products, with_costs=True).get(pk=product.pk), include_orders=True
+                ),
+            ),
+        ]
+        for name, drf, fast in cases:
+            drf_time, drf_data = self.measure(drf, options["repeat"])
+            fast_time, fast_data = self.measure(fast, options["repeat"])
+            self.stdout.write(self.style.SUCCESS(f"{name}:"))
+            self.stdout.write(f"    DRF serializers: {drf_time * 1000:.1f} ms")
+            self.stdout.write(f"    Fast read path:  {fast_time * 1000:.1f} ms ({drf_time / fast_time:.1f}x faster)")
+            if drf_data != fast_data:
+                self.stdout.write(self.style.ERROR("    The two implementations returned different data"))
+
+    def measure(self, serialize, repeat):
+        """
+        Return the best time of ``repeat`` runs, including the queries, and the data of the last one.
+        """
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = serialize()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, data
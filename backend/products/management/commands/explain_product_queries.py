@@ -0,0 +1,185 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from products.models import DeliveredOrder, Product, ProductCost, ProductSalesRollup
+from products.pagination import DeliveredOrderCursorPagination, ProductCursorPagination
+from products.views import ProductViewSet
+
+User = get_user_model()
+
+BENCHMARK_USERNAME = "benchmark"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a large dataset and prints the query plan and timing of the queries behind each product "
+        "endpoint, and without the custom indexes with --drop-indexes. Only runs with DEBUG on or against a "
+        "dedicated benchmark database (one whose name contains 'benchmark')"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=2000, help="Number of products to seed")
+        parser.add_argument("--orders", type=int, default=100, help="Number of delivered orders per product")
+        parser.add_argument("--users", type=int, default=20, help="Number of other users owning as many products")
+        parser.add_argument("--reseed", action="store_true", help="Remove the existing benchmark data and seed again")
+        parser.add_argument(
+            "--drop-indexes",
+            action="store_true",
+            help="Also explain the queries without the custom indexes, which are dropped and created again. "
+            "This locks the tables while the indexes are rebuilt",
+        )
+
+    def handle(self, *args, **options):
+        self.check_database()
+        user = self.seed(options["products"], options["orders"], options["users"], options["reseed"])
+        product = Product.objects.filter(user=user).order_by("-updated_at").first()
+
+        self.stdout.write(self.style.MIGRATE_HEADING("With indexes"))
+        self.explain_actions(user, product)
+        if not options["drop_indexes"]:
+            return
+
+        # Drop the indexes declared in the models' Meta, and create them again afterwards
+        self.stdout.write(self.style.MIGRATE_HEADING("Without indexes"))
+        indexes = [(model, index) for model in (Product, DeliveredOrder) for index in model._meta.indexes]
+        with connection.schema_editor() as schema_editor:
+            for model, index in indexes:
+                schema_editor.remove_index(model, index)
+        try:
+            self.explain_actions(user, product)
+        finally:
+            with connection.schema_editor() as schema_editor:
+                for model, index in indexes:
+                    schema_editor.add_index(model, index)
+
+    def check_database(self):
+        """
+        Refuse to seed and alter a database that may be shared, or serve production.
+
+        Raises:
+            CommandError: Unless DEBUG is on or the name of the database contains "benchmark"
+        """
+        name = str(connection.settings_dict["NAME"])
+        if not settings.DEBUG and "benchmark" not in name.lower():
+            raise CommandError(
+                f"Refusing to seed benchmark data into database {name!r}: run with DEBUG=True "
+                "or against a dedicated database whose name contains 'benchmark'"
+            )
+
+    def seed(self, product_count, orders_per_product, other_users, reseed):
+        """
+        Create the benchmark users, products, costs and orders unless they already exist.
+        """
+        user, _ = User.objects.get_or_create(username=BENCHMARK_USERNAME)
+        if reseed:
+            Product.objects.filter(user__username__startswith=BENCHMARK_USERNAME).delete()
+        elif Product.objects.filter(user=user).exists():
+            self.stdout.write(f"Using existing benchmark data for user {BENCHMARK_USERNAME}")
+            return user
+
+        owners = [user] + [
+            User.objects.get_or_create(username=f"{BENCHMARK_USERNAME}{i}")[0] for i in range(1, other_users + 1)
+        ]
+        now = timezone.now()
+        for owner in owners:
+            products = Product.objects.bulk_create(
+                [
+                    Product(
+                        user=owner,
+                        product_name=f"Product {i}",
+                        product_category="Benchmark",
+                        product_image="/images/benchmark.jpg",
+                        product_selling_price=Decimal("1000.00"),
+                        product_description="Seeded by explain_product_queries",
+                    )
+                    for i in range(product_count)
+                ],
+                batch_size=1000,
+            )
+            # Half of the products get costs
+            ProductCost.objects.bulk_create(
+                [ProductCost(product=product, product_cost=Decimal("400.00")) for product in products[::2]],
+                batch_size=1000,
+            )
+            for product in products:
+                orders = DeliveredOrder.objects.bulk_create(
+                    [
+                        DeliveredOrder(
+                            product=product,
+                            price=Decimal(random.randint(800, 1000)),
+                            quantity=random.randint(1, 20),
+                            discount=random.random() < 0.3,
+                            created_at=now - timedelta(hours=random.randint(0, 24 * 365)),
+                        )
+                        for _ in range(orders_per_product)
+                    ],
+                    batch_size=1000,
+                )
+                ProductSalesRollup.add_orders(orders)
+            self.stdout.write(f"  Seeded {product_count} products for {owner.username}")
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded {len(owners) * product_count} products"))
+        return user
+
+    def action_querysets(self, user, product):
+        """
+        Build the querysets the product endpoints run, through the viewset itself.
+        """
+
+        def view_for(action, **params):
+            request = Request(APIRequestFactory().get("/", params))
+            request.user = user
+            return ProductViewSet(request=request, action=action, kwargs={"pk": product.pk}, format_kwarg=None)
+
+        page_size = ProductCursorPagination.page_size
+        products_ordering = ProductCursorPagination.ordering
+        orders = product.delivered_orders_list.all()
+        return [
+            (
+                "with-costs",
+                view_for("products_with_costs")
+                .get_queryset()
+                .filter(product_cost__isnull=False)
+                .order_by(*products_ordering)[:page_size],
+            ),
+            (
+                "without-costs",
+                view_for("products_without_costs")
+                .get_queryset()
+                .filter(product_cost__isnull=True)
+                .order_by(*products_ordering)[:page_size],
+            ),
+            ("retrieve", view_for("retrieve").get_queryset().filter(pk=product.pk)),
+            (
+                "orders",
+                orders.order_by(*DeliveredOrderCursorPagination.ordering)[: DeliveredOrderCursorPagination.page_size],
+            ),
+            ("series (product)", orders.time_series("day")),
+            ("series (all products)", DeliveredOrder.objects.filter(product__user=user).time_series("week")),
+        ]
+
+    def explain_actions(self, user, product):
+        """
+        Print the query plan and the execution time of each endpoint query.
+        """
+        analyze = connection.vendor == "postgresql"
+        for name, queryset in self.action_querysets(user, product):
+            self.stdout.write(self.style.SUCCESS(f"{name}:"))
+            # EXPLAIN ANALYZE is PostgreSQL only, other databases get the plain plan
+            plan = queryset.explain(analyze=True) if analyze else queryset.explain()
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
+
+            start = time.perf_counter()
+            list(queryset)
+            self.stdout.write(f"    Fetched in {(time.perf_counter() - start) * 1000:.2f} ms")
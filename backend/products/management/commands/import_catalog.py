@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalog_import import CatalogImporter
+from products.models import CatalogImport
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports products, product costs and delivered orders from CSV files, using COPY on PostgreSQL. "
+        "A failed or interrupted import can be resumed with --resume"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", type=str, help="Username the imported products belong to")
+        parser.add_argument("--products", type=str, help="CSV file of products")
+        parser.add_argument("--costs", type=str, help="CSV file of product costs")
+        parser.add_argument("--orders", type=str, help="CSV file of delivered orders")
+        parser.add_argument("--resume", type=int, help="Id of a previous import to resume")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Number of rows per transaction")
+
+    def handle(self, *args, **options):
+        if options.get("resume"):
+            try:
+                catalog_import = CatalogImport.objects.get(pk=options["resume"])
+            except CatalogImport.DoesNotExist:
+                raise CommandError(f"Catalog import {options['resume']} does not exist")
+            if catalog_import.status == CatalogImport.STATUS_COMPLETED:
+                self.stdout.write(self.style.SUCCESS(f"Catalog import {catalog_import.pk} is already completed"))
+                return
+            self.stdout.write(f"Resuming catalog import {catalog_import.pk}")
+        else:
+            username = options.get("username")
+            if not username:
+                raise CommandError("--username is required unless --resume is given")
+            try:
+                user = User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"User {username} does not exist")
+            if not any(options.get(name) for name in ("products", "costs", "orders")):
+                raise CommandError("At least one of --products, --costs or --orders is required")
+
+            catalog_import = CatalogImport.objects.create(
+                user=user,
+                products_file=options.get("products") or "",
+                product_costs_file=options.get("costs") or "",
+                delivered_orders_file=options.get("orders") or "",
+            )
+            self.stdout.write(f"Created catalog import {catalog_import.pk}")
+
+        def progress(stage, done):
+            self.stdout.write(f"  {stage}: {done} rows imported")
+
+        catalog_import = CatalogImporter(catalog_import, chunk_size=options["chunk_size"], progress=progress).run()
+
+        if catalog_import.status == CatalogImport.STATUS_FAILED:
+            raise CommandError(
+                f"Catalog import {catalog_import.pk} failed: {catalog_import.error}\n"
+                f"Fix the file and run again with --resume {catalog_import.pk}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {catalog_import.products_done} products, {catalog_import.product_costs_done} product "
+                f"costs and {catalog_import.delivered_orders_done} delivered orders"
+            )
+        )
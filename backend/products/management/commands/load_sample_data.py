@@ -3,7 +3,7 @@ from decimal import Decimal
 from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
 
-from products.models import DeliveredOrder, Product, ProductCost
+from products.models import DeliveredOrder, Product, ProductCost, ProductSalesRollup
 
 User = get_user_model()
 
@@ -253,9 +253,11 @@ class Command(BaseCommand):
                 ProductCost.objects.create(product=product, **product_cost_data)
                 self.stdout.write(f"  Added product costs for {product.product_name}")
 
-            # Create delivered orders
-            for order_data in delivered_orders_data:
-                DeliveredOrder.objects.create(product=product, **order_data)
+            # Create delivered orders and add them to the product's sales rollup
+            orders = DeliveredOrder.objects.bulk_create(
+                [DeliveredOrder(product=product, **order_data) for order_data in delivered_orders_data]
+            )
+            ProductSalesRollup.add_orders(orders)
 
             self.stdout.write(f"  Added {len(delivered_orders_data)} delivered orders for {product.product_name}")
             self.stdout.write(self.style.SUCCESS(f"Created product: {product.product_name}"))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from products.models import ProductSalesRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-product sales rollups from the delivered orders, or verifies them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--product", type=int, action="append", help="Only process this product id (repeatable)")
+        parser.add_argument(
+            "--verify", action="store_true", help="Only report rollups that differ from the orders, without writing"
+        )
+
+    def handle(self, *args, **options):
+        product_ids = options.get("product")
+
+        if not options.get("verify"):
+            count = ProductSalesRollup.rebuild(product_ids)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} sales rollups"))
+            return
+
+        fields = list(ProductSalesRollup.empty())
+        expected = ProductSalesRollup.compute(product_ids)
+        rollups = ProductSalesRollup.objects.all()
+        if product_ids:
+            rollups = rollups.filter(product_id__in=product_ids)
+        stored = {rollup.pop("product_id"): rollup for rollup in rollups.values("product_id", *fields)}
+
+        mismatches = 0
+        for product_id in sorted(set(expected) | set(stored)):
+            actual = stored.get(product_id, ProductSalesRollup.empty())
+            wanted = expected.get(product_id, ProductSalesRollup.empty())
+            differences = [field for field in fields if actual[field] != wanted[field]]
+            if differences:
+                mismatches += 1
+                details = ", ".join(f"{field}: {actual[field]} != {wanted[field]}" for field in differences)
+                self.stdout.write(self.style.ERROR(f"  Product {product_id}: {details}"))
+
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} sales rollups are out of date"))
+        else:
+            self.stdout.write(self.style.SUCCESS("All sales rollups are up to date"))
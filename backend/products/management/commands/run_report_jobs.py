@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from products import report_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the queued agent report jobs. Use with REPORT_JOB_BACKEND=queue to generate the reports "
+        "outside of the web processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run the pending jobs and exit instead of polling")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument(
+            "--requeue-after",
+            type=int,
+            default=15,
+            help="Minutes after which a running job is considered abandoned and queued again",
+        )
+
+    def handle(self, *args, **options):
+        requeue_after = timedelta(minutes=options["requeue_after"])
+        while True:
+            requeued = report_jobs.requeue_stale_jobs(requeue_after)
+            if requeued:
+                self.stdout.write(f"Queued {requeued} abandoned jobs again")
+
+            done = report_jobs.run_pending_jobs()
+            if done:
+                self.stdout.write(self.style.SUCCESS(f"Ran {done} report jobs"))
+
+            if options["once"]:
+                return
+            if not done:
+                time.sleep(options["interval"])
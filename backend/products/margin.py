@@ -0,0 +1,270 @@
+"""
+Margin engine: the unit economics of a product, computed with Decimal.
+
+These are the formulas of the ``calculate_profit_marginn`` tool of the margin
+analysis agent, which now calls this module instead of doing the arithmetic
+itself. The backend computes the same figures directly from the financial
+data sent to Agent 1 (see ``utils.agent_financial_data``), without waiting
+for the agent.
+
+The agent service imports this module as ``backend.products.margin``, so it
+must only depend on the standard library.
+
+The agents do not receive the product's order list, whose size grows with the
+sales history, but an order summary (see ``summarize_orders``): the orders
+grouped by price and discount flag, the totals and a bounded monthly series,
+which the backend aggregates in the database (see ``utils.order_summaries``).
+Grouping orders of the same price does not change the revenue, so the tool
+computes the same margin from the groups as from the orders.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal
+
+HUNDREDTHS = Decimal("0.01")
+
+# Categories of the user's fixed costs, see fixed_costs.models.FixedCosts
+FIXED_COST_FIELDS = ("rental", "employees", "communication", "dev", "transportation", "other")
+
+# Number of months, with orders, of the series in an order summary
+ORDER_SERIES_MONTHS = 12
+
+INPUT_FIELDS = (
+    "selling_price",
+    "total_units_sold",
+    "total_units_returned",
+    "product_cost_per_unit",
+    "packaging_cost_per_unit",
+    "confirmation_fees_per_unit",
+    "marketing_cost_per_unit",
+    "return_cost_per_unit",
+    "fixed_cost_total",
+)
+
+
+def to_decimal(value):
+    """
+    Convert a number, a numeric string or None (zero) to a Decimal, without going through binary floats.
+    """
+    if value is None or value == "":
+        return Decimal("0")
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def quantize(value):
+    return value.quantize(HUNDREDTHS, rounding=ROUND_HALF_UP)
+
+
+def calculate_margin(
+    selling_price,
+    total_units_sold,
+    total_units_returned,
+    product_cost_per_unit,
+    packaging_cost_per_unit,
+    confirmation_fees_per_unit,
+    marketing_cost_per_unit,
+    return_cost_per_unit,
+    fixed_cost_total,
+    order_details,
+):
+    """
+    Calculate the profit margin of a product from its unit economics.
+
+    Args:
+        selling_price: Average price after discounts
+        total_units_sold (int): Total quantity sold (before returns)
+        total_units_returned (int): Quantity returned
+        product_cost_per_unit: Cost per unit of product
+        packaging_cost_per_unit: Packaging cost per unit
+        confirmation_fees_per_unit: Confirmation/transaction fees per unit
+        marketing_cost_per_unit: Marketing cost per unit
+        return_cost_per_unit: Return handling cost per unit returned
+        fixed_cost_total: Total fixed cost (allocated once)
+        order_details (list): (price, quantity) pairs, one per order
+
+    Returns:
+        dict: The inputs as Decimals and ints, and total_revenue, total_costs, total_profit,
+            profit_margin (%), fixed_cost_per_unit and return_rate (%) rounded to the hundredth
+    """
+    inputs = {
+        "selling_price": to_decimal(selling_price),
+        "total_units_sold": int(total_units_sold),
+        "total_units_returned": int(total_units_returned),
+        "product_cost_per_unit": to_decimal(product_cost_per_unit),
+        "packaging_cost_per_unit": to_decimal(packaging_cost_per_unit),
+        "confirmation_fees_per_unit": to_decimal(confirmation_fees_per_unit),
+        "marketing_cost_per_unit": to_decimal(marketing_cost_per_unit),
+        "return_cost_per_unit": to_decimal(return_cost_per_unit),
+        "fixed_cost_total": to_decimal(fixed_cost_total),
+        "order_details": [
+            {"price": to_decimal(price), "quantity": to_decimal(quantity)} for price, quantity in order_details
+        ],
+    }
+    units_sold = inputs["total_units_sold"]
+    units_returned = inputs["total_units_returned"]
+
+    # Revenue, from the actual price of each order as some are discounted
+    total_revenue = sum((order["price"] * order["quantity"] for order in inputs["order_details"]), Decimal("0"))
+
+    # Variable costs are paid for the returned units too, which also cost their return handling
+    unit_variable_cost = (
+        inputs["product_cost_per_unit"]
+        + inputs["packaging_cost_per_unit"]
+        + inputs["confirmation_fees_per_unit"]
+        + inputs["marketing_cost_per_unit"]
+    )
+    total_product_cost = unit_variable_cost * (units_sold + units_returned)
+    total_return_cost = inputs["return_cost_per_unit"] * units_returned
+    total_costs = total_product_cost + inputs["fixed_cost_total"] + total_return_cost
+
+    total_profit = total_revenue - total_costs
+    profit_margin = 100 * total_profit / total_revenue if total_revenue > 0 else Decimal("0")
+    fixed_cost_per_unit = inputs["fixed_cost_total"] / units_sold if units_sold > 0 else Decimal("0")
+    return_rate = Decimal(100 * units_returned) / (units_sold + units_returned) if units_sold > 0 else Decimal("0")
+
+    return {
+        "inputs": inputs,
+        "total_revenue": quantize(total_revenue),
+        "total_costs": quantize(total_costs),
+        "total_profit": quantize(total_profit),
+        "profit_margin": quantize(profit_margin),
+        "fixed_cost_per_unit": quantize(fixed_cost_per_unit),
+        "return_rate": quantize(return_rate),
+    }
+
+
+def summarize_orders(orders, months=ORDER_SERIES_MONTHS):
+    """
+    Summarize serialized delivered orders into a payload of bounded size for the agents.
+
+    Args:
+        orders (list): Orders as serialized by ``fast_serializers.delivered_orders_by_product``
+        months (int): Number of most recent months with orders to include in the series, at least 1
+
+    Returns:
+        dict: order_count, total_units, total_revenue, price_groups (price, discount, quantity and
+            order_count of the orders at each price, highest price first) and monthly_series (month,
+            units, revenue and order_count, oldest first)
+    """
+    groups = {}
+    series = {}
+    total_units = 0
+    total_revenue = Decimal("0")
+    orders = list(orders)
+    for order in orders:
+        price = to_decimal(order["price"])
+        quantity = int(order["quantity"])
+        revenue = price * quantity
+        total_units += quantity
+        total_revenue += revenue
+
+        group = groups.setdefault((price, bool(order.get("discount"))), [0, 0])
+        group[0] += quantity
+        group[1] += 1
+        # "YYYY-MM" of the ISO 8601 created_at
+        point = series.setdefault(order["created_at"][:7], [0, Decimal("0"), 0])
+        point[0] += quantity
+        point[1] += revenue
+        point[2] += 1
+
+    return order_summary(
+        len(orders),
+        total_units,
+        total_revenue,
+        [(price, discount, *group) for (price, discount), group in sorted(groups.items(), reverse=True)],
+        [(month, *point) for month, point in sorted(series.items())[-months:]],
+    )
+
+
+def order_summary(order_count, total_units, total_revenue, price_groups, monthly_series):
+    """
+    Build an order summary from aggregates of the orders, e.g. computed by the database.
+
+    Args:
+        order_count (int): Number of orders
+        total_units (int): Sum of their quantity
+        total_revenue: Sum of their price * quantity
+        price_groups (iterable): (price, discount, quantity, order_count) tuples, highest price first
+        monthly_series (iterable): ("YYYY-MM", units, revenue, order_count) tuples, oldest first
+
+    Returns:
+        dict: The summary, see ``summarize_orders``
+    """
+    return {
+        "order_count": order_count,
+        "total_units": total_units,
+        "total_revenue": str(quantize(to_decimal(total_revenue))),
+        "price_groups": [
+            {
+                "price": str(quantize(to_decimal(price))),
+                "discount": discount,
+                "quantity": quantity,
+                "order_count": count,
+            }
+            for price, discount, quantity, count in price_groups
+        ],
+        "monthly_series": [
+            {"month": month, "units": units, "revenue": str(quantize(to_decimal(revenue))), "order_count": count}
+            for month, units, revenue, count in monthly_series
+        ],
+    }
+
+
+def margin_inputs(financial_data):
+    """
+    Extract the inputs of ``calculate_margin`` from the financial data sent to Agent 1.
+
+    Args:
+        financial_data (dict): {"user": {"fixed_costs": ...}, "product_details": ...}, with the
+            order summary of the product, or its delivered orders
+
+    Returns:
+        dict: Keyword arguments of ``calculate_margin``
+    """
+    product = financial_data["product_details"]
+    costs = product.get("product_cost") or {}
+    fixed_costs = financial_data.get("user", {}).get("fixed_costs") or {}
+    summary = product.get("order_summary") or summarize_orders(product.get("delivered_orders", []))
+    return {
+        "selling_price": product["product_selling_price"],
+        "total_units_sold": summary["total_units"],
+        "total_units_returned": product.get("total_returns") or 0,
+        "product_cost_per_unit": costs.get("product_cost"),
+        "packaging_cost_per_unit": costs.get("packaging_fees"),
+        "confirmation_fees_per_unit": costs.get("confirmation_fees"),
+        "marketing_cost_per_unit": costs.get("ads_cost"),
+        "return_cost_per_unit": costs.get("return_cost"),
+        # Only the categories: the serialized fixed costs also hold their id and total
+        "fixed_cost_total": sum((to_decimal(fixed_costs.get(field)) for field in FIXED_COST_FIELDS), Decimal("0")),
+        "order_details": [(group["price"], group["quantity"]) for group in summary["price_groups"]],
+    }
+
+
+def product_margin(financial_data):
+    """
+    Calculate the margin of the product described by the financial data sent to Agent 1.
+    """
+    return calculate_margin(**margin_inputs(financial_data))
+
+
+def convert_numbers(value, convert):
+    """
+    Apply ``convert`` (e.g. str or float) to the Decimals of a ``calculate_margin`` result, for JSON.
+    """
+    if isinstance(value, dict):
+        return {key: convert_numbers(item, convert) for key, item in value.items()}
+    if isinstance(value, list):
+        return [convert_numbers(item, convert) for item in value]
+    if isinstance(value, Decimal):
+        return convert(value)
+    return value
+
+
+def margin_summary(financial_data):
+    """
+    Calculate the margin of a product for the API responses: Decimals as strings, without the order list.
+    """
+    result = product_margin(financial_data)
+    result["inputs"] = {field: result["inputs"][field] for field in INPUT_FIELDS}
+    return convert_numbers(result, str)
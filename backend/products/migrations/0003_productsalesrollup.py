@@ -0,0 +1,68 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Min, Q, Sum
+
+
+def build_sales_rollups(apps, schema_editor):
+    """Create the rollups of the orders recorded before the table existed."""
+    DeliveredOrder = apps.get_model('products', 'DeliveredOrder')
+    ProductSalesRollup = apps.get_model('products', 'ProductSalesRollup')
+
+    line_total = ExpressionWrapper(F('price') * F('quantity'), output_field=DecimalField(max_digits=20, decimal_places=2))
+    discounted = Q(discount=True)
+    rows = DeliveredOrder.objects.order_by().values('product_id').annotate(
+        units_sold=Sum('quantity'),
+        revenue=Sum(line_total),
+        discounted_units=Sum('quantity', filter=discounted),
+        discounted_revenue=Sum(line_total, filter=discounted),
+        order_count=Count('id'),
+        first_order_at=Min('created_at'),
+        last_order_at=Max('created_at'),
+    )
+    ProductSalesRollup.objects.bulk_create(
+        [
+            ProductSalesRollup(
+                product_id=row['product_id'],
+                units_sold=row['units_sold'],
+                revenue=row['revenue'],
+                discounted_units=row['discounted_units'] or 0,
+                discounted_revenue=row['discounted_revenue'] or 0,
+                order_count=row['order_count'],
+                first_order_at=row['first_order_at'],
+                last_order_at=row['last_order_at'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_alter_deliveredorder_options_alter_product_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesRollup',
+            fields=[
+                ('product', models.OneToOneField(help_text='The product these sales figures belong to', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_rollup', serialize=False, to='products.product')),
+                ('units_sold', models.PositiveBigIntegerField(default=0, help_text='Total units sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Total revenue', max_digits=20)),
+                ('discounted_units', models.PositiveBigIntegerField(default=0, help_text='Units sold with a discount')),
+                ('discounted_revenue', models.DecimalField(decimal_places=2, default=0, help_text='Revenue of the orders sold with a discount', max_digits=20)),
+                ('order_count', models.PositiveIntegerField(default=0, help_text='Number of delivered orders')),
+                ('first_order_at', models.DateTimeField(blank=True, help_text='Timestamp of the oldest order', null=True)),
+                ('last_order_at', models.DateTimeField(blank=True, help_text='Timestamp of the most recent order', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='Timestamp when the rollup was last updated')),
+            ],
+            options={
+                'verbose_name': 'Product Sales Rollup',
+                'verbose_name_plural': 'Product Sales Rollups',
+            },
+        ),
+        migrations.RunPython(build_sales_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_productsalesrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deliveredorder',
+            index=models.Index(fields=['product', 'created_at'], name='order_product_created_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_deliveredorder_product_created_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='deliveredorder',
+            name='order_product_created_idx',
+        ),
+        migrations.AlterField(
+            model_name='deliveredorder',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Timestamp when the order was recorded'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveredorder',
+            index=models.Index(fields=['product', '-created_at'], name='order_product_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['user', '-updated_at', '-id'], name='product_user_updated_idx'),
+        ),
+    ]
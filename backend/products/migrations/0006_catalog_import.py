@@ -0,0 +1,96 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("products", "0005_product_and_order_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogImport",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "products_file",
+                    models.CharField(blank=True, help_text="Path of the products CSV file", max_length=500),
+                ),
+                (
+                    "product_costs_file",
+                    models.CharField(blank=True, help_text="Path of the product costs CSV file", max_length=500),
+                ),
+                (
+                    "delivered_orders_file",
+                    models.CharField(blank=True, help_text="Path of the delivered orders CSV file", max_length=500),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("products_done", models.PositiveBigIntegerField(default=0, help_text="Product rows imported so far")),
+                (
+                    "product_costs_done",
+                    models.PositiveBigIntegerField(default=0, help_text="Product cost rows imported so far"),
+                ),
+                (
+                    "delivered_orders_done",
+                    models.PositiveBigIntegerField(default=0, help_text="Delivered order rows imported so far"),
+                ),
+                ("error", models.TextField(blank=True, help_text="Why the import failed, if it did")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, help_text="Timestamp when the import was created"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, help_text="Timestamp when the import was last updated"),
+                ),
+            ],
+            options={
+                "verbose_name": "Catalog Import",
+                "verbose_name_plural": "Catalog Imports",
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="external_ref",
+            field=models.CharField(
+                blank=True,
+                help_text="Identifier of the product in the merchant's own catalogue, used to match imported data",
+                max_length=100,
+                null=True,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="product",
+            constraint=models.UniqueConstraint(
+                fields=("user", "external_ref"), name="product_user_external_ref_unique"
+            ),
+        ),
+        migrations.AddField(
+            model_name="catalogimport",
+            name="user",
+            field=models.ForeignKey(
+                help_text="User the imported products belong to",
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="catalog_imports",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
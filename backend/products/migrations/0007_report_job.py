@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:30
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_catalog_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload_key', models.CharField(help_text='Report cache key of the financial data', max_length=100)),
+                ('financial_data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='The payload sent to Agent 1')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('report_1', models.JSONField(blank=True, help_text='The report of Agent 1', null=True)),
+                ('report_2', models.JSONField(blank=True, help_text='The report of Agent 2', null=True)),
+                ('error', models.TextField(blank=True, help_text='Why the job failed, if it did')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Timestamp when the job was queued')),
+                ('started_at', models.DateTimeField(blank=True, help_text='Timestamp when a worker picked the job up', null=True)),
+                ('finished_at', models.DateTimeField(blank=True, help_text='Timestamp when the job completed or failed', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='Timestamp when the job was last updated')),
+                ('product', models.ForeignKey(help_text='The product the reports are about', on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'Report Job',
+                'verbose_name_plural': 'Report Jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['product', '-finished_at'], name='reportjob_product_finished_idx'), models.Index(fields=['status', 'created_at'], name='reportjob_status_created_idx')],
+            },
+        ),
+    ]
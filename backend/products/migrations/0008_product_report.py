@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_report_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(help_text="Number of the snapshot among the product's snapshots")),
+                ('payload_key', models.CharField(help_text='Hash of the financial data the agents analysed', max_length=100)),
+                ('report_1', models.JSONField(help_text='The report of Agent 1')),
+                ('report_2', models.JSONField(help_text='The report of Agent 2')),
+                ('model_name', models.CharField(blank=True, help_text='The LLM(s) that wrote the reports', max_length=200)),
+                ('input_tokens', models.PositiveIntegerField(default=0, help_text='Prompt tokens used by both agent runs')),
+                ('output_tokens', models.PositiveIntegerField(default=0, help_text='Completion tokens used by both agent runs')),
+                ('total_tokens', models.PositiveIntegerField(default=0, help_text='Tokens used by both agent runs')),
+                ('latency_ms', models.PositiveIntegerField(blank=True, help_text='Duration of both agent runs', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Timestamp when the snapshot was recorded')),
+                ('product', models.ForeignKey(help_text='The product the reports are about', on_delete=django.db.models.deletion.CASCADE, related_name='reports', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'Product Report',
+                'verbose_name_plural': 'Product Reports',
+                'ordering': ['product', '-version'],
+                'indexes': [models.Index(fields=['product', 'payload_key', '-version'], name='productreport_payload_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productreport',
+            constraint=models.UniqueConstraint(fields=('product', 'version'), name='productreport_product_version_uniq'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    """Keep the newest of the queued or running jobs of the same product and payload, fail the others."""
+    ReportJob = apps.get_model('products', 'ReportJob')
+
+    active = ReportJob.objects.filter(status__in=['pending', 'running']).order_by('product_id', 'payload_key', '-created_at')
+    seen = set()
+    duplicates = []
+    for job_id, product_id, payload_key in active.values_list('id', 'product_id', 'payload_key'):
+        if (product_id, payload_key) in seen:
+            duplicates.append(job_id)
+        seen.add((product_id, payload_key))
+    ReportJob.objects.filter(pk__in=duplicates).update(status='failed', error='Superseded by an identical job')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_report'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reportjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('product', 'payload_key'), name='reportjob_active_uniq'),
+        ),
+    ]
@@ -1,7 +1,25 @@
-import json
+from decimal import Decimal
 
 from django.conf import settings
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Count,
+    DecimalField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Prefetch,
+    Q,
+    Sum,
+    Value,
+    Window,
+)
+from django.db.models.functions import Coalesce, Greatest, Least, RowNumber, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
 
 
 class ProductCost(models.Model):
@@ -66,6 +84,75 @@ class ProductCost(models.Model):
         return self.product_cost + self.confirmation_fees + self.packaging_fees + self.return_cost + self.ads_cost
 
 
+class DeliveredOrderQuerySet(models.QuerySet):
+    """
+    Custom QuerySet for the DeliveredOrder model.
+    """
+
+    TRUNCATIONS = {"day": TruncDay, "week": TruncWeek, "month": TruncMonth}
+
+    def time_series(self, interval="day", group_by=(), last=None):
+        """
+        Aggregate the orders into time buckets, computed by the database.
+
+        The orders are grouped on ``created_at`` truncated to the start of the
+        day, week (Monday) or month, so only one row per bucket is returned.
+
+        Args:
+            interval (str, optional): One of "day", "week" or "month". Defaults to "day".
+            group_by (tuple, optional): Fields to group on before the period, e.g. ("product_id",)
+            last (int, optional): Only return the latest ``last`` buckets with orders of each group,
+                numbered by the database with a window function. Defaults to all of them.
+
+        Returns:
+            QuerySet: Dicts with the group_by fields, period, revenue, units, discounted_units,
+            discounted_revenue and order_count, ordered by the group_by fields and period
+        """
+        line_total = ExpressionWrapper(
+            F("price") * F("quantity"), output_field=DecimalField(max_digits=20, decimal_places=2)
+        )
+        discounted = Q(discount=True)
+        series = (
+            self.annotate(period=self.TRUNCATIONS[interval]("created_at"))
+            .values(*group_by, "period")
+            .annotate(
+                revenue=Sum(line_total),
+                units=Sum("quantity"),
+                discounted_units=Coalesce(Sum("quantity", filter=discounted), 0),
+                discounted_revenue=Coalesce(
+                    Sum(line_total, filter=discounted),
+                    Value(Decimal("0")),
+                    output_field=DecimalField(max_digits=20, decimal_places=2),
+                ),
+                order_count=Count("id"),
+            )
+            .order_by(*group_by, "period")
+        )
+        if last is None:
+            return series
+        recency = Window(
+            RowNumber(), partition_by=[F(field) for field in group_by] or None, order_by=F("period").desc()
+        )
+        return series.annotate(recency=recency).filter(recency__lte=last)
+
+    def price_groups(self, group_by=()):
+        """
+        Aggregate the orders by price and discount flag, computed by the database.
+
+        Args:
+            group_by (tuple, optional): Fields to group on before the price, e.g. ("product_id",)
+
+        Returns:
+            QuerySet: Dicts with the group_by fields, price, discount, quantity and order_count,
+            ordered by the group_by fields then highest price first, discounted first
+        """
+        return (
+            self.values(*group_by, "price", "discount")
+            .annotate(quantity=Sum("quantity"), order_count=Count("id"))
+            .order_by(*group_by, "-price", "-discount")
+        )
+
+
 class DeliveredOrder(models.Model):
     """
     Model representing a delivered order for a product.
@@ -91,12 +178,18 @@ class DeliveredOrder(models.Model):
         related_name="delivered_orders_list",
         help_text="The product this order is associated with",
     )
-    created_at = models.DateTimeField(auto_now_add=True, help_text="Timestamp when the order was recorded")
+    created_at = models.DateTimeField(default=timezone.now, help_text="Timestamp when the order was recorded")
+
+    objects = DeliveredOrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Delivered Order"
         verbose_name_plural = "Delivered Orders"
         ordering = ["-created_at"]
+        indexes = [
+            # Newest orders of one product first (pagination), and range scans for the time series
+            models.Index(fields=["product", "-created_at"], name="order_product_recent_idx"),
+        ]
 
     def __str__(self):
         return f"Order of {self.quantity} units at {self.price} each"
@@ -110,6 +203,94 @@ class DeliveredOrder(models.Model):
         """
         return self.price * self.quantity
 
+    def save(self, *args, **kwargs):
+        """
+        Save the order and keep the product's sales rollup up to date.
+
+        A new order is added to the rollup incrementally. Editing an existing order
+        recomputes the rollup of the affected product(s), which is rarer and needs
+        the previous values.
+        """
+        with transaction.atomic():
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                ProductSalesRollup.add_orders([self])
+            else:
+                previous_product_id = (
+                    DeliveredOrder.objects.filter(pk=self.pk).values_list("product_id", flat=True).first()
+                )
+                super().save(*args, **kwargs)
+                ProductSalesRollup.rebuild({self.product_id, previous_product_id} - {None})
+
+    def delete(self, *args, **kwargs):
+        """
+        Delete the order and recompute the sales rollup of its product.
+        """
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            ProductSalesRollup.rebuild([self.product_id])
+        return result
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+    Custom QuerySet for the Product model.
+
+    Provides helpers that push sales computations down to the database so that
+    callers do not need to load every DeliveredOrder row into Python.
+    """
+
+    def with_financials(self):
+        """
+        Annotate each product with its sales aggregates.
+
+        The aggregates are read from the ProductSalesRollup table through a single
+        LEFT JOIN, so the cost per product is constant regardless of the length of
+        its order history. Products without any order get zeros.
+
+        Annotations:
+            revenue (Decimal): Sum of price * quantity over all orders
+            units_sold (int): Sum of quantity over all orders
+            discounted_units (int): Sum of quantity over orders sold with a discount
+            order_count (int): Number of delivered orders
+
+        Returns:
+            ProductQuerySet: The annotated queryset
+        """
+        return self.annotate(
+            revenue=Coalesce(
+                F("sales_rollup__revenue"),
+                Value(Decimal("0")),
+                output_field=DecimalField(max_digits=20, decimal_places=2),
+            ),
+            units_sold=Coalesce(F("sales_rollup__units_sold"), 0),
+            discounted_units=Coalesce(F("sales_rollup__discounted_units"), 0),
+            order_count=Coalesce(F("sales_rollup__order_count"), 0),
+        )
+
+    def with_cost_flag(self):
+        """
+        Annotate each product with ``has_product_costs`` computed by an EXISTS subquery.
+
+        This avoids one query per product when the flag is read from instances that
+        were not loaded with ``select_related("product_cost")``.
+
+        Returns:
+            ProductQuerySet: The annotated queryset
+        """
+        return self.annotate(has_product_costs=Exists(ProductCost.objects.filter(product=OuterRef("pk"))))
+
+    def with_orders(self):
+        """
+        Prefetch the delivered orders of each product, newest first, in one extra query.
+
+        Returns:
+            ProductQuerySet: The queryset with the orders prefetched
+        """
+        return self.prefetch_related(
+            Prefetch("delivered_orders_list", queryset=DeliveredOrder.objects.order_by("-created_at", "-id"))
+        )
+
 
 class Product(models.Model):
     """
@@ -125,6 +306,7 @@ class Product(models.Model):
         product_image (CharField): Path to the product image
         product_selling_price (DecimalField): Current selling price
         product_description (TextField): Detailed description of the product
+        external_ref (CharField): Identifier of the product in the merchant's catalogue, if imported
         total_returns (PositiveIntegerField): Total number of product returns
         user (ForeignKey): The user who owns/manages this product
         created_at (DateTimeField): When the product was created
@@ -138,6 +320,12 @@ class Product(models.Model):
         max_digits=10, decimal_places=2, help_text="Current selling price of the product"
     )
     product_description = models.TextField(help_text="Detailed description of the product")
+    external_ref = models.CharField(
+        max_length=100,
+        null=True,
+        blank=True,
+        help_text="Identifier of the product in the merchant's own catalogue, used to match imported data",
+    )
     total_returns = models.PositiveIntegerField(default=0, help_text="Total number of product returns")
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -148,10 +336,19 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, help_text="Timestamp when the product was created")
     updated_at = models.DateTimeField(auto_now=True, help_text="Timestamp when the product was last updated")
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Product"
         verbose_name_plural = "Products"
         ordering = ["-updated_at"]
+        indexes = [
+            # A user's products, most recently updated first (listings and their cursor pagination)
+            models.Index(fields=["user", "-updated_at", "-id"], name="product_user_updated_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "external_ref"], name="product_user_external_ref_unique"),
+        ]
 
     def __str__(self):
         return self.product_name
@@ -162,13 +359,50 @@ class Product(models.Model):
         Check if the product has associated product costs.
 
         This property is useful for filtering products based on whether they
-        have cost information available or not.
+        have cost information available or not. When the instance was loaded
+        through ``Product.objects.with_cost_flag()`` the annotated value is used
+        instead of querying the related ProductCost.
 
         Returns:
             bool: True if the product has associated product costs, False otherwise
         """
+        if "_has_product_costs" in self.__dict__:
+            return self._has_product_costs
         return hasattr(self, "product_cost")
 
+    @has_product_costs.setter
+    def has_product_costs(self, value):
+        # Receives the value of the with_cost_flag() annotation
+        self._has_product_costs = value
+
+    @property
+    def average_realized_price(self):
+        """
+        Average price per unit actually obtained across all delivered orders.
+
+        Requires the instance to come from ``Product.objects.with_financials()``.
+
+        Returns:
+            Decimal: revenue / units_sold, or 0 if nothing was sold
+        """
+        if not self.units_sold:
+            return Decimal("0")
+        return self.revenue / self.units_sold
+
+    @property
+    def discount_share(self):
+        """
+        Share of the units sold that were sold with a discount.
+
+        Requires the instance to come from ``Product.objects.with_financials()``.
+
+        Returns:
+            Decimal: discounted_units / units_sold (between 0 and 1), or 0 if nothing was sold
+        """
+        if not self.units_sold:
+            return Decimal("0")
+        return Decimal(self.discounted_units) / Decimal(self.units_sold)
+
     def add_delivered_order(self, price, quantity, discount=False):
         """
         Helper method to add a delivered order to this product.
@@ -185,3 +419,410 @@ class Product(models.Model):
             DeliveredOrder: The newly created delivered order instance
         """
         return DeliveredOrder.objects.create(product=self, price=price, quantity=quantity, discount=discount)
+
+
+class ProductSalesRollup(models.Model):
+    """
+    Model holding pre-aggregated sales figures for a product.
+
+    The rollup is maintained incrementally whenever delivered orders are created,
+    so reading the financials of a product does not require scanning its order
+    history. Orders created through ``DeliveredOrder.save`` (including
+    ``Product.add_delivered_order`` and the admin) update it automatically; code
+    using ``bulk_create`` must call ``ProductSalesRollup.add_orders`` itself.
+    The ``rebuild_sales_rollups`` management command recomputes or verifies it.
+
+    Attributes:
+        product (OneToOneField): The product these figures belong to
+        units_sold (PositiveBigIntegerField): Sum of the quantity of all orders
+        revenue (DecimalField): Sum of price * quantity of all orders
+        discounted_units (PositiveBigIntegerField): Units sold with a discount
+        discounted_revenue (DecimalField): Revenue of the orders sold with a discount
+        order_count (PositiveIntegerField): Number of delivered orders
+        first_order_at (DateTimeField): When the oldest order was recorded
+        last_order_at (DateTimeField): When the most recent order was recorded
+        updated_at (DateTimeField): When the rollup was last updated
+    """
+
+    TOTAL_FIELDS = ("units_sold", "revenue", "discounted_units", "discounted_revenue", "order_count")
+
+    product = models.OneToOneField(
+        "Product",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="sales_rollup",
+        help_text="The product these sales figures belong to",
+    )
+    units_sold = models.PositiveBigIntegerField(default=0, help_text="Total units sold")
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0, help_text="Total revenue")
+    discounted_units = models.PositiveBigIntegerField(default=0, help_text="Units sold with a discount")
+    discounted_revenue = models.DecimalField(
+        max_digits=20, decimal_places=2, default=0, help_text="Revenue of the orders sold with a discount"
+    )
+    order_count = models.PositiveIntegerField(default=0, help_text="Number of delivered orders")
+    first_order_at = models.DateTimeField(null=True, blank=True, help_text="Timestamp of the oldest order")
+    last_order_at = models.DateTimeField(null=True, blank=True, help_text="Timestamp of the most recent order")
+    updated_at = models.DateTimeField(auto_now=True, help_text="Timestamp when the rollup was last updated")
+
+    class Meta:
+        verbose_name = "Product Sales Rollup"
+        verbose_name_plural = "Product Sales Rollups"
+
+    def __str__(self):
+        return f"Sales rollup for product {self.product_id}"
+
+    @classmethod
+    def add_orders(cls, orders):
+        """
+        Add newly created delivered orders to the rollups of their products.
+
+        The orders are summed in Python and each affected rollup is updated with a
+        single UPDATE using F() expressions, so concurrent writers do not lose
+        increments.
+
+        Args:
+            orders (iterable of DeliveredOrder): Orders that were just saved
+        """
+        deltas = {}
+        for order in orders:
+            delta = deltas.setdefault(
+                order.product_id,
+                {**cls.empty(), "first_order_at": order.created_at, "last_order_at": order.created_at},
+            )
+            total = Decimal(str(order.price)) * order.quantity
+            delta["units_sold"] += order.quantity
+            delta["revenue"] += total
+            if order.discount:
+                delta["discounted_units"] += order.quantity
+                delta["discounted_revenue"] += total
+            delta["order_count"] += 1
+            delta["first_order_at"] = min(delta["first_order_at"], order.created_at)
+            delta["last_order_at"] = max(delta["last_order_at"], order.created_at)
+
+        with transaction.atomic():
+            for product_id, delta in deltas.items():
+                cls.objects.get_or_create(product_id=product_id)
+                cls.objects.filter(product_id=product_id).update(
+                    **{field: F(field) + delta[field] for field in cls.TOTAL_FIELDS},
+                    first_order_at=Least(
+                        Coalesce(F("first_order_at"), Value(delta["first_order_at"])), Value(delta["first_order_at"])
+                    ),
+                    last_order_at=Greatest(
+                        Coalesce(F("last_order_at"), Value(delta["last_order_at"])), Value(delta["last_order_at"])
+                    ),
+                    # update() does not apply auto_now, and the conditional GET validators rely on it
+                    updated_at=timezone.now(),
+                )
+
+    @classmethod
+    def compute(cls, product_ids=None):
+        """
+        Compute the rollup figures from scratch out of the DeliveredOrder table.
+
+        Args:
+            product_ids (iterable of int, optional): Restrict to these products. Defaults to all products.
+
+        Returns:
+            dict: Mapping of product id to a dict of rollup field values, for products having orders
+        """
+        line_total = ExpressionWrapper(
+            F("price") * F("quantity"), output_field=DecimalField(max_digits=20, decimal_places=2)
+        )
+        discounted = Q(discount=True)
+        orders = DeliveredOrder.objects.order_by()
+        if product_ids is not None:
+            orders = orders.filter(product_id__in=list(product_ids))
+        rows = orders.values("product_id").annotate(
+            units_sold=Sum("quantity"),
+            revenue=Sum(line_total),
+            discounted_units=Coalesce(Sum("quantity", filter=discounted), 0),
+            discounted_revenue=Coalesce(
+                Sum(line_total, filter=discounted),
+                Value(Decimal("0")),
+                output_field=DecimalField(max_digits=20, decimal_places=2),
+            ),
+            order_count=Count("id"),
+            first_order_at=Min("created_at"),
+            last_order_at=Max("created_at"),
+        )
+        return {row.pop("product_id"): row for row in rows}
+
+    @classmethod
+    def rebuild(cls, product_ids=None):
+        """
+        Recompute the rollups from scratch and store them.
+
+        Rollups of products without orders are reset to zero.
+
+        Args:
+            product_ids (iterable of int, optional): Restrict to these products. Defaults to all products.
+
+        Returns:
+            int: The number of rollups written
+        """
+        products = Product.objects.order_by()
+        if product_ids is not None:
+            product_ids = list(product_ids)
+            products = products.filter(pk__in=product_ids)
+
+        figures = cls.compute(product_ids)
+        with transaction.atomic():
+            count = 0
+            for product_id in products.values_list("pk", flat=True).iterator():
+                cls.objects.update_or_create(product_id=product_id, defaults=figures.get(product_id, cls.empty()))
+                count += 1
+        return count
+
+    @classmethod
+    def empty(cls):
+        """
+        Return the rollup field values of a product without orders.
+        """
+        return {
+            "units_sold": 0,
+            "revenue": Decimal("0"),
+            "discounted_units": 0,
+            "discounted_revenue": Decimal("0"),
+            "order_count": 0,
+            "first_order_at": None,
+            "last_order_at": None,
+        }
+
+
+class CatalogImport(models.Model):
+    """
+    Model tracking a bulk import of a merchant's catalogue.
+
+    An import loads up to three CSV files (products, product costs and delivered
+    orders) for one user. The files are processed in chunks, each committed
+    together with the number of rows done so far, so an interrupted or failed
+    import can be resumed where it stopped.
+
+    Attributes:
+        user (ForeignKey): The user the imported products belong to
+        products_file (CharField): Path of the products CSV file
+        product_costs_file (CharField): Path of the product costs CSV file
+        delivered_orders_file (CharField): Path of the delivered orders CSV file
+        status (CharField): Current status of the import
+        products_done (PositiveBigIntegerField): Product rows imported so far
+        product_costs_done (PositiveBigIntegerField): Product cost rows imported so far
+        delivered_orders_done (PositiveBigIntegerField): Delivered order rows imported so far
+        error (TextField): Why the import failed, if it did
+        created_at (DateTimeField): When the import was created
+        updated_at (DateTimeField): When the import was last updated
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="catalog_imports",
+        help_text="User the imported products belong to",
+    )
+    products_file = models.CharField(max_length=500, blank=True, help_text="Path of the products CSV file")
+    product_costs_file = models.CharField(max_length=500, blank=True, help_text="Path of the product costs CSV file")
+    delivered_orders_file = models.CharField(
+        max_length=500, blank=True, help_text="Path of the delivered orders CSV file"
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    products_done = models.PositiveBigIntegerField(default=0, help_text="Product rows imported so far")
+    product_costs_done = models.PositiveBigIntegerField(default=0, help_text="Product cost rows imported so far")
+    delivered_orders_done = models.PositiveBigIntegerField(default=0, help_text="Delivered order rows imported so far")
+    error = models.TextField(blank=True, help_text="Why the import failed, if it did")
+    created_at = models.DateTimeField(auto_now_add=True, help_text="Timestamp when the import was created")
+    updated_at = models.DateTimeField(auto_now=True, help_text="Timestamp when the import was last updated")
+
+    class Meta:
+        verbose_name = "Catalog Import"
+        verbose_name_plural = "Catalog Imports"
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Catalog import {self.pk} for {self.user} ({self.status})"
+
+
+class ReportJob(models.Model):
+    """
+    Model tracking the generation of the agent reports of a product in the background.
+
+    A job is created when the product detail is requested and no cached reports
+    match the product's current financial data. A worker runs Agent 1 then
+    Agent 2 on the stored financial data, and records the reports, which are
+    also put in the report cache. A product has at most one queued or running
+    job per financial data, so concurrent requests for the same reports share
+    it, even when served by different processes.
+
+    Attributes:
+        product (ForeignKey): The product the reports are about
+        payload_key (CharField): Report cache key of the financial data, used to reuse a job for identical inputs
+        financial_data (JSONField): The payload sent to Agent 1
+        status (CharField): Current status of the job
+        report_1 (JSONField): The report of Agent 1, once the job finished
+        report_2 (JSONField): The report of Agent 2, once the job finished
+        error (TextField): Why the job failed, if it did
+        created_at (DateTimeField): When the job was queued
+        started_at (DateTimeField): When a worker picked the job up
+        finished_at (DateTimeField): When the job completed or failed
+        updated_at (DateTimeField): When the job was last updated
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="report_jobs",
+        help_text="The product the reports are about",
+    )
+    payload_key = models.CharField(max_length=100, help_text="Report cache key of the financial data")
+    financial_data = models.JSONField(encoder=DjangoJSONEncoder, help_text="The payload sent to Agent 1")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    report_1 = models.JSONField(null=True, blank=True, help_text="The report of Agent 1")
+    report_2 = models.JSONField(null=True, blank=True, help_text="The report of Agent 2")
+    error = models.TextField(blank=True, help_text="Why the job failed, if it did")
+    created_at = models.DateTimeField(auto_now_add=True, help_text="Timestamp when the job was queued")
+    started_at = models.DateTimeField(null=True, blank=True, help_text="Timestamp when a worker picked the job up")
+    finished_at = models.DateTimeField(null=True, blank=True, help_text="Timestamp when the job completed or failed")
+    updated_at = models.DateTimeField(auto_now=True, help_text="Timestamp when the job was last updated")
+
+    class Meta:
+        verbose_name = "Report Job"
+        verbose_name_plural = "Report Jobs"
+        ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "payload_key"],
+                condition=Q(status__in=["pending", "running"]),
+                name="reportjob_active_uniq",
+            ),
+        ]
+        indexes = [
+            # Last finished job of a product, for the detail validators
+            models.Index(fields=["product", "-finished_at"], name="reportjob_product_finished_idx"),
+            # Queue polling by the run_report_jobs worker
+            models.Index(fields=["status", "created_at"], name="reportjob_status_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"Report job {self.pk} for {self.product} ({self.status})"
+
+
+class ProductReport(models.Model):
+    """
+    Model storing a snapshot of the agent reports of a product.
+
+    A snapshot is recorded each time the agents successfully analyse a product, and
+    numbered per product. The product detail serves the latest snapshot computed
+    from the product's current financial data when the report cache does not have
+    it, and the history can be browsed to compare reports over time.
+
+    Attributes:
+        product (ForeignKey): The product the reports are about
+        version (PositiveIntegerField): Number of the snapshot among the product's snapshots, from 1
+        payload_key (CharField): Report cache key, i.e. hash, of the financial data the agents analysed
+        report_1 (JSONField): The report of Agent 1
+        report_2 (JSONField): The report of Agent 2
+        model_name (CharField): The LLM(s) that wrote the reports
+        input_tokens (PositiveIntegerField): Prompt tokens used by both agent runs
+        output_tokens (PositiveIntegerField): Completion tokens used by both agent runs
+        total_tokens (PositiveIntegerField): Tokens used by both agent runs
+        latency_ms (PositiveIntegerField): Duration of both agent runs, in milliseconds
+        created_at (DateTimeField): When the snapshot was recorded
+    """
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="reports",
+        help_text="The product the reports are about",
+    )
+    version = models.PositiveIntegerField(help_text="Number of the snapshot among the product's snapshots")
+    payload_key = models.CharField(max_length=100, help_text="Hash of the financial data the agents analysed")
+    report_1 = models.JSONField(help_text="The report of Agent 1")
+    report_2 = models.JSONField(help_text="The report of Agent 2")
+    model_name = models.CharField(max_length=200, blank=True, help_text="The LLM(s) that wrote the reports")
+    input_tokens = models.PositiveIntegerField(default=0, help_text="Prompt tokens used by both agent runs")
+    output_tokens = models.PositiveIntegerField(default=0, help_text="Completion tokens used by both agent runs")
+    total_tokens = models.PositiveIntegerField(default=0, help_text="Tokens used by both agent runs")
+    latency_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Duration of both agent runs")
+    created_at = models.DateTimeField(auto_now_add=True, help_text="Timestamp when the snapshot was recorded")
+
+    class Meta:
+        verbose_name = "Product Report"
+        verbose_name_plural = "Product Reports"
+        ordering = ["product", "-version"]
+        constraints = [
+            models.UniqueConstraint(fields=["product", "version"], name="productreport_product_version_uniq"),
+        ]
+        indexes = [
+            # Latest snapshot of a product for its current financial data, read by the product detail
+            models.Index(fields=["product", "payload_key", "-version"], name="productreport_payload_idx"),
+        ]
+
+    def __str__(self):
+        return f"Reports v{self.version} of {self.product}"
+
+    @property
+    def reports(self):
+        """
+        The reports as cached and returned by the product detail.
+        """
+        return {"report_1": self.report_1, "report_2": self.report_2, "report_version": self.version}
+
+    @classmethod
+    def record(cls, product_id, payload_key, report_1, report_2):
+        """
+        Record a snapshot of the reports of a product, with the next version number.
+
+        The model, token usage and latency are read from the "meta" the agent service adds to its reports.
+
+        Returns:
+            ProductReport: The new snapshot
+        """
+        metas = [(report.get("meta") if isinstance(report, dict) else None) or {} for report in (report_1, report_2)]
+        usages = [meta.get("usage") or {} for meta in metas]
+        latencies = [meta["latency_ms"] for meta in metas if meta.get("latency_ms") is not None]
+        fields = {
+            "model_name": ", ".join(dict.fromkeys(str(meta["model"]) for meta in metas if meta.get("model"))),
+            **{
+                name: sum(usage.get(name) or 0 for usage in usages)
+                for name in ("input_tokens", "output_tokens", "total_tokens")
+            },
+            "latency_ms": sum(latencies) if latencies else None,
+        }
+
+        # Versions are allocated under the unique constraint, retried if two snapshots race for one
+        for attempt in range(3):
+            version = (cls.objects.filter(product_id=product_id).aggregate(version=Max("version"))["version"] or 0) + 1
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(
+                        product_id=product_id,
+                        version=version,
+                        payload_key=payload_key,
+                        report_1=report_1,
+                        report_2=report_2,
+                        **fields,
+                    )
+            except IntegrityError:
+                if attempt == 2:
+                    raise
@@ -0,0 +1,196 @@
+import json
+from collections import namedtuple
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+# Position of a row in a keyset ordering: the value of each ordering field, as strings
+Keyset = namedtuple("Keyset", ["values"])
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination on a composite keyset.
+
+    DRF's ``CursorPagination`` only encodes the first ordering field in the cursor
+    and steps over rows sharing its value with an OFFSET, which gives up after
+    ``offset_cutoff`` rows: rows created at the same time were skipped or repeated
+    on deep pages. Here the cursor holds the value of every ordering field and the
+    page is located with ``WHERE (a, b) < (x, y)`` written out as
+    ``a < x OR (a = x AND b < y)``. The last ordering field must be unique (the id),
+    so that the position of a row is unique and no offset is ever needed.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        assert ordering[-1].lstrip("-") in ("id", "pk"), "The last ordering field of a keyset must be the id."
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, current_position = False, None
+        else:
+            reverse, current_position = self.cursor.reverse, self.cursor.position
+            # Forged or legacy cursors may carry an offset, positions are unique and never need one
+            self.cursor = self.cursor._replace(offset=0)
+
+        if reverse:
+            queryset = queryset.order_by(*[self.reverse_field(field) for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self.after(queryset.model, current_position, reverse))
+
+        # One extra row tells whether there is a following page
+        results = list(queryset[: self.page_size + 1])
+        self.page = results[: self.page_size]
+        has_following_position = len(results) > len(self.page)
+        following_position = self._get_position_from_instance(results[-1], self.ordering) if results else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    def after(self, model, position, reverse):
+        """
+        Build the condition selecting the rows that follow ``position`` in the ordering.
+
+        Args:
+            model: Model of the paginated queryset, to parse the values of the cursor
+            position (Keyset): Position of the last row of the previous page
+            reverse (bool): Whether the cursor goes backwards
+
+        Returns:
+            Q: ``a < x OR (a = x AND b < y) OR ...``, with ``>`` for ascending fields
+        """
+        if len(position.values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        values = []
+        for field, value in zip(self.ordering, position.values):
+            name = field.lstrip("-")
+            try:
+                model_field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+                values.append(model_field.to_python(value))
+            except (FieldDoesNotExist, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") != reverse else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            values = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=cursor.offset, reverse=cursor.reverse, position=Keyset(values))
+
+    def encode_cursor(self, cursor):
+        position = cursor.position
+        if position is not None:
+            position = json.dumps(position.values, separators=(",", ":"))
+        return super().encode_cursor(Cursor(offset=0, reverse=cursor.reverse, position=position))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        # The next page starts after the last row of this one, whichever way it was fetched
+        position = self.next_position
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.previous_position
+        if self.page:
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            name = field.lstrip("-")
+            values.append(str(instance[name] if isinstance(instance, dict) else getattr(instance, name)))
+        return Keyset(values)
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    """
+    Cursor (keyset) pagination for product listings.
+
+    Pages are located with a ``WHERE (updated_at, id) < cursor`` condition instead
+    of an OFFSET, so fetching a page costs the same regardless of how deep it is.
+    The id breaks the ties between products updated at the same time.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = ("-updated_at", "-id")
+
+
+class DeliveredOrderCursorPagination(KeysetCursorPagination):
+    """
+    Cursor (keyset) pagination for the delivered orders of a product.
+
+    Pages are located with a ``WHERE (created_at, id) < cursor`` condition, newest
+    orders first, the id breaking the ties between orders of the same instant.
+    """
+
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    ordering = ("-created_at", "-id")
+
+
+class ProductReportCursorPagination(KeysetCursorPagination):
+    """
+    Cursor (keyset) pagination for the report snapshots of a product.
+
+    Pages are located with a ``WHERE (version, id) < cursor`` condition, latest
+    snapshot first.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("-version", "-id")
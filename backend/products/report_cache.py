@@ -0,0 +1,139 @@
+"""
+Content-addressed cache of the agent reports.
+
+The reports of the two agents only depend on the financial data sent to Agent
+1: the product with its costs, sales figures and orders, and the user's fixed
+costs. They are cached in the ``agent_reports`` cache (see ``CACHES`` in the
+settings) under a SHA-256 of that payload in canonical JSON form, so identical
+inputs reuse the reports instead of running the LLMs again, and any change to
+the inputs leads to a different key.
+
+Stale entries would only waste space until they expire, but they are also
+deleted as soon as a Product, ProductCost, DeliveredOrder or FixedCosts row is
+saved or deleted (see ``connect_signals``). Bulk writes, which do not send
+signals, are still covered by the content addressing.
+
+Hits and misses are counted in the cache itself, and exposed by the
+``/api/products/report-cache/`` endpoint.
+"""
+
+import hashlib
+import json
+
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.signals import post_delete, post_save
+
+CACHE_ALIAS = "agent_reports"
+KEY_PREFIX = "agent-report"
+HITS_KEY = f"{KEY_PREFIX}:hits"
+MISSES_KEY = f"{KEY_PREFIX}:misses"
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def report_key(financial_data):
+    """
+    Return the cache key of the reports for a financial payload.
+    """
+    canonical = json.dumps(financial_data, sort_keys=True, separators=(",", ":"), cls=DjangoJSONEncoder)
+    return f"{KEY_PREFIX}:{hashlib.sha256(canonical.encode()).hexdigest()}"
+
+
+def product_index_key(product_id):
+    # Key of the latest reports cached for a product, used to delete them when the product changes
+    return f"{KEY_PREFIX}:product:{product_id}"
+
+
+def count(key):
+    cache = get_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_reports(financial_data):
+    """
+    Look up the reports of a financial payload.
+
+    Returns:
+        dict: {"report_1": ..., "report_2": ...}, or None on a miss
+    """
+    reports = get_cache().get(report_key(financial_data))
+    count(HITS_KEY if reports is not None else MISSES_KEY)
+    return reports
+
+
+def has_errors(reports):
+    """
+    Whether one of the agent calls producing the reports failed.
+    """
+    return any(isinstance(report, dict) and "error" in report for report in reports.values())
+
+
+def set_reports(product_id, financial_data, reports):
+    """
+    Cache the reports of a financial payload, unless one of the agent calls failed.
+    """
+    if has_errors(reports):
+        return
+    key = report_key(financial_data)
+    get_cache().set_many({key: reports, product_index_key(product_id): key})
+
+
+def invalidate_products(product_ids):
+    """
+    Delete the cached reports of products.
+    """
+    cache = get_cache()
+    index_keys = [product_index_key(product_id) for product_id in product_ids]
+    if index_keys:
+        report_keys = cache.get_many(index_keys).values()
+        cache.delete_many([*index_keys, *report_keys])
+
+
+def stats():
+    """
+    Return the hit and miss counts since the counters were last reset.
+    """
+    counts = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    return {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else None}
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
+
+
+def invalidate_product(sender, instance, **kwargs):
+    invalidate_products([instance.pk])
+
+
+def invalidate_product_of(sender, instance, **kwargs):
+    invalidate_products([instance.product_id])
+
+
+def invalidate_user_products(sender, instance, **kwargs):
+    from .models import Product
+
+    invalidate_products(Product.objects.filter(user_id=instance.user_id).values_list("pk", flat=True))
+
+
+def connect_signals():
+    """
+    Delete cached reports whenever the data they were computed from changes. Called by ProductsConfig.ready().
+    """
+    from fixed_costs.models import FixedCosts
+
+    from .models import DeliveredOrder, Product, ProductCost
+
+    for name, signal in (("save", post_save), ("delete", post_delete)):
+        signal.connect(invalidate_product, sender=Product, dispatch_uid=f"report_cache_product_{name}")
+        for model in (ProductCost, DeliveredOrder):
+            signal.connect(invalidate_product_of, sender=model, dispatch_uid=f"report_cache_{model.__name__}_{name}")
+        signal.connect(invalidate_user_products, sender=FixedCosts, dispatch_uid=f"report_cache_fixed_costs_{name}")
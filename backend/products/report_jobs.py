@@ -0,0 +1,270 @@
+"""
+Background generation of the agent reports.
+
+The product detail endpoint does not wait for the agents anymore: it returns
+the cached reports, or the latest ProductReport snapshot, when the product's
+financial data did not change, and otherwise queues a ReportJob and returns
+its id with ``report_status: pending``. The client then polls
+``/api/products/{id}/report/``.
+
+How queued jobs are run depends on ``settings.REPORT_JOB_BACKEND``:
+- ``"thread"``: by a pool of ``REPORT_JOB_WORKERS`` threads in the web process,
+  once the transaction that created the job is committed
+- ``"queue"``: by the ``run_report_jobs`` management command, which polls the
+  ReportJob table and can run on another machine
+- ``"immediate"``: right away in the request, which is only meant for debugging
+
+Jobs are claimed with a conditional UPDATE, so a job is only run once even if
+thread workers and ``run_report_jobs`` share the same database. Concurrent
+requests for the same product and financial data, in any process, share one
+job: a unique constraint allows only one queued or running job per payload.
+
+A job handed to a thread only lives in the memory of its process: if the
+process restarts, the job stays pending or running. A request finding such a
+job untouched for ``REPORT_JOB_STALE_AFTER`` queues it again (see ``requeue``).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import report_cache
+from .models import ProductReport, ReportJob
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.REPORT_JOB_WORKERS, thread_name_prefix="report-job")
+    return _executor
+
+
+def report_fields(product_id, financial_data):
+    """
+    Return the report fields of a product detail response.
+
+    Args:
+        product_id (int): The product
+        financial_data (dict): The payload for Agent 1, see ``utils.agent_financial_data``
+
+    Returns:
+        tuple: (fields, cache status) where fields holds report_status, report_job (id of the job
+            generating the reports, None if they were found) and report_1, report_2 and
+            report_version once available
+    """
+    reports, cache_status = find_reports(product_id, financial_data)
+    if reports is not None:
+        return {"report_status": ReportJob.STATUS_COMPLETED, "report_job": None, **reports}, cache_status
+    job = enqueue(product_id, financial_data)
+    fields = {"report_status": job.status, "report_job": job.pk}
+    if job.status == ReportJob.STATUS_COMPLETED:
+        # Only with the "immediate" backend
+        fields.update(report_1=job.report_1, report_2=job.report_2)
+    return fields, "miss"
+
+
+def find_reports(product_id, financial_data):
+    """
+    Look up the reports of a product's financial data in the cache, then in its snapshots.
+
+    Returns:
+        tuple: (reports, "hit" or "snapshot"), or (None, "miss")
+    """
+    reports = report_cache.get_reports(financial_data)
+    if reports is not None:
+        return reports, "hit"
+    snapshot = (
+        ProductReport.objects.filter(product_id=product_id, payload_key=report_cache.report_key(financial_data))
+        .order_by("-version")
+        .first()
+    )
+    if snapshot is None:
+        return None, "miss"
+    report_cache.set_reports(product_id, financial_data, snapshot.reports)
+    return snapshot.reports, "snapshot"
+
+
+def find_many_reports(payloads):
+    """
+    Like ``find_reports`` for several products, reading their snapshots with one query.
+
+    Args:
+        payloads (dict): Product id to its financial data
+
+    Returns:
+        dict: Product id to (reports, cache status) for the products whose reports were found
+    """
+    found = {}
+    keys = {}
+    for product_id, financial_data in payloads.items():
+        reports = report_cache.get_reports(financial_data)
+        if reports is not None:
+            found[product_id] = (reports, "hit")
+        else:
+            keys[product_id] = report_cache.report_key(financial_data)
+    if not keys:
+        return found
+
+    snapshots = ProductReport.objects.filter(product_id__in=keys, payload_key__in=set(keys.values()))
+    for snapshot in snapshots.order_by("product_id", "-version"):
+        if snapshot.product_id not in found and snapshot.payload_key == keys[snapshot.product_id]:
+            report_cache.set_reports(snapshot.product_id, payloads[snapshot.product_id], snapshot.reports)
+            found[snapshot.product_id] = (snapshot.reports, "snapshot")
+    return found
+
+
+def store_reports(product_id, financial_data, reports):
+    """
+    Record a snapshot of new reports and cache them, unless one of the agent calls failed.
+
+    Returns:
+        dict: The reports, with their report_version if they were recorded
+    """
+    if report_cache.has_errors(reports):
+        return reports
+    snapshot = ProductReport.record(
+        product_id, report_cache.report_key(financial_data), reports["report_1"], reports["report_2"]
+    )
+    report_cache.set_reports(product_id, financial_data, snapshot.reports)
+    return snapshot.reports
+
+
+def enqueue(product_id, financial_data):
+    """
+    Queue a job generating the reports of a product, unless one is already queued for the same data.
+
+    Returns:
+        ReportJob: The queued or running job, or the one that just finished
+    """
+    payload_key = report_cache.report_key(financial_data)
+    jobs = ReportJob.objects.filter(product_id=product_id, payload_key=payload_key).order_by("-created_at")
+    job = jobs.filter(status__in=[ReportJob.STATUS_PENDING, ReportJob.STATUS_RUNNING]).first()
+    if job is not None:
+        if job.updated_at < timezone.now() - settings.REPORT_JOB_STALE_AFTER:
+            requeue(job)
+        return job
+    try:
+        with transaction.atomic():
+            job = ReportJob.objects.create(
+                product_id=product_id, payload_key=payload_key, financial_data=financial_data
+            )
+    except IntegrityError:
+        # Another request queued the same job in the meantime, it may even have finished since
+        return jobs.first()
+    dispatch(job)
+    return job
+
+
+def requeue(job):
+    """
+    Queue a lost job again and hand it to the configured backend.
+
+    The job is only updated if it did not change since it was read, so that of concurrent
+    requests finding the same lost job only one dispatches it.
+    """
+    requeued = ReportJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(
+        status=ReportJob.STATUS_PENDING, started_at=None, updated_at=timezone.now()
+    )
+    job.refresh_from_db()
+    if requeued:
+        dispatch(job)
+
+
+def dispatch(job):
+    """
+    Hand a new or requeued job to the configured backend.
+    """
+    backend = settings.REPORT_JOB_BACKEND
+    if backend == "thread":
+        # The worker thread has its own connection and must see the committed job
+        transaction.on_commit(lambda: get_executor().submit(run_job_in_thread, job.pk))
+    elif backend == "immediate":
+        run_job(job.pk)
+        job.refresh_from_db()
+    # "queue": left for the run_report_jobs command
+
+
+def claim(job_id):
+    """
+    Mark a pending job as running, returning False if another worker got it first.
+    """
+    return bool(
+        ReportJob.objects.filter(pk=job_id, status=ReportJob.STATUS_PENDING).update(
+            status=ReportJob.STATUS_RUNNING, started_at=timezone.now(), updated_at=timezone.now()
+        )
+    )
+
+
+def run_job(job_id):
+    """
+    Run a pending job: get the reports of Agent 1 then Agent 2, and store and cache them.
+
+    Returns:
+        bool: Whether the job was run by this call
+    """
+    from .utils import get_agent_reports
+
+    if not claim(job_id):
+        return False
+    job = ReportJob.objects.get(pk=job_id)
+
+    # Anything raised must fail the job: left running, it would block new jobs for the same data
+    try:
+        reports = get_agent_reports(job.financial_data)
+        job.report_1, job.report_2 = reports["report_1"], reports["report_2"]
+        store_reports(job.product_id, job.financial_data, {"report_1": job.report_1, "report_2": job.report_2})
+    except Exception as e:
+        job.status = ReportJob.STATUS_FAILED
+        job.error = str(e)
+    else:
+        errors = [
+            report["error"] for report in (job.report_1, job.report_2) if isinstance(report, dict) and "error" in report
+        ]
+        job.status = ReportJob.STATUS_FAILED if errors else ReportJob.STATUS_COMPLETED
+        # A failed pipeline call fails both reports with the same error
+        job.error = "; ".join(dict.fromkeys(str(error) for error in errors))
+    job.finished_at = timezone.now()
+    job.save(update_fields=["report_1", "report_2", "status", "error", "finished_at", "updated_at"])
+    return True
+
+
+def run_job_in_thread(job_id):
+    """
+    Run a job in a worker thread, which must close its own database connection.
+    """
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        connection.close()
+
+
+def run_pending_jobs(limit=None):
+    """
+    Run the pending jobs, oldest first.
+
+    Returns:
+        int: Number of jobs run
+    """
+    pending = ReportJob.objects.filter(status=ReportJob.STATUS_PENDING).order_by("created_at")
+    job_ids = list(pending.values_list("pk", flat=True)[:limit])
+    return sum(run_job(job_id) for job_id in job_ids)
+
+
+def requeue_stale_jobs(older_than):
+    """
+    Put back in the queue the jobs left running by a worker that died.
+
+    Args:
+        older_than (timedelta): How long a job may run before it is considered abandoned
+
+    Returns:
+        int: Number of jobs queued again
+    """
+    return ReportJob.objects.filter(status=ReportJob.STATUS_RUNNING, started_at__lt=timezone.now() - older_than).update(
+        status=ReportJob.STATUS_PENDING, started_at=None, updated_at=timezone.now()
+    )
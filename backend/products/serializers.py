@@ -1,6 +1,7 @@
+from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from .models import DeliveredOrder, Product, ProductCost
+from .models import CatalogImport, DeliveredOrder, Product, ProductCost, ProductReport, ReportJob
 
 
 class DeliveredOrderSerializer(serializers.ModelSerializer):
@@ -50,11 +51,21 @@ class ProductSerializer(serializers.ModelSerializer):
     The has_product_costs field is a read-only boolean that indicates whether
     the product has associated cost information.
 
+    The revenue, units_sold, average_realized_price, discount_share and order_count
+    fields are aggregates computed by the database; the serialized instances must
+    come from ``Product.objects.with_financials()``.
+
     The delivered_orders field provides a nested representation of all order
-    history associated with the product.
+    history associated with the product. It is only included when the serializer
+    context contains ``include_orders=True``, since it grows with the order history.
     """
 
     has_product_costs = serializers.BooleanField(read_only=True)
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2, read_only=True)
+    units_sold = serializers.IntegerField(read_only=True)
+    average_realized_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    discount_share = serializers.DecimalField(max_digits=5, decimal_places=4, read_only=True)
+    order_count = serializers.IntegerField(read_only=True)
     delivered_orders = DeliveredOrderSerializer(source="delivered_orders_list", many=True, read_only=True)
 
     class Meta:
@@ -68,11 +79,25 @@ class ProductSerializer(serializers.ModelSerializer):
             "product_description",
             "total_returns",
             "has_product_costs",
+            "revenue",
+            "units_sold",
+            "average_realized_price",
+            "discount_share",
+            "order_count",
             "delivered_orders",
             "created_at",
             "updated_at",
         ]
 
+    def get_fields(self):
+        """
+        Drop the nested order list unless it was explicitly requested.
+        """
+        fields = super().get_fields()
+        if not self.context.get("include_orders", False):
+            fields.pop("delivered_orders", None)
+        return fields
+
 
 class ProductDetailSerializer(ProductSerializer):
     """
@@ -85,14 +110,174 @@ class ProductDetailSerializer(ProductSerializer):
     The product_cost field provides a nested representation of the
     associated ProductCost object, if one exists.
 
+    The margin field holds the margin figures of the product, computed by
+    the margin engine (see products/margin.py) from the same data as report_1.
     The report_1 field contains analysis from the first external agent service.
     The report_2 field contains analysis from the second external agent service,
     which is based on both the product data and the first agent's report.
+    Both are only present when report_status is completed; otherwise report_job
+    is the id of the job generating them, see ReportJobSerializer.
+    The report_version field is the version of the ProductReport snapshot the
+    reports come from.
     """
 
     product_cost = ProductCostSerializer(read_only=True)
+    margin = serializers.JSONField(read_only=True, required=False)
+    report_status = serializers.ChoiceField(choices=ReportJob.STATUS_CHOICES, read_only=True, required=False)
+    report_job = serializers.IntegerField(read_only=True, required=False)
     report_1 = serializers.JSONField(read_only=True, required=False)
     report_2 = serializers.JSONField(read_only=True, required=False)
+    report_version = serializers.IntegerField(read_only=True, required=False)
 
     class Meta(ProductSerializer.Meta):
-        fields = ProductSerializer.Meta.fields + ["product_cost", "report_1", "report_2"]
+        fields = ProductSerializer.Meta.fields + [
+            "product_cost",
+            "margin",
+            "report_status",
+            "report_job",
+            "report_1",
+            "report_2",
+            "report_version",
+        ]
+
+
+class OrderSeriesQuerySerializer(serializers.Serializer):
+    """
+    Serializer validating the query parameters of the order series endpoints.
+    """
+
+    interval = serializers.ChoiceField(choices=["day", "week", "month"], default="day")
+    start = serializers.DateTimeField(required=False, help_text="Only include orders recorded at or after this time")
+    end = serializers.DateTimeField(required=False, help_text="Only include orders recorded before this time")
+
+
+class OrderSeriesPointSerializer(serializers.Serializer):
+    """
+    Serializer for one bucket of an order time series.
+
+    Each point aggregates the delivered orders recorded during the period
+    starting at ``period``.
+    """
+
+    period = serializers.DateTimeField()
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2)
+    units = serializers.IntegerField()
+    discounted_units = serializers.IntegerField()
+    discounted_revenue = serializers.DecimalField(max_digits=20, decimal_places=2)
+    order_count = serializers.IntegerField()
+
+
+class CatalogImportSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the CatalogImport model.
+
+    Exposes the status and progress of a catalogue import.
+    """
+
+    username = serializers.CharField(source="user.username", read_only=True)
+
+    class Meta:
+        model = CatalogImport
+        fields = [
+            "id",
+            "username",
+            "status",
+            "products_done",
+            "product_costs_done",
+            "delivered_orders_done",
+            "error",
+            "created_at",
+            "updated_at",
+        ]
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the ReportJob model.
+
+    Exposes the status of the generation of a product's agent reports, and the
+    reports once it completed.
+    """
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            "id",
+            "product",
+            "status",
+            "report_1",
+            "report_2",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+
+
+class ProductReportSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the ProductReport model, without the reports.
+
+    Lists the snapshots of a product's agent reports with what each one cost.
+    """
+
+    class Meta:
+        model = ProductReport
+        fields = [
+            "version",
+            "payload_key",
+            "model_name",
+            "input_tokens",
+            "output_tokens",
+            "total_tokens",
+            "latency_ms",
+            "created_at",
+        ]
+
+
+class ProductReportDetailSerializer(ProductReportSerializer):
+    """
+    Serializer for one ProductReport snapshot, with its reports.
+    """
+
+    class Meta(ProductReportSerializer.Meta):
+        fields = ProductReportSerializer.Meta.fields + ["report_1", "report_2"]
+
+
+class CatalogImportRequestSerializer(serializers.Serializer):
+    """
+    Serializer validating the upload of a catalogue import.
+
+    At least one of the three CSV files must be provided.
+    """
+
+    username = serializers.CharField(help_text="Username the imported products belong to")
+    products = serializers.FileField(required=False, help_text="CSV file of products")
+    product_costs = serializers.FileField(required=False, help_text="CSV file of product costs")
+    delivered_orders = serializers.FileField(required=False, help_text="CSV file of delivered orders")
+
+    def validate_username(self, value):
+        user = get_user_model().objects.filter(username=value).first()
+        if user is None:
+            raise serializers.ValidationError("User does not exist.")
+        return user
+
+    def validate(self, attrs):
+        if not any(name in attrs for name in ("products", "product_costs", "delivered_orders")):
+            raise serializers.ValidationError("At least one CSV file is required.")
+        return attrs
+
+
+class BatchReportRequestSerializer(serializers.Serializer):
+    """
+    Serializer validating a batch report request.
+
+    Without product_ids, all the user's products are analysed.
+    """
+
+    product_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        allow_empty=False,
+        help_text="Ids of the products to analyse, all the user's products by default",
+    )
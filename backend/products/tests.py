@@ -1,3 +1,1457 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.renderers import ORJSONRenderer, msgpack
+from fixed_costs.models import FixedCosts
+
+from . import agent_client, report_cache, report_jobs
+from .agent_client import AgentClient, CircuitOpenError
+from .catalog_import import CatalogImporter
+from .fast_serializers import delivered_orders_by_product, product_rows, serialize_product_detail, serialize_products
+from .margin import calculate_margin, margin_inputs, product_margin, summarize_orders
+from .models import CatalogImport, DeliveredOrder, Product, ProductCost, ProductReport, ProductSalesRollup, ReportJob
+from .serializers import ProductDetailSerializer, ProductSerializer
+from .utils import (
+    agent_financial_data,
+    call_agent_service,
+    canonical_json,
+    get_batch_reports,
+    order_summaries,
+    stream_agent_events,
+)
+
+User = get_user_model()
+
+
+def create_product(user, name="Product", with_costs=False, orders=3):
+    """
+    Create a product with a few delivered orders, and optionally product costs.
+    """
+    product = Product.objects.create(
+        user=user,
+        product_name=name,
+        product_category="Electronics",
+        product_image="/images/product.jpg",
+        product_selling_price=Decimal("100.00"),
+        product_description="A test product",
+    )
+    if with_costs:
+        ProductCost.objects.create(product=product, product_cost=Decimal("40.00"))
+    for i in range(orders):
+        product.add_delivered_order(price=Decimal("100.00") - i, quantity=10, discount=bool(i % 2))
+    return product
+
+
+class ProductQueryCountTests(TestCase):
+    """
+    Regression tests pinning the number of queries issued by each product endpoint.
+
+    The counts must not depend on the number of products or orders returned.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_products(self, count):
+        for i in range(count):
+            create_product(self.user, name=f"With costs {i}", with_costs=True)
+            create_product(self.user, name=f"Without costs {i}")
+
+    def assert_list_queries(self, url, expected):
+        for count in (1, 5):
+            Product.objects.all().delete()
+            self.create_products(count)
+            with self.assertNumQueries(expected):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), count)
+
+    def test_products_with_costs_queries(self):
+        # Conditional GET validators, page of products
+        self.assert_list_queries("/api/products/with-costs/", 2)
+
+    def test_products_without_costs_queries(self):
+        self.assert_list_queries("/api/products/without-costs/", 2)
+
+    def test_products_with_orders_queries(self):
+        # One extra query for the orders of the page
+        self.assert_list_queries("/api/products/with-costs/?include_orders=true", 3)
+        self.assert_list_queries("/api/products/without-costs/?include_orders=true", 3)
+
+    @override_settings(REPORT_JOB_BACKEND="queue")
+    def test_retrieve_queries(self):
+        for orders in (1, 20, 2000):
+            product = create_product(self.user, with_costs=True, orders=min(orders, 20))
+            if orders > 20:
+                # Spread over many prices and months, as a long order history
+                created = DeliveredOrder.objects.bulk_create(
+                    DeliveredOrder(
+                        product=product,
+                        price=Decimal(50 + i % 40),
+                        quantity=1 + i % 5,
+                        created_at=datetime(2020 + i % 5, 1 + i % 12, 1, tzinfo=timezone.utc),
+                    )
+                    for i in range(orders - 20)
+                )
+                ProductSalesRollup.add_orders(created)
+            # Fresh user instance, as on a real request, so the fixed costs lookup is not cached
+            self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+            # Conditional GET validators, product with costs and aggregates, user's fixed costs, price groups and
+            # monthly series of its orders, lookup of a report snapshot, of a queued report job and creation of
+            # one in a savepoint. The orders themselves are not loaded
+            with self.assertNumQueries(10):
+                response = self.client.get(f"/api/products/{product.id}/")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data["has_product_costs"])
+            self.assertEqual(response.data["order_count"], orders)
+            self.assertNotIn("delivered_orders", response.data)
+
+            # One more query when the client asks for the orders, the job queued above is reused
+            self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+            with self.assertNumQueries(8):
+                response = self.client.get(f"/api/products/{product.id}/?include_orders=true")
+            self.assertEqual(len(response.data["delivered_orders"]), orders)
+
+    def test_product_orders_queries(self):
+        for orders in (1, 20):
+            product = create_product(self.user, orders=orders)
+            # Product ownership check, page of orders
+            with self.assertNumQueries(2):
+                response = self.client.get(f"/api/products/{product.id}/orders/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), orders)
+
+
+class ProductPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def collect_pages(self, url):
+        results = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            results.extend(response.data["results"])
+            url = response.data["next"]
+        return results
+
+    def test_products_pages(self):
+        products = [create_product(self.user, name=f"Product {i}", with_costs=True, orders=0) for i in range(5)]
+        # Same updated_at for several products, the id keeps the ordering stable
+        Product.objects.filter(pk__in=[p.pk for p in products[:3]]).update(updated_at=products[0].updated_at)
+
+        results = self.collect_pages("/api/products/with-costs/?page_size=2")
+        expected = Product.objects.order_by("-updated_at", "-id").values_list("id", flat=True)
+        self.assertEqual([product["id"] for product in results], list(expected))
+
+    def test_product_orders_pages(self):
+        product = create_product(self.user, orders=7)
+        other_product = create_product(self.user, orders=2)
+
+        results = self.collect_pages(f"/api/products/{product.id}/orders/?page_size=3")
+        self.assertEqual(len(results), 7)
+        self.assertEqual(sum(order["quantity"] for order in results), 70)
+
+        response = self.client.get(f"/api/products/{other_product.id}/orders/")
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_product_orders_pages_with_same_created_at(self):
+        # More orders of the same instant than DRF's offset_cutoff, as written by a bulk ingestion
+        product = create_product(self.user, orders=0)
+        created_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        DeliveredOrder.objects.bulk_create(
+            DeliveredOrder(product=product, price=Decimal("10.00"), quantity=i + 1, created_at=created_at)
+            for i in range(1205)
+        )
+        # Orders are told apart by their quantity, the serializer does not expose the id
+        expected = list(range(1205, 0, -1))
+
+        results = self.collect_pages(f"/api/products/{product.id}/orders/?page_size=100")
+        self.assertEqual([order["quantity"] for order in results], expected)
+
+        # And backwards from the last page
+        response = self.client.get(f"/api/products/{product.id}/orders/?page_size=1000")
+        response = self.client.get(response.data["next"])
+        backwards = list(response.data["results"])
+        url = response.data["previous"]
+        while url:
+            response = self.client.get(url)
+            backwards[:0] = response.data["results"]
+            url = response.data["previous"]
+        self.assertEqual([order["quantity"] for order in backwards], expected)
+
+    def test_invalid_cursor(self):
+        product = create_product(self.user)
+        for cursor in ("not-base64", "cD1ub3QtanNvbg==", "cD0lNUIlMjJub3QtYS1kYXRlJTIyJTJDJTIyMSUyMiU1RA=="):
+            response = self.client.get(f"/api/products/{product.id}/orders/?cursor={cursor}")
+            self.assertEqual(response.status_code, 404)
+
+    def test_product_orders_of_another_user(self):
+        other_user = User.objects.create_user(username="other", password="password")
+        product = create_product(other_user)
+
+        response = self.client.get(f"/api/products/{product.id}/orders/")
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductFinancialsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+
+    def test_with_financials(self):
+        product = create_product(self.user, orders=0)
+        product.add_delivered_order(price=Decimal("10.00"), quantity=3)
+        product.add_delivered_order(price=Decimal("8.50"), quantity=2, discount=True)
+
+        product = Product.objects.with_financials().get(pk=product.pk)
+        self.assertEqual(product.revenue, Decimal("47.00"))
+        self.assertEqual(product.units_sold, 5)
+        self.assertEqual(product.discounted_units, 2)
+        self.assertEqual(product.order_count, 2)
+        self.assertEqual(product.average_realized_price, Decimal("9.4"))
+        self.assertEqual(product.discount_share, Decimal("0.4"))
+
+    def test_with_financials_without_orders(self):
+        product = create_product(self.user, orders=0)
+
+        product = Product.objects.with_financials().get(pk=product.pk)
+        self.assertEqual(product.revenue, Decimal("0"))
+        self.assertEqual(product.units_sold, 0)
+        self.assertEqual(product.average_realized_price, Decimal("0"))
+        self.assertEqual(product.discount_share, Decimal("0"))
+
+    def test_cost_flag(self):
+        with_costs = create_product(self.user, with_costs=True)
+        without_costs = create_product(self.user)
+
+        with self.assertNumQueries(1):
+            flags = {product.pk: product.has_product_costs for product in Product.objects.with_cost_flag()}
+        self.assertEqual(flags, {with_costs.pk: True, without_costs.pk: False})
+
+
+class FastSerializerTests(TestCase):
+    """
+    The fast read path must produce exactly the JSON of the DRF serializers.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+        create_product(self.user, name="With costs", with_costs=True, orders=5)
+        create_product(self.user, name="Without costs", orders=3)
+        product = create_product(self.user, name="Without orders", orders=0)
+        product.add_delivered_order(price=Decimal("9.99"), quantity=3, discount=True)
+        create_product(self.user, name="Never sold", orders=0)
+        self.products = Product.objects.filter(user=self.user).with_financials().with_cost_flag().order_by("id")
+
+    def test_products(self):
+        for include_orders in (False, True):
+            expected = ProductSerializer(
+                self.products.with_orders(), many=True, context={"include_orders": include_orders}
+            ).data
+            actual = serialize_products(product_rows(self.products), include_orders=include_orders)
+            self.assertEqual(json.dumps(actual), json.dumps(expected))
+
+    def test_product_detail(self):
+        for product in self.products.select_related("product_cost"):
+            expected = ProductDetailSerializer(product).data
+            actual = serialize_product_detail(product_rows(self.products, with_costs=True).get(pk=product.pk))
+            self.assertEqual(json.dumps(actual), json.dumps(expected))
+
+
+class MarginEngineTests(TestCase):
+    def test_calculate_margin(self):
+        result = calculate_margin(
+            selling_price="100.00",
+            total_units_sold=30,
+            total_units_returned=2,
+            product_cost_per_unit=40,
+            packaging_cost_per_unit=5,
+            confirmation_fees_per_unit=3,
+            marketing_cost_per_unit=10,
+            return_cost_per_unit=8,
+            fixed_cost_total=1000,
+            order_details=[(100, 10), ("90.5", 20)],
+        )
+        # Revenue 1000 + 1810, costs 58 * 32 + 1000 + 8 * 2
+        self.assertEqual(result["total_revenue"], Decimal("2810.00"))
+        self.assertEqual(result["total_costs"], Decimal("2872.00"))
+        self.assertEqual(result["total_profit"], Decimal("-62.00"))
+        self.assertEqual(result["profit_margin"], Decimal("-2.21"))
+        self.assertEqual(result["fixed_cost_per_unit"], Decimal("33.33"))
+        self.assertEqual(result["return_rate"], Decimal("6.25"))
+
+        result = calculate_margin(0, 0, 0, 0, 0, 0, 0, 0, 500, [])
+        self.assertEqual((result["total_profit"], result["profit_margin"]), (Decimal("-500.00"), Decimal("0.00")))
+
+    def test_margin_inputs(self):
+        user = User.objects.create_user(username="merchant", password="password")
+        FixedCosts.objects.create(user=user, rental=Decimal("100.00"), dev=Decimal("50.50"))
+        product = create_product(user, with_costs=True)
+        Product.objects.filter(pk=product.pk).update(total_returns=2)
+        row = product_rows(Product.objects.filter(pk=product.pk).with_financials().with_cost_flag(), with_costs=True)
+        financial_data = agent_financial_data(
+            User.objects.get(pk=user.pk), serialize_product_detail(row[0]), order_summaries(row)[product.pk]
+        )
+
+        inputs = margin_inputs(financial_data)
+        self.assertEqual(inputs["total_units_sold"], 30)
+        self.assertEqual(inputs["total_units_returned"], 2)
+        # The id and total of the serialized fixed costs are not costs
+        self.assertEqual(inputs["fixed_cost_total"], Decimal("150.50"))
+        self.assertEqual(len(inputs["order_details"]), 3)
+        self.assertEqual(product_margin(financial_data)["total_costs"], Decimal("1430.50"))
+
+    def test_summarize_orders(self):
+        orders = [
+            {"price": "90.00", "quantity": 2, "discount": True, "created_at": "2024-03-02T10:00:00Z"},
+            {"price": "100.00", "quantity": 1, "discount": False, "created_at": "2024-03-01T10:00:00Z"},
+            {"price": "90.00", "quantity": 3, "discount": True, "created_at": "2024-02-01T10:00:00Z"},
+            {"price": "100.00", "quantity": 4, "discount": False, "created_at": "2024-01-01T10:00:00Z"},
+        ]
+        summary = summarize_orders(orders, months=2)
+        self.assertEqual(
+            summary,
+            {
+                "order_count": 4,
+                "total_units": 10,
+                "total_revenue": "950.00",
+                "price_groups": [
+                    {"price": "100.00", "discount": False, "quantity": 5, "order_count": 2},
+                    {"price": "90.00", "discount": True, "quantity": 5, "order_count": 2},
+                ],
+                "monthly_series": [
+                    {"month": "2024-02", "units": 3, "revenue": "270.00", "order_count": 1},
+                    {"month": "2024-03", "units": 3, "revenue": "280.00", "order_count": 2},
+                ],
+            },
+        )
+
+        # The groups give the same margin as the orders, with a payload that does not grow with them
+        grouped = {"product_details": {"product_selling_price": "100.00", "order_summary": summary}}
+        listed = {"product_details": {"product_selling_price": "100.00", "delivered_orders": orders}}
+        self.assertEqual(product_margin(grouped), product_margin(listed))
+        summary = summarize_orders(orders * 100, months=2)
+        self.assertEqual(
+            (summary["total_units"], len(summary["price_groups"]), len(summary["monthly_series"])), (1000, 2, 2)
+        )
+
+    def test_order_summaries(self):
+        # The database aggregates give the summary of the serialized orders
+        user = User.objects.create_user(username="merchant", password="password")
+        products = [create_product(user, name=f"Product {i}", orders=0) for i in range(2)]
+        for i in range(30):
+            order = products[i % 2].add_delivered_order(
+                price=Decimal(90 + 10 * (i % 3)), quantity=i, discount=i % 4 == 0
+            )
+            DeliveredOrder.objects.filter(pk=order.pk).update(
+                created_at=datetime(2023 + i // 12, i % 12 + 1, 1 + i % 28, tzinfo=timezone.utc)
+            )
+
+        rows = list(product_rows(Product.objects.filter(user=user).with_financials().with_cost_flag().order_by("id")))
+        orders = delivered_orders_by_product([row["id"] for row in rows])
+        for summaries in (
+            order_summaries(rows, months=5),
+            {row["id"]: order_summaries([row], months=5)[row["id"]] for row in rows},
+        ):
+            for row in rows:
+                self.assertEqual(summaries[row["id"]], summarize_orders(orders[row["id"]], months=5))
+                self.assertEqual(len(summaries[row["id"]]["monthly_series"]), 5)
+
+        # The database only returns the last months of each product
+        orders = DeliveredOrder.objects.filter(product__user=user)
+        points = list(orders.time_series("month", group_by=("product_id",), last=5))
+        self.assertEqual([point["product_id"] for point in points], [rows[0]["id"]] * 5 + [rows[1]["id"]] * 5)
+        self.assertEqual(
+            points[-1]["period"], orders.filter(product_id=rows[1]["id"]).time_series("month").last()["period"]
+        )
+
+
+class RendererTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = create_product(self.user, name="Caf\u00e9 \u2028", with_costs=True)
+
+    def test_orjson_matches_json_renderer(self):
+        response = self.client.get("/api/products/with-costs/?include_orders=true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+        data = {"amount": Decimal("12.50"), "at": datetime(2024, 1, 1, 10, 30, tzinfo=timezone.utc), "ids": (1, 2)}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(data, "application/json; indent=4")),
+            json.loads(JSONRenderer().render(data)),
+        )
+
+    def test_orjson_non_str_keys(self):
+        data = {"product_ids": {1: ["A valid integer is required."]}, 2: None}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+        # The errors of a ListField are keyed by the index of the invalid item
+        response = self.client.post("/api/products/reports/batch/", {"product_ids": ["x", 1]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {"product_ids": {"0": ["A valid integer is required."]}})
+
+    def test_orjson_parser(self):
+        product = create_product(self.user, name="Without costs")
+        url = f"/api/products/{product.id}/add-costs/"
+        response = self.client.post(url, '{"product_cost": "12.30", "ads_cost": 2}', content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["product_cost"]["product_cost"], "12.30")
+
+        response = self.client.post(url, "{not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        response = self.client.get("/api/products/with-costs/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(JSONRenderer().render(response.data)))
+
+
+@override_settings(REPORT_JOB_BACKEND="queue")
+@mock.patch("products.utils.get_agent2_report", return_value={})
+@mock.patch("products.utils.get_agent1_report", return_value={})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = create_product(self.user, with_costs=True)
+        self.url = f"/api/products/{self.product.id}/"
+
+    def assert_not_modified(self, url, etag, queries=1):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def assert_modified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        return response["ETag"]
+
+    def test_retrieve(self, agent1, agent2):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["report_status"], "pending")
+        etag = response["ETag"]
+
+        self.assert_not_modified(self.url, etag)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        self.assertNotEqual(self.client.get(f"{self.url}?include_orders=true")["ETag"], etag)
+
+        # The reports became available
+        report_jobs.run_pending_jobs()
+        self.assertEqual((agent1.call_count, agent2.call_count), (1, 1))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data["report_status"], "completed")
+        etag = response["ETag"]
+        self.assert_not_modified(self.url, etag)
+
+        self.product.add_delivered_order(price=Decimal("50.00"), quantity=1)
+        etag = self.assert_modified(self.url, etag)
+        self.product.product_cost.save()
+        etag = self.assert_modified(self.url, etag)
+        FixedCosts.objects.create(user=self.user, rental=Decimal("100.00"))
+        etag = self.assert_modified(self.url, etag)
+        self.product.delivered_orders_list.first().delete()
+        etag = self.assert_modified(self.url, etag)
+        self.assert_not_modified(self.url, etag)
+
+    def test_retrieve_of_another_user(self, agent1, agent2):
+        self.client.force_authenticate(User.objects.create_user(username="other", password="password"))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH="*").status_code, 404)
+
+    def test_lists(self, agent1, agent2):
+        url = "/api/products/with-costs/"
+        etag = self.client.get(url)["ETag"]
+        self.assert_not_modified(url, etag)
+
+        other = create_product(self.user, with_costs=True, orders=0)
+        etag = self.assert_modified(url, etag)
+        other.product_cost.delete()
+        etag = self.assert_modified(url, etag)
+        other.delete()
+        etag = self.assert_modified(url, etag)
+        self.assertNotEqual(self.client.get("/api/products/without-costs/")["ETag"], etag)
+
+
+@override_settings(REPORT_JOB_BACKEND="queue")
+@mock.patch.dict(os.environ, {"AGENT1_SERVICE_URL": "http://agents/1", "AGENT2_SERVICE_URL": "http://agents/2"})
+class AgentReportTests(TestCase):
+    def setUp(self):
+        report_cache.get_cache().clear()
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.fixed_costs = FixedCosts.objects.create(user=self.user, rental=Decimal("100.00"))
+        self.product = create_product(self.user, with_costs=True)
+        self.url = f"/api/products/{self.product.id}/"
+        self.report_1 = {"status": "OK", "data": {"margin": 12.5}}
+        self.report_2 = {"status": "OK", "data": {"recommendations": []}}
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url=None):
+        # Fresh user instance, as on a real request, so that changed fixed costs are read again
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        return self.client.get(url or self.url)
+
+    def assert_agent_requests(self, calls):
+        (url_1, data_1), (url_2, data_2) = calls
+        self.assertEqual(url_1, "http://agents/1")
+        financial_data = data_1["financial_data"]
+        self.assertEqual(financial_data["user"]["fixed_costs"]["rental"], "100.00")
+        self.assertEqual(financial_data["product_details"]["id"], self.product.id)
+        self.assertNotIn("delivered_orders", financial_data["product_details"])
+        self.assertEqual(financial_data["product_details"]["order_summary"]["order_count"], 3)
+        self.assertEqual((url_2, data_2), ("http://agents/2", {"report": canonical_json(self.report_1)}))
+
+    def run_jobs(self, *reports):
+        with mock.patch("products.utils.call_agent_service", side_effect=reports) as call:
+            report_jobs.run_pending_jobs()
+        return [c.args for c in call.call_args_list]
+
+    def test_retrieve(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Report-Cache"], "miss")
+        self.assertEqual(response.data["report_status"], "pending")
+        self.assertNotIn("report_1", response.data)
+        self.assertNotIn("delivered_orders", response.data)
+        self.assertEqual(
+            {field: response.data["margin"][field] for field in ("total_revenue", "total_costs", "profit_margin")},
+            {"total_revenue": "2970.00", "total_costs": "1300.00", "profit_margin": "56.23"},
+        )
+        job_id = response.data["report_job"]
+
+        # Requests made while the job is queued reuse it
+        self.assertEqual(self.get().data["report_job"], job_id)
+        self.assertEqual(ReportJob.objects.count(), 1)
+        response = self.get(f"{self.url}report/")
+        self.assertEqual((response.data["id"], response.data["status"]), (job_id, "pending"))
+
+        self.assert_agent_requests(self.run_jobs(self.report_1, self.report_2))
+        response = self.get(f"{self.url}report/?job={job_id}")
+        self.assertEqual(response.data["status"], "completed")
+        self.assertEqual((response.data["report_1"], response.data["report_2"]), (self.report_1, self.report_2))
+        self.assertIsNotNone(response.data["finished_at"])
+
+        response = self.get()
+        self.assertEqual(response["X-Report-Cache"], "hit")
+        self.assertEqual((response.data["report_status"], response.data["report_job"]), ("completed", None))
+        self.assertEqual((response.data["report_1"], response.data["report_2"]), (self.report_1, self.report_2))
+
+    def test_report_endpoint_not_found(self):
+        self.assertEqual(self.get(f"{self.url}report/").status_code, 404)
+        job_id = self.get().data["report_job"]
+        self.assertEqual(self.get(f"{self.url}report/?job={job_id + 1}").status_code, 404)
+        other = create_product(self.user)
+        self.assertEqual(self.get(f"/api/products/{other.id}/report/?job={job_id}").status_code, 404)
+        self.client.force_authenticate(User.objects.create_user(username="other", password="password"))
+        self.assertEqual(self.client.get(f"{self.url}report/").status_code, 404)
+
+    @override_settings(REPORT_JOB_BACKEND="immediate")
+    def test_immediate_backend(self):
+        with mock.patch("products.utils.call_agent_service", side_effect=[self.report_1, self.report_2]):
+            response = self.get()
+        self.assertEqual(response.data["report_status"], "completed")
+        self.assertEqual((response.data["report_1"], response.data["report_2"]), (self.report_1, self.report_2))
+
+    def test_report_cache(self):
+        self.assertEqual(self.get()["X-Report-Cache"], "miss")
+        self.assertEqual(len(self.run_jobs(self.report_1, self.report_2)), 2)
+        response = self.get()
+        self.assertEqual(response["X-Report-Cache"], "hit")
+        self.assertEqual((response.data["report_1"], response.data["report_2"]), (self.report_1, self.report_2))
+
+        # A change of the financial data leads to a new agent run
+        self.product.add_delivered_order(price=Decimal("10.00"), quantity=1)
+        self.assertEqual(self.get()["X-Report-Cache"], "miss")
+        self.assertEqual(len(self.run_jobs(self.report_1, self.report_2)), 2)
+        self.assertEqual(ReportJob.objects.filter(status="completed").count(), 2)
+
+        admin = User.objects.create_superuser(username="admin", password="password")
+        self.client.force_authenticate(admin)
+        response = self.client.get("/api/products/report-cache/")
+        self.assertEqual(response.data, {"hits": 1, "misses": 2, "hit_rate": 1 / 3})
+        self.assertEqual(self.client.get("/api/products/agent-services/").status_code, 200)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get("/api/products/report-cache/").status_code, 403)
+
+    def test_report_cache_invalidation(self):
+        other = create_product(self.user)
+        cache = report_cache.get_cache()
+        # (change, whether it also concerns the other product of the user)
+        for change, shared in (
+            (lambda: self.product.save(), False),
+            (lambda: self.product.product_cost.save(), False),
+            (lambda: self.product.delivered_orders_list.first().delete(), False),
+            (lambda: self.fixed_costs.save(), True),
+        ):
+            for product in (self.product, other):
+                report_cache.set_reports(product.pk, {"product": product.pk}, {"report_1": {}, "report_2": {}})
+            change()
+            self.assertIsNone(cache.get(report_cache.report_key({"product": self.product.pk})))
+            self.assertEqual(cache.get(report_cache.report_key({"product": other.pk})) is None, shared)
+
+    def test_failed_reports_are_not_cached(self):
+        job_id = self.get().data["report_job"]
+        self.run_jobs({"error": "timeout", "status": "failed"}, self.report_2)
+        response = self.get(f"{self.url}report/")
+        self.assertEqual((response.data["status"], response.data["error"]), ("failed", "timeout"))
+
+        response = self.get()
+        self.assertEqual(response["X-Report-Cache"], "miss")
+        self.assertNotEqual(response.data["report_job"], job_id)
+        self.assertFalse(ProductReport.objects.exists())
+
+    def test_failed_storage_fails_the_job(self):
+        job_id = self.get().data["report_job"]
+        with mock.patch("products.report_jobs.store_reports", side_effect=DatabaseError("disk full")):
+            self.run_jobs(self.report_1, self.report_2)
+        job = ReportJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.error), ("failed", "disk full"))
+
+        # The failed job no longer holds the slot of the active job
+        self.assertNotEqual(self.get().data["report_job"], job_id)
+
+    @mock.patch.dict(os.environ, {"AGENT_PIPELINE_SERVICE_URL": "http://agents/pipeline"})
+    def test_pipeline(self):
+        timings = {"analysis_ms": 1200, "recommendation_ms": 800, "total_ms": 2000}
+        self.get()
+        result = {"status": "OK", "report_1": self.report_1, "report_2": self.report_2, "timings": timings}
+        ((url, data),) = self.run_jobs(result)
+        self.assertEqual((url, list(data)), ("http://agents/pipeline", ["financial_data"]))
+        response = self.get()
+        self.assertEqual((response.data["report_1"], response.data["report_2"]), (self.report_1, self.report_2))
+
+        self.product.add_delivered_order(price=Decimal("10.00"), quantity=1)
+        self.get()
+        self.run_jobs({"status": "ERROR", "message": "Rate limited"})
+        response = self.get(f"{self.url}report/")
+        self.assertEqual((response.data["status"], response.data["error"]), ("failed", "Rate limited"))
+
+    def test_concurrent_requests_share_a_job(self):
+        job_id = self.get().data["report_job"]
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReportJob.objects.create(
+                product=self.product, payload_key=ReportJob.objects.get().payload_key, financial_data={}
+            )
+
+        # A request that lost the race to queue the job gets the other request's job
+        job = ReportJob.objects.get()
+        ReportJob.objects.filter(pk=job_id).update(status="completed")
+        with mock.patch.object(ReportJob.objects, "create", side_effect=IntegrityError):
+            self.assertEqual(report_jobs.enqueue(self.product.id, job.financial_data).pk, job_id)
+
+    def test_lost_jobs_are_queued_again(self):
+        job_id = self.get().data["report_job"]
+        # Left running by a web process that restarted
+        stale = datetime.now(timezone.utc) - timedelta(minutes=16)
+        ReportJob.objects.filter(pk=job_id).update(status="running", started_at=stale, updated_at=stale)
+
+        with override_settings(REPORT_JOB_BACKEND="thread"), mock.patch(
+            "products.report_jobs.get_executor"
+        ) as executor, self.captureOnCommitCallbacks(execute=True):
+            response = self.get()
+        self.assertEqual((response.data["report_status"], response.data["report_job"]), ("pending", job_id))
+        executor.return_value.submit.assert_called_once_with(report_jobs.run_job_in_thread, job_id)
+        job = ReportJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.started_at), ("pending", None))
+
+        # A recent job is left alone
+        with override_settings(REPORT_JOB_BACKEND="thread"), mock.patch(
+            "products.report_jobs.get_executor"
+        ) as executor, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.get().data["report_job"], job_id)
+        executor.return_value.submit.assert_not_called()
+
+        self.run_jobs(self.report_1, self.report_2)
+        self.assertEqual(ReportJob.objects.get().status, "completed")
+
+    def test_report_snapshots(self):
+        meta_1 = {"model": "gpt-4o", "usage": {"input_tokens": 100, "output_tokens": 20, "total_tokens": 120}}
+        meta_2 = {"model": "gpt-4o", "usage": {"input_tokens": 50, "output_tokens": 10, "total_tokens": 60}}
+        report_1 = {**self.report_1, "meta": {**meta_1, "latency_ms": 1500}}
+        report_2 = {**self.report_2, "meta": {**meta_2, "latency_ms": 800}}
+        self.get()
+        # Agent 2 gets the report of Agent 1 without the metadata of its run
+        self.assert_agent_requests(self.run_jobs(report_1, report_2))
+
+        snapshot = ProductReport.objects.get()
+        self.assertEqual((snapshot.version, snapshot.model_name), (1, "gpt-4o"))
+        self.assertEqual(
+            (snapshot.input_tokens, snapshot.output_tokens, snapshot.total_tokens, snapshot.latency_ms),
+            (150, 30, 180, 2300),
+        )
+
+        # Once the cache entry is gone, the snapshot is served without running the agents again
+        report_cache.get_cache().clear()
+        response = self.get()
+        self.assertEqual(response["X-Report-Cache"], "snapshot")
+        self.assertEqual((response.data["report_status"], response.data["report_version"]), ("completed", 1))
+        self.assertEqual(response.data["report_1"], report_1)
+        self.assertEqual(ReportJob.objects.count(), 1)
+        self.assertEqual(self.get()["X-Report-Cache"], "hit")
+
+        self.product.add_delivered_order(price=Decimal("10.00"), quantity=1)
+        self.assertEqual(self.get()["X-Report-Cache"], "miss")
+        self.run_jobs(self.report_1, self.report_2)
+        self.assertEqual(self.get().data["report_version"], 2)
+
+        response = self.get(f"{self.url}reports/")
+        self.assertEqual([snapshot["version"] for snapshot in response.data["results"]], [2, 1])
+        self.assertNotIn("report_1", response.data["results"][0])
+        self.assertEqual(response.data["results"][0]["latency_ms"], None)
+        response = self.get(f"{self.url}reports/1/")
+        self.assertEqual((response.data["report_1"], response.data["total_tokens"]), (report_1, 180))
+        self.assertEqual(self.get(f"{self.url}reports/3/").status_code, 404)
+        self.client.force_authenticate(User.objects.create_user(username="other", password="password"))
+        self.assertEqual(self.client.get(f"{self.url}reports/1/").status_code, 404)
+
+    def test_record_versions(self):
+        for version in (1, 2):
+            snapshot = ProductReport.record(self.product.id, "key", self.report_1, self.report_2)
+            self.assertEqual(snapshot.version, version)
+        other = ProductReport.record(create_product(self.user).id, "key", self.report_1, {"error": "down"})
+        self.assertEqual((other.version, other.model_name, other.total_tokens), (1, "", 0))
+
+    def read_events(self, response):
+        body = b"".join(response.streaming_content).decode()
+        events = []
+        for chunk in body.strip().split("\n\n"):
+            event_line, data_line = chunk.split("\n")
+            events.append((event_line[len("event: ") :], json.loads(data_line[len("data: ") :])))
+        return events
+
+    def test_stream_report(self):
+        def stream_agent_events(url, data):
+            agent = "1" if url == "http://agents/1/stream" else "2"
+            if agent == "1":
+                yield "tool_call_started", {"tool": "calculate_profit_marginn"}
+                yield "calculation_results", {"profit_margin": 56.23}
+            yield "partial_output", {"delta": "{"}
+            yield "final_output", self.report_1 if agent == "1" else self.report_2
+
+        with mock.patch("products.utils.stream_agent_events", side_effect=stream_agent_events) as stream:
+            response = self.get(f"{self.url}report/stream/")
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            events = self.read_events(response)
+        self.assertEqual(
+            [(event, data.get("agent")) for event, data in events],
+            [
+                ("margin", None),
+                ("tool_call_started", 1),
+                ("calculation_results", 1),
+                ("partial_output", 1),
+                ("final_output", 1),
+                ("partial_output", 2),
+                ("final_output", 2),
+                ("reports", None),
+            ],
+        )
+        self.assertEqual(events[0][1]["total_revenue"], "2970.00")
+        self.assertEqual(events[2][1]["data"], {"profit_margin": 56.23})
+        self.assertEqual(
+            events[-1][1],
+            {"report_cache": "miss", "report_1": self.report_1, "report_2": self.report_2, "report_version": 1},
+        )
+        self.assertEqual(stream.call_args_list[1].args[1], {"report": canonical_json(self.report_1)})
+
+        # The streamed reports are cached for the product detail and the next streams
+        self.assertEqual(self.get()["X-Report-Cache"], "hit")
+        events = self.read_events(self.get(f"{self.url}report/stream/"))
+        self.assertEqual([event for event, _ in events], ["margin", "reports"])
+        self.assertEqual(events[-1][1]["report_cache"], "hit")
+
+    def test_stream_report_errors(self):
+        with mock.patch("products.utils.stream_agent_events", side_effect=requests.exceptions.ConnectionError("down")):
+            with self.assertLogs("products.utils"):
+                events = self.read_events(self.get(f"{self.url}report/stream/"))
+        self.assertEqual([event for event, _ in events], ["margin", "error", "error", "reports"])
+        self.assertEqual(events[-1][1]["report_1"], {"error": "down", "status": "failed"})
+        # Failed reports are not cached
+        self.assertEqual(self.get()["X-Report-Cache"], "miss")
+
+        self.client.force_authenticate(User.objects.create_user(username="other", password="password"))
+        response = self.client.get(f"{self.url}report/stream/", HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(response.content.startswith(b"event: error\ndata: "))
+
+    def test_stream_agent_events(self):
+        lines = [b"event: tool_call_started", b'data: {"tool": "calculate_profit_marginn"}', b'data: {"a": 1}']
+        client = AgentClient()
+        self.addCleanup(client.close)
+        with mock.patch.object(agent_client, "get_client", return_value=client):
+            with mock.patch.object(client, "post_lines", return_value=iter(lines)):
+                events = list(stream_agent_events("http://agents/1/stream", {}))
+        self.assertEqual(events, [("tool_call_started", {"tool": "calculate_profit_marginn"}), ("message", {"a": 1})])
+
+    def test_run_report_jobs_command(self):
+        self.get()
+        ReportJob.objects.create(
+            product=self.product,
+            payload_key="stale",
+            financial_data={},
+            status=ReportJob.STATUS_RUNNING,
+            started_at=datetime(2020, 1, 1, tzinfo=timezone.utc),
+        )
+        out = StringIO()
+        with mock.patch("products.utils.call_agent_service", return_value=self.report_1):
+            call_command("run_report_jobs", "--once", stdout=out)
+        self.assertIn("Queued 1 abandoned jobs again", out.getvalue())
+        self.assertIn("Ran 2 report jobs", out.getvalue())
+        self.assertFalse(ReportJob.objects.exclude(status="completed").exists())
+
+    @override_settings(ROOT_URLCONF="core.asgi_urls")
+    async def test_async_retrieve(self):
+        auth = {"Authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+        response = await self.async_client.get(self.url, headers=auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Report-Cache"], "miss")
+        data = json.loads(response.content)
+        self.assertEqual(data["report_status"], "pending")
+        self.assertNotIn("delivered_orders", data)
+        self.assertTrue(await ReportJob.objects.filter(pk=data["report_job"]).aexists())
+
+        response = await self.async_client.get(self.url, headers={**auth, "If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+        self.assertEqual((await self.async_client.get(self.url)).status_code, 401)
+        other = await User.objects.acreate(username="other")
+        response = await self.async_client.get(
+            self.url, headers={"Authorization": f"Bearer {AccessToken.for_user(other)}"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(AGENT_BATCH_MAX_PRODUCTS=3)
+class BatchReportTests(TestCase):
+    url = "/api/products/reports/batch/"
+
+    def setUp(self):
+        report_cache.get_cache().clear()
+        self.user = User.objects.create_user(username="merchant", password="password")
+        FixedCosts.objects.create(user=self.user, rental=Decimal("100.00"))
+        self.products = [create_product(self.user, f"Product {i}", with_costs=bool(i % 2)) for i in range(3)]
+        create_product(User.objects.create_user(username="other", password="password"))
+        self.client = APIClient()
+
+    def post(self, data=None):
+        # Fresh user instance, as on a real request, so the fixed costs lookup is not cached
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        return self.client.post(self.url, data or {}, format="json")
+
+    def read(self, response):
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def batch_reports(self, items):
+        # Completes in reverse order
+        for product_id, financial_data in reversed(items):
+            yield product_id, {"report_1": {"status": "OK", "id": product_id}, "report_2": {"status": "OK"}}
+
+    def test_batch(self):
+        with mock.patch("products.utils.get_batch_reports", side_effect=self.batch_reports) as batch:
+            self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+            # Products with costs and aggregates, price groups and monthly series of their orders, user's fixed costs
+            with self.assertNumQueries(4):
+                response = self.client.post(self.url, {}, format="json")
+            lines = self.read(response)
+        self.assertEqual([line["product_id"] for line in lines], [p.id for p in reversed(self.products)])
+        self.assertEqual({line["report_cache"] for line in lines}, {"miss"})
+        self.assertEqual(lines[0]["report_1"], {"status": "OK", "id": self.products[-1].id})
+
+        # The payloads are the ones the product detail sends to Agent 1
+        (items,) = batch.call_args.args
+        product_data = self.client.get(f"/api/products/{self.products[1].id}/?include_orders=true").data
+        for field in ("margin", "report_status", "report_job", "report_1", "report_2", "report_version"):
+            product_data.pop(field, None)
+        product_data.pop("delivered_orders")
+        row = product_rows(Product.objects.filter(pk=self.products[1].id).with_financials().with_cost_flag(), True)
+        expected = agent_financial_data(
+            User.objects.get(pk=self.user.pk), json.loads(json.dumps(product_data)), order_summaries(row)[row[0]["id"]]
+        )
+        self.assertEqual(json.loads(json.dumps(dict(items)[self.products[1].id])), expected)
+
+        self.products[0].add_delivered_order(price=Decimal("10.00"), quantity=1)
+        with mock.patch("products.utils.get_batch_reports", side_effect=self.batch_reports) as batch:
+            lines = self.read(self.post({"product_ids": [self.products[0].id, self.products[2].id]}))
+        self.assertEqual([item[0] for item in batch.call_args.args[0]], [self.products[0].id])
+        self.assertEqual(
+            [(line["product_id"], line["report_cache"]) for line in lines],
+            [(self.products[2].id, "hit"), (self.products[0].id, "miss")],
+        )
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post({"product_ids": []}).status_code, 400)
+        other = Product.objects.exclude(user=self.user).get()
+        response = self.post({"product_ids": [self.products[0].id, other.id]})
+        self.assertEqual((response.status_code, response.data["product_ids"]), (404, [other.id]))
+        create_product(self.user)
+        self.assertEqual(self.post().status_code, 400)
+
+    @mock.patch.dict(os.environ, {"AGENT_BATCH_SERVICE_URL": "http://agents/batch"})
+    def test_get_batch_reports(self):
+        report = {"status": "OK"}
+        lines = [
+            json.dumps({"id": 2, "status": "OK", "report_1": report, "report_2": report}).encode(),
+            json.dumps({"id": 1, "status": "ERROR", "message": "Rate limited"}).encode(),
+        ]
+        client = AgentClient()
+        self.addCleanup(client.close)
+        with mock.patch.object(agent_client, "get_client", return_value=client):
+            with mock.patch.object(client, "post_lines", return_value=iter(lines)) as post_lines:
+                results = dict(get_batch_reports([(1, {"a": 1}), (2, {"b": 2}), (3, {"c": 3})]))
+        url, data = post_lines.call_args.args
+        self.assertEqual((url, data["items"][0]), ("http://agents/batch", {"id": 1, "financial_data": {"a": 1}}))
+        self.assertEqual(results[2], {"report_1": report, "report_2": report})
+        self.assertEqual(results[1]["report_1"], {"error": "Rate limited", "status": "failed"})
+        self.assertEqual(results[3]["report_2"]["status"], "failed")
+
+
+class StubAgentHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so that connection reuse can be checked
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append(self.client_address)
+        if self.server.release is not None:
+            self.server.release.wait(5)
+        time.sleep(self.server.delay)
+        status_code = self.server.statuses.pop(0) if self.server.statuses else 200
+        if status_code != 200:
+            body = {"detail": "error"}
+        else:
+            body = self.server.bodies.pop(0) if self.server.bodies else {"status": "OK"}
+        body = json.dumps(body).encode()
+        try:
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting, see test_read_timeouts_are_not_retried
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AgentClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubAgentHandler)
+        self.server.requests, self.server.statuses, self.server.release = [], [], None
+        self.server.bodies, self.server.delay = [], 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.service = f"http://127.0.0.1:{self.server.server_port}"
+        self.url = f"{self.service}/agent"
+        self.now = 0.0
+        self.client = AgentClient(retries=2, backoff=0, failure_threshold=2, reset_timeout=30, clock=lambda: self.now)
+        self.addCleanup(self.client.close)
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.assertEqual(self.client.post(self.url, {"report": "{}"}), {"status": "OK"})
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(set(self.server.requests)), 1)
+        metrics = self.client.metrics()[self.service]
+        self.assertEqual((metrics["calls"], metrics["attempts"], metrics["retries"]), (3, 3, 0))
+        self.assertGreater(metrics["mean_latency"], 0)
+        self.assertEqual(list(self.client.post_lines(self.url, {})), [b'{"status": "OK"}'])
+
+    def test_retries(self):
+        self.server.statuses = [503, 429]
+        self.assertEqual(self.client.post(self.url, {}), {"status": "OK"})
+        self.assertEqual(self.client.metrics()[self.service]["retries"], 2)
+
+        # Client errors are not retried, nor held against the service
+        self.server.statuses = [400]
+        with mock.patch.object(agent_client, "get_client", return_value=self.client), self.assertLogs("products.utils"):
+            self.assertEqual(call_agent_service(self.url, {})["status"], "failed")
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.client.metrics()[self.service]["failures"], 0)
+
+    def test_read_timeouts_are_not_retried(self):
+        # The agent run goes on after a read timeout, a retry would pay for another one
+        self.server.delay = 0.5
+        client = AgentClient(retries=2, backoff=0, failure_threshold=1, timeout=(5, 0.1))
+        self.addCleanup(client.close)
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            client.post(self.url, {})
+        self.assertEqual(len(self.server.requests), 1)
+        metrics = client.metrics()[self.service]
+        self.assertEqual((metrics["retries"], metrics["failures"], metrics["circuit"]), (0, 1, "open"))
+
+    def test_gateway_errors_are_not_retried(self):
+        self.server.statuses = [504]
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.client.post(self.url, {})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_failed_bodies_open_the_circuit(self):
+        self.server.bodies = [{"status": "ERROR", "message": "Rate limited"}, {"status": "failed", "error": "boom"}]
+        self.assertEqual(self.client.post(self.url, {})["status"], "ERROR")
+        self.assertEqual(self.client.post(self.url, {"other": 1})["status"], "failed")
+        metrics = self.client.metrics()[self.service]
+        self.assertEqual((metrics["failures"], metrics["retries"], metrics["circuit"]), (2, 0, "open"))
+        with self.assertRaises(CircuitOpenError):
+            self.client.post(self.url, {})
+
+    def test_circuit_breaker(self):
+        self.server.statuses = [503] * 6
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.client.post(self.url, {})
+        self.assertEqual(self.client.metrics()[self.service]["circuit"], "open")
+        with self.assertRaises(CircuitOpenError):
+            self.client.post(self.url, {})
+        self.assertEqual(len(self.server.requests), 6)
+
+        # After the reset timeout, a successful trial call closes the circuit
+        self.now = 30
+        self.assertEqual(self.client.post(self.url, {}), {"status": "OK"})
+        metrics = self.client.metrics()[self.service]
+        self.assertEqual((metrics["circuit"], metrics["short_circuited"], metrics["failures"]), ("closed", 1, 2))
+
+    def test_other_request_errors_settle_the_circuit(self):
+        self.server.statuses = [503] * 6
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.client.post(self.url, {})
+
+        # A trial call failing with an error other than a connection error opens the circuit again
+        self.now = 30
+        with mock.patch.object(
+            self.client.session, "post", side_effect=requests.exceptions.ChunkedEncodingError("Connection broken")
+        ) as post, self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            self.client.post(self.url, {})
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(self.client.metrics()[self.service]["circuit"], "open")
+
+        # So does one whose body cannot be read
+        self.now = 60
+        with mock.patch.object(
+            requests.Response, "json", side_effect=requests.exceptions.ContentDecodingError("Bad gzip")
+        ), self.assertRaises(requests.exceptions.ContentDecodingError):
+            self.client.post(self.url, {})
+        self.assertEqual(self.client.metrics()[self.service]["circuit"], "open")
+
+        self.now = 90
+        self.assertEqual(self.client.post(self.url, {}), {"status": "OK"})
+        self.assertEqual(self.client.metrics()[self.service]["circuit"], "closed")
+
+    def test_identical_calls_are_coalesced(self):
+        self.server.release = threading.Event()
+        results = []
+        threads = [
+            threading.Thread(target=lambda body: results.append(self.client.post(self.url, body)), args=(body,))
+            for body in ({"report": "{}"}, {"report": "{}"}, {"report": "{}"}, {"report": "[]"})
+        ]
+        for thread in threads:
+            thread.start()
+        # Let all the calls reach the client before the responses are sent
+        time.sleep(0.2)
+        self.server.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{"status": "OK"}] * 4)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.client.metrics()[self.service]["coalesced"], 2)
+
+    def test_connection_errors(self):
+        self.server.shutdown()
+        self.server.server_close()
+        client = AgentClient(retries=1, backoff=0, failure_threshold=1)
+        self.addCleanup(client.close)
+        with mock.patch.object(agent_client, "get_client", return_value=client), self.assertLogs(
+            "products.utils"
+        ) as logs:
+            self.assertEqual(call_agent_service(self.url, {})["status"], "failed")
+            self.assertIn("Circuit open", call_agent_service(self.url, {})["error"])
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(client.metrics()[self.service]["attempts"], 2)
+
+
+class ProductSalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.product = create_product(self.user, orders=0)
+
+    def assert_rollup_matches_orders(self):
+        rollup = ProductSalesRollup.objects.get(product=self.product)
+        expected = ProductSalesRollup.compute([self.product.pk]).get(self.product.pk, ProductSalesRollup.empty())
+        for field, value in expected.items():
+            self.assertEqual(getattr(rollup, field), value, field)
+        return rollup
+
+    def test_add_delivered_order(self):
+        self.product.add_delivered_order(price=Decimal("10.00"), quantity=3)
+        self.product.add_delivered_order(price=Decimal("8.50"), quantity=2, discount=True)
+
+        rollup = self.assert_rollup_matches_orders()
+        self.assertEqual(rollup.revenue, Decimal("47.00"))
+        self.assertEqual(rollup.discounted_revenue, Decimal("17.00"))
+        self.assertEqual(rollup.order_count, 2)
+
+    def test_add_orders_after_bulk_create(self):
+        orders = DeliveredOrder.objects.bulk_create(
+            [DeliveredOrder(product=self.product, price=Decimal("5.00"), quantity=i + 1) for i in range(10)]
+        )
+        ProductSalesRollup.add_orders(orders)
+
+        rollup = self.assert_rollup_matches_orders()
+        self.assertEqual(rollup.units_sold, 55)
+
+    def test_update_and_delete_order(self):
+        order = self.product.add_delivered_order(price=Decimal("10.00"), quantity=3)
+        self.product.add_delivered_order(price=Decimal("8.50"), quantity=2, discount=True)
+
+        order.quantity = 5
+        order.save()
+        self.assertEqual(self.assert_rollup_matches_orders().units_sold, 7)
+
+        order.delete()
+        self.assertEqual(self.assert_rollup_matches_orders().units_sold, 2)
+
+    def test_rebuild_command(self):
+        self.product.add_delivered_order(price=Decimal("10.00"), quantity=3)
+        ProductSalesRollup.objects.filter(product=self.product).update(units_sold=0)
+
+        out = StringIO()
+        call_command("rebuild_sales_rollups", "--verify", stdout=out)
+        self.assertIn("1 sales rollups are out of date", out.getvalue())
+
+        call_command("rebuild_sales_rollups", stdout=StringIO())
+        self.assert_rollup_matches_orders()
+
+
+class OrderSeriesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = create_product(self.user, orders=0)
+        self.other_product = create_product(self.user, orders=0)
+
+        for product, day, price, quantity, discount in [
+            (self.product, 1, "10.00", 3, False),
+            (self.product, 1, "8.00", 2, True),
+            (self.product, 2, "10.00", 1, False),
+            (self.product, 15, "10.00", 4, False),
+            (self.other_product, 2, "5.00", 10, True),
+        ]:
+            order = product.add_delivered_order(price=Decimal(price), quantity=quantity, discount=discount)
+            DeliveredOrder.objects.filter(pk=order.pk).update(
+                created_at=datetime(2025, 4, day, 12, tzinfo=timezone.utc)
+            )
+
+    def test_product_daily_series(self):
+        response = self.client.get(f"/api/products/{self.product.id}/series/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["interval"], "day")
+        series = response.data["series"]
+        self.assertEqual([point["period"][:10] for point in series], ["2025-04-01", "2025-04-02", "2025-04-15"])
+        self.assertEqual(series[0]["revenue"], "46.00")
+        self.assertEqual(series[0]["units"], 5)
+        self.assertEqual(series[0]["discounted_units"], 2)
+        self.assertEqual(series[0]["discounted_revenue"], "16.00")
+        self.assertEqual(series[0]["order_count"], 2)
+
+    def test_product_monthly_series_with_range(self):
+        response = self.client.get(
+            f"/api/products/{self.product.id}/series/",
+            {"interval": "month", "start": "2025-04-02T00:00:00Z"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["series"]), 1)
+        self.assertEqual(response.data["series"][0]["units"], 5)
+
+    def test_all_products_weekly_series(self):
+        response = self.client.get("/api/products/series/", {"interval": "week"})
+        self.assertEqual(response.status_code, 200)
+        # 2025-04-01 and 2025-04-02 fall in the week starting Monday 2025-03-31
+        series = response.data["series"]
+        self.assertEqual([point["period"][:10] for point in series], ["2025-03-31", "2025-04-14"])
+        self.assertEqual(series[0]["units"], 16)
+
+    def test_invalid_interval(self):
+        response = self.client.get("/api/products/series/", {"interval": "year"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExplainProductQueriesTests(TestCase):
+    options = ("--products", "2", "--orders", "1", "--users", "0")
+
+    def test_refuses_shared_database(self):
+        for command in ("explain_product_queries", "benchmark_product_serializers"):
+            with self.subTest(command=command), self.assertRaisesMessage(
+                CommandError, "Refusing to seed benchmark data"
+            ):
+                call_command(command, *self.options, "--reseed", stdout=StringIO())
+        self.assertFalse(Product.objects.exists())
+
+    @override_settings(DEBUG=True)
+    def test_keeps_indexes_by_default(self):
+        out = StringIO()
+        with mock.patch("django.db.backends.base.schema.BaseDatabaseSchemaEditor.remove_index") as remove_index:
+            call_command("explain_product_queries", *self.options, stdout=out)
+        remove_index.assert_not_called()
+        self.assertIn("With indexes", out.getvalue())
+        self.assertNotIn("Without indexes", out.getvalue())
+        self.assertEqual(Product.objects.filter(user__username="benchmark").count(), 2)
+
+
+class BulkOrderIngestionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = create_product(self.user, orders=0)
+        self.other_product = create_product(self.user, orders=0)
+
+    def post(self, url, body, content_type):
+        return self.client.generic("POST", url, body, content_type=content_type)
+
+    def assert_rollup(self, product, units_sold):
+        rollup = ProductSalesRollup.objects.get(product=product)
+        self.assertEqual(rollup.units_sold, units_sold)
+        self.assertEqual(rollup.order_count, product.delivered_orders_list.count())
+
+    def test_json_array(self):
+        body = json.dumps(
+            [
+                {"price": "10.50", "quantity": 3, "discount": True, "created_at": "2024-01-01T10:00:00Z"},
+                {"price": 12, "quantity": 1},
+            ]
+        )
+        response = self.post(f"/api/products/{self.product.id}/orders/bulk/", body, "application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {"created": 2})
+        order = self.product.delivered_orders_list.get(discount=True)
+        self.assertEqual(order.price, Decimal("10.50"))
+        self.assertEqual(order.created_at, datetime(2024, 1, 1, 10, tzinfo=timezone.utc))
+        self.assert_rollup(self.product, 4)
+
+    def test_ndjson(self):
+        body = "\n".join(json.dumps({"price": "5.00", "quantity": i + 1}) for i in range(10)) + "\n"
+        response = self.post(f"/api/products/{self.product.id}/orders/bulk/", body, "application/x-ndjson")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {"created": 10})
+        self.assert_rollup(self.product, 55)
+
+    def test_csv_across_products_in_several_batches(self):
+        lines = ["product,price,quantity,discount"]
+        lines += [f"{self.product.id},10.00,1,false" for _ in range(5)]
+        lines += [f"{self.other_product.id},20.00,2,true" for _ in range(5)]
+        with self.settings(ORDER_INGESTION_BATCH_SIZE=3):
+            response = self.post("/api/products/orders/bulk/", "\n".join(lines), "text/csv")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {"created": 10})
+        self.assert_rollup(self.product, 5)
+        self.assert_rollup(self.other_product, 10)
+
+    def test_invalid_rows_create_nothing(self):
+        other_user = User.objects.create_user(username="other", password="password")
+        foreign_product = create_product(other_user, orders=0)
+        body = json.dumps(
+            [
+                {"product": self.product.id, "price": "10.00", "quantity": 1},
+                {"product": self.product.id, "price": "abc", "quantity": -1},
+                {"product": foreign_product.id, "price": "10.00", "quantity": 1},
+                {"product": self.product.id, "price": "10.00", "quantity": 1, "created_at": "yesterday"},
+            ]
+        )
+        response = self.post("/api/products/orders/bulk/", body, "application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["created"], 0)
+        self.assertEqual(response.data["error_count"], 3)
+        errors = {error["row"]: error["errors"] for error in response.data["errors"]}
+        self.assertEqual(set(errors), {2, 3, 4})
+        self.assertEqual(set(errors[2]), {"price", "quantity"})
+        self.assertIn("product", errors[3])
+        self.assertIn("created_at", errors[4])
+        self.assertFalse(DeliveredOrder.objects.exists())
+        self.assertFalse(ProductSalesRollup.objects.exists())
+
+    def test_fractional_quantities_are_rejected(self):
+        url = f"/api/products/{self.product.id}/orders/bulk/"
+        for body, content_type in (
+            ('[{"price": "10.00", "quantity": 1.5}]', "application/json"),
+            ('{"price": "10.00", "quantity": "1.5"}', "application/x-ndjson"),
+            ("price,quantity\n10.00,1.5", "text/csv"),
+            ("price,quantity\n10.00,NaN", "text/csv"),
+        ):
+            with self.subTest(body=body):
+                response = self.post(url, body, content_type)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(set(response.data["errors"][0]["errors"]), {"quantity"})
+        self.assertFalse(DeliveredOrder.objects.exists())
+
+        # Whole numbers written with decimals are fine
+        response = self.post(url, '[{"price": "10.00", "quantity": 2.0}]', "application/json")
+        self.assertEqual(response.data, {"created": 1})
+        self.assert_rollup(self.product, 2)
+
+    def test_byte_order_mark(self):
+        url = f"/api/products/{self.product.id}/orders/bulk/"
+        response = self.post(url, "\ufeffprice,quantity\n10.00,3".encode(), "text/csv")
+        self.assertEqual(response.status_code, 201, response.data)
+        response = self.post(url, '\ufeff{"price": "10.00", "quantity": 1}'.encode(), "application/x-ndjson")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assert_rollup(self.product, 4)
+
+    def test_malformed_and_unsupported_bodies(self):
+        url = f"/api/products/{self.product.id}/orders/bulk/"
+        self.assertEqual(self.post(url, "{not json", "application/json").status_code, 400)
+        self.assertEqual(self.post(url, json.dumps({"price": 1}), "application/json").status_code, 400)
+        self.assertEqual(self.post(url, "price=1", "application/x-www-form-urlencoded").status_code, 415)
+
+
+class CatalogImportTests(TestCase):
+    PRODUCTS_CSV = (
+        "external_ref,product_name,product_selling_price,product_category\n"
+        "SKU-1,Phone,100.00,Electronics\n"
+        "SKU-2,Case,20.00,Accessories\n"
+    )
+    COSTS_CSV = "product_ref,product_cost,ads_cost\nSKU-1,40.00,5.00\n"
+    ORDERS_CSV = (
+        "product_ref,price,quantity,discount,created_at\n"
+        "SKU-1,100.00,2,false,2024-01-01T10:00:00Z\n"
+        "SKU-1,90.00,1,true,2024-01-02T10:00:00Z\n"
+        "SKU-2,20.00,5,false,2024-01-03T10:00:00Z\n"
+    )
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", password="password")
+        self.user = User.objects.create_user(username="merchant", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = self.settings(CATALOG_IMPORT_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, **files):
+        data = {"username": "merchant"}
+        for name, content in files.items():
+            data[name] = SimpleUploadedFile(f"{name}.csv", content.encode(), content_type="text/csv")
+        return self.client.post("/api/products/import/", data, format="multipart")
+
+    def test_import(self):
+        response = self.upload(
+            products=self.PRODUCTS_CSV, product_costs=self.COSTS_CSV, delivered_orders=self.ORDERS_CSV
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data["status"], CatalogImport.STATUS_COMPLETED)
+        self.assertEqual(
+            (
+                response.data["products_done"],
+                response.data["product_costs_done"],
+                response.data["delivered_orders_done"],
+            ),
+            (2, 1, 3),
+        )
+
+        phone = Product.objects.get(user=self.user, external_ref="SKU-1")
+        self.assertEqual(phone.product_cost.product_cost, Decimal("40.00"))
+        self.assertEqual(phone.product_cost.ads_cost, Decimal("5.00"))
+        self.assertEqual(phone.sales_rollup.units_sold, 3)
+        self.assertEqual(phone.sales_rollup.revenue, Decimal("290.00"))
+        self.assertEqual(phone.sales_rollup.discounted_units, 1)
+        self.assertEqual(Product.objects.get(external_ref="SKU-2").sales_rollup.order_count, 1)
+
+        status_response = self.client.get(f"/api/products/import/{response.data['id']}/")
+        self.assertEqual(status_response.data["status"], CatalogImport.STATUS_COMPLETED)
+
+    def test_reimport_updates_products(self):
+        self.upload(products=self.PRODUCTS_CSV)
+        response = self.upload(products="external_ref,product_name,product_selling_price\nSKU-1,Phone 2,120.00\n")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.filter(user=self.user).count(), 2)
+        phone = Product.objects.get(user=self.user, external_ref="SKU-1")
+        self.assertEqual((phone.product_name, phone.product_selling_price), ("Phone 2", Decimal("120.00")))
+
+    def test_failed_import_resumes_after_last_chunk(self):
+        self.upload(products=self.PRODUCTS_CSV)
+        path = self.directory / "orders.csv"
+        path.write_text(self.ORDERS_CSV + "SKU-2,oops,1,false,\n" + "SKU-2,20.00,1,false,\n")
+        catalog_import = CatalogImport.objects.create(user=self.user, delivered_orders_file=str(path))
+
+        CatalogImporter(catalog_import, chunk_size=2).run()
+        catalog_import.refresh_from_db()
+        self.assertEqual(catalog_import.status, CatalogImport.STATUS_FAILED)
+        self.assertIn("line 5", catalog_import.error)
+        # The first two chunks were committed, the failing one was rolled back
+        self.assertEqual(catalog_import.delivered_orders_done, 2)
+        self.assertEqual(DeliveredOrder.objects.count(), 2)
+
+        path.write_text(self.ORDERS_CSV + "SKU-2,20.00,1,false,\n" + "SKU-2,20.00,1,false,\n")
+        response = self.client.post(f"/api/products/import/{catalog_import.pk}/resume/")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data["delivered_orders_done"], 5)
+        self.assertEqual(DeliveredOrder.objects.count(), 5)
+        self.assertEqual(Product.objects.get(external_ref="SKU-2").sales_rollup.units_sold, 7)
+
+    def test_import_orders_without_created_at(self):
+        self.upload(products=self.PRODUCTS_CSV)
+        rows = "".join(f"SKU-1,10.00,{quantity},false,\n" for quantity in range(1, 7))
+        path = self.directory / "orders.csv"
+        path.write_text("product_ref,price,quantity,discount,created_at\n" + rows)
+        catalog_import = CatalogImport.objects.create(user=self.user, delivered_orders_file=str(path))
+
+        CatalogImporter(catalog_import, chunk_size=4).run()
+        self.assertEqual(catalog_import.status, CatalogImport.STATUS_COMPLETED, catalog_import.error)
+        # Distinct timestamps, in the order of the file, across chunks
+        orders = list(DeliveredOrder.objects.order_by("created_at").values_list("quantity", "created_at"))
+        self.assertEqual([quantity for quantity, _ in orders], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(len({created_at for _, created_at in orders}), 6)
+
+    def test_byte_order_mark(self):
+        response = self.upload(products="\ufeff" + self.PRODUCTS_CSV, delivered_orders="\ufeff" + self.ORDERS_CSV)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data["status"], CatalogImport.STATUS_COMPLETED, response.data["error"])
+        self.assertEqual(Product.objects.get(external_ref="SKU-1").sales_rollup.units_sold, 3)
+
+    def test_unknown_product_and_non_admin(self):
+        response = self.upload(delivered_orders=self.ORDERS_CSV)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("unknown product_ref", response.data["error"])
+
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.upload(products=self.PRODUCTS_CSV).status_code, 403)
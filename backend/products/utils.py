@@ -1,14 +1,157 @@
 import json
+import logging
 import os
+from collections import defaultdict
 
 import requests
 from django.conf import settings
+from django.utils import timezone
+
+from fixed_costs.serializers import FixedCostsSerializer
+
+from . import agent_client
+from .margin import ORDER_SERIES_MONTHS, order_summary
+from .models import DeliveredOrder
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for each agent service call
+AGENT_TIMEOUT = 10
+
+
+def order_summaries(rows, months=ORDER_SERIES_MONTHS):
+    """
+    Build the order summary of products (see ``margin.summarize_orders``) without loading their orders.
+
+    The totals come from the sales rollup the rows are annotated with, the price groups and the
+    monthly series are aggregated by the database, in one query each, which only returns the last
+    ``months`` months of each product: the work does not grow with the number of orders nor the
+    length of the history.
+
+    Args:
+        rows (list): Rows from ``fast_serializers.product_rows``
+        months (int): Number of most recent months with orders to include in the series, at least 1
+
+    Returns:
+        dict: Product id to its order summary
+    """
+    product_ids = [row["id"] for row in rows]
+    orders = DeliveredOrder.objects.filter(product_id__in=product_ids)
+
+    groups = defaultdict(list)
+    for group in orders.price_groups(group_by=("product_id",)):
+        groups[group["product_id"]].append((group["price"], group["discount"], group["quantity"], group["order_count"]))
+
+    series = defaultdict(list)
+    for point in orders.time_series("month", group_by=("product_id",), last=months):
+        month = timezone.localtime(point["period"]).strftime("%Y-%m")
+        series[point["product_id"]].append((month, point["units"], point["revenue"], point["order_count"]))
+
+    return {
+        row["id"]: order_summary(
+            row["order_count"],
+            row["units_sold"],
+            row["revenue"],
+            groups[row["id"]],
+            series[row["id"]],
+        )
+        for row in rows
+    }
+
+
+def agent_financial_data(user, product_data, summary):
+    """
+    Build the financial data analysed by Agent 1: the user's fixed costs and the product details.
+
+    The agents get the order summary of the product instead of its delivered orders, so the
+    size of their prompt does not grow with the order history.
+
+    Args:
+        user (User): The product owner
+        product_data (dict): The serialized product, its delivered orders are left out if included
+        summary (dict): The order summary of the product, see ``order_summaries``
+
+    Returns:
+        dict: The financial data
+    """
+    fixed_costs = getattr(user, "fixed_costs", None)
+    user_fixed_costs = FixedCostsSerializer(fixed_costs).data if fixed_costs else {}
+    product_details = {field: value for field, value in product_data.items() if field != "delivered_orders"}
+    product_details["order_summary"] = summary
+    return {"user": {"fixed_costs": user_fixed_costs}, "product_details": product_details}
+
+
+def agent1_request(financial_data):
+    """
+    Return the URL and body of an Agent 1 call, or an error report if the service is not configured.
+    """
+    agent1_url = os.environ.get("AGENT1_SERVICE_URL", "")
+    if not agent1_url:
+        return None, {"error": "AGENT1_SERVICE_URL not configured", "status": "failed"}
+    # The profit margin analysis endpoint reads the "financial_data" key
+    return agent1_url, {"financial_data": financial_data}
+
+
+def agent2_request(agent1_result):
+    """
+    Return the URL and body of an Agent 2 call, or an error report if the service is not configured.
+    """
+    agent2_url = os.environ.get("AGENT2_SERVICE_URL", "")
+    if not agent2_url:
+        return None, {"error": "AGENT2_SERVICE_URL not configured", "status": "failed"}
+    # The recommendation endpoint reads Agent 1's report as a string under the "report" key. The run's
+    # model and token usage are only recorded with the snapshot (see models.ProductReport)
+    if isinstance(agent1_result, dict):
+        agent1_result = {key: value for key, value in agent1_result.items() if key != "meta"}
+    return agent2_url, {"report": canonical_json(agent1_result)}
+
+
+def canonical_json(value):
+    """
+    Serialize to JSON with sorted keys and no whitespace, as the agent service serializes the agent
+    inputs (see ai_agent.utils.single_flight.canonical_json), so that the same report gets the same
+    single-flight and response cache keys there whether it comes from the backend or the pipeline.
+    """
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def pipeline_request(financial_data):
+    """
+    Return the URL and body of a pipeline call, running both agents, or None if the service is not configured.
+    """
+    pipeline_url = os.environ.get("AGENT_PIPELINE_SERVICE_URL", "")
+    if not pipeline_url:
+        return None, None
+    return pipeline_url, {"financial_data": financial_data}
+
+
+def batch_request(items):
+    """
+    Return the URL and body of a batch report call, or an error report if the service is not configured.
+
+    Args:
+        items (list): (id, financial data) pairs
+    """
+    batch_url = os.environ.get("AGENT_BATCH_SERVICE_URL", "")
+    if not batch_url:
+        return None, {"error": "AGENT_BATCH_SERVICE_URL not configured", "status": "failed"}
+    return batch_url, {"items": [{"id": item_id, "financial_data": data} for item_id, data in items]}
+
+
+def stream_url(url):
+    """
+    Return the URL of the streaming variant of an agent endpoint.
+    """
+    return f"{url.rstrip('/')}/stream"
 
 
 def call_agent_service(url, data):
     """
     Make an API call to an external agent service.
 
+    The call goes through the shared ``AgentClient``, which reuses connections, retries
+    transient failures and stops calling a service that keeps failing.
+
     Args:
         url (str): The URL of the external service
         data (dict): The data to send to the service
@@ -17,55 +160,180 @@ def call_agent_service(url, data):
         dict: The JSON response from the service, or an error message if the call failed
     """
     try:
-        response = requests.post(
-            url, json=data, headers={"Content-Type": "application/json"}, timeout=10  # 10 second timeout
-        )
-        response.raise_for_status()  # Raise an exception for 4XX/5XX responses
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return agent_client.get_client().post(url, data)
+    except (requests.exceptions.RequestException, ValueError) as e:
         # Log the error and return a fallback response
-        print(f"Error calling external service: {e}")
+        logger.warning("Error calling external service %s: %s", url, e)
         return {"error": str(e), "status": "failed"}
 
 
-def get_agent1_report(product_data):
+def get_agent1_report(financial_data):
     """
     Get a report from Agent 1 service for a product.
 
     Args:
-        product_data (dict): The product data
+        financial_data (dict): The financial data, see ``agent_financial_data``
 
     Returns:
         dict: The report from Agent 1
     """
-    agent1_url = os.environ.get("AGENT1_SERVICE_URL", "")
-    if not agent1_url:
-        return {"error": "AGENT1_SERVICE_URL not configured", "status": "failed"}
-
-    # Prepare data for Agent 1
-    request_data = {"product": product_data}
+    url, request_data = agent1_request(financial_data)
+    if url is None:
+        return request_data
 
     # Call the Agent 1 service
-    return call_agent_service(agent1_url, request_data)
+    return call_agent_service(url, request_data)
 
 
-def get_agent2_report(agent1_result, product_data):
+def get_agent2_report(agent1_result):
     """
     Get a report from Agent 2 service based on the result from Agent 1.
 
     Args:
         agent1_result (dict): The result from Agent 1
-        product_data (dict): The original product data
 
     Returns:
         dict: The report from Agent 2
     """
-    agent2_url = os.environ.get("AGENT2_SERVICE_URL", "")
-    if not agent2_url:
-        return {"error": "AGENT2_SERVICE_URL not configured", "status": "failed"}
-
-    # Prepare data for Agent 2 (includes both original product data and Agent 1 results)
-    request_data = {"product": product_data, "agent1_report": agent1_result}
+    url, request_data = agent2_request(agent1_result)
+    if url is None:
+        return request_data
 
     # Call the Agent 2 service
-    return call_agent_service(agent2_url, request_data)
+    return call_agent_service(url, request_data)
+
+
+def get_agent_reports(financial_data):
+    """
+    Get the reports of both agents for a product.
+
+    With AGENT_PIPELINE_SERVICE_URL, the agent service runs both agents in one call, passing
+    Agent 1's report to Agent 2 in-process. Otherwise Agent 1 then Agent 2 are called.
+
+    Args:
+        financial_data (dict): The financial data, see ``agent_financial_data``
+
+    Returns:
+        dict: {"report_1": ..., "report_2": ...}; on failure the reports are error messages, like
+            the ones of ``call_agent_service``
+    """
+    url, request_data = pipeline_request(financial_data)
+    if url is None:
+        report_1 = get_agent1_report(financial_data)
+        return {"report_1": report_1, "report_2": get_agent2_report(report_1)}
+
+    result = call_agent_service(url, request_data)
+    if result.get("status") == "OK" and "report_1" in result and "report_2" in result:
+        logger.info("Agent pipeline %s timings: %s", url, result.get("timings"))
+        return {"report_1": result["report_1"], "report_2": result["report_2"]}
+    error = (
+        result if "error" in result else {"error": result.get("message", "Agent pipeline failed"), "status": "failed"}
+    )
+    return {"report_1": error, "report_2": error}
+
+
+def get_batch_reports(items):
+    """
+    Get the reports of both agents for several financial payloads from the batch endpoint of the agent service.
+
+    The service runs the payloads concurrently and streams each result as soon as it is ready.
+
+    Args:
+        items (list): (id, financial data) pairs, see ``agent_financial_data``
+
+    Yields:
+        tuple: (id, {"report_1": ..., "report_2": ...}) in completion order; on failure the reports are
+            error messages, like the ones of ``call_agent_service``
+    """
+    url, request_data = batch_request(items)
+    if url is None:
+        for item_id, _ in items:
+            yield item_id, {"report_1": request_data, "report_2": request_data}
+        return
+
+    pending = {item_id for item_id, _ in items}
+    try:
+        for line in agent_client.get_client().post_lines(url, request_data):
+            result = json.loads(line)
+            item_id = result.get("id")
+            if item_id not in pending:
+                continue
+            pending.discard(item_id)
+            if result.get("status") == "OK":
+                yield item_id, {"report_1": result["report_1"], "report_2": result["report_2"]}
+            else:
+                error = {"error": result.get("message", "Agent batch failed"), "status": "failed"}
+                yield item_id, {"report_1": error, "report_2": error}
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning("Error calling external service %s: %s", url, e)
+        error = {"error": str(e), "status": "failed"}
+    else:
+        error = {"error": "Missing from the agent batch response", "status": "failed"}
+    for item_id in sorted(pending):
+        yield item_id, {"report_1": error, "report_2": error}
+
+
+def stream_agent_events(url, data):
+    """
+    Call the streaming variant of an agent endpoint and parse the Server-Sent Events it sends.
+
+    Yields:
+        tuple: (event name, decoded JSON data)
+    """
+    event = "message"
+    for line in agent_client.get_client().post_lines(url, data):
+        line = line.decode()
+        if line.startswith("event:"):
+            event = line[len("event:") :].strip()
+        elif line.startswith("data:"):
+            yield event, json.loads(line[len("data:") :])
+            event = "message"
+
+
+def stream_agent_report(agent, request):
+    """
+    Relay the events of one streamed agent run, and return its report.
+
+    Args:
+        agent (int): Number of the agent, added to the events
+        request (tuple): (url, body) of the non-streaming call, or (None, error report), see ``agent1_request``
+
+    Yields:
+        tuple: (agent, event name, data) for each event of the run
+
+    Returns:
+        dict: The final output of the run, like the response of the non-streaming endpoint, or an error report
+    """
+    url, request_data = request
+    if url is None:
+        yield agent, "error", request_data
+        return request_data
+
+    report = {"error": "The agent stream ended without a final output", "status": "failed"}
+    try:
+        for event, data in stream_agent_events(stream_url(url), request_data):
+            yield agent, event, data
+            if event == "final_output":
+                report = data
+            elif event == "error":
+                report = {"error": data.get("message", "Agent run failed"), "status": "failed"}
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning("Error calling external service %s: %s", url, e)
+        report = {"error": str(e), "status": "failed"}
+        yield agent, "error", report
+    return report
+
+
+def stream_agent_reports(financial_data):
+    """
+    Run Agent 1 then Agent 2 with their streaming endpoints, relaying the events of both runs.
+
+    Yields:
+        tuple: (agent number, event name, data)
+
+    Returns:
+        dict: {"report_1": ..., "report_2": ...}, as ``get_agent1_report`` and ``get_agent2_report`` return them
+    """
+    agent1_result = yield from stream_agent_report(1, agent1_request(financial_data))
+    agent2_result = yield from stream_agent_report(2, agent2_request(agent1_result))
+    return {"report_1": agent1_result, "report_2": agent2_result}
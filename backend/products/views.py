@@ -1,13 +1,61 @@
-import json
-
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from drf_spectacular.utils import OpenApiExample, OpenApiParameter, OpenApiResponse, extend_schema
-from rest_framework import mixins, permissions, status, viewsets
+from rest_framework import generics, mixins, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 
-from .models import Product, ProductCost
-from .serializers import ProductCostSerializer, ProductDetailSerializer, ProductSerializer
+from core.renderers import EventStreamRenderer, ORJSONRenderer, format_event
+
+from . import agent_client, report_cache, report_jobs
+from .catalog_import import CatalogImporter
+from .conditional import add_validators, conditional_response, product_list_validators, product_validators
+from .fast_serializers import product_rows, serialize_product_detail, serialize_products
+from .ingestion import OrderIngestion, read_rows
+from .margin import margin_summary
+from .models import CatalogImport, DeliveredOrder, Product, ProductCost, ProductReport, ReportJob
+from .pagination import DeliveredOrderCursorPagination, ProductCursorPagination, ProductReportCursorPagination
+from .serializers import (
+    BatchReportRequestSerializer,
+    CatalogImportRequestSerializer,
+    CatalogImportSerializer,
+    DeliveredOrderSerializer,
+    OrderSeriesPointSerializer,
+    OrderSeriesQuerySerializer,
+    ProductCostSerializer,
+    ProductDetailSerializer,
+    ProductReportDetailSerializer,
+    ProductReportSerializer,
+    ProductSerializer,
+    ReportJobSerializer,
+)
+
+INCLUDE_ORDERS_PARAMETER = OpenApiParameter(
+    name="include_orders",
+    type=bool,
+    location=OpenApiParameter.QUERY,
+    required=False,
+    description="Include the full list of delivered orders for each product (disabled by default).",
+)
+
+CURSOR_PARAMETERS = [
+    OpenApiParameter(
+        name="cursor",
+        type=str,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description="Opaque cursor taken from the next/previous link of the previous page.",
+    ),
+    OpenApiParameter(
+        name="page_size",
+        type=int,
+        location=OpenApiParameter.QUERY,
+        required=False,
+        description="Number of results per page.",
+    ),
+]
 
 
 class ProductViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
@@ -19,18 +67,76 @@ class ProductViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     associated product costs, adding product costs to products, and updating product costs.
 
     Note: The main list endpoint has been removed. Use /with-costs or /without-costs
-    endpoints instead to get lists of products.
+    endpoints instead to get lists of products. Both are cursor paginated, as is the
+    /{id}/orders sub-resource listing the delivered orders of a product.
     """
 
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
     http_method_names = ["get", "post", "head", "options"]  # Only allow GET and special POST actions
 
     def get_queryset(self):
         """
-        Return products belonging to the current user.
+        Return products belonging to the current user, annotated with their sales aggregates.
+
+        The list and retrieve actions read it as ``.values()`` rows through
+        ``fast_serializers``, which load the delivered orders themselves with one
+        query. The cost actions serialize model instances and get the product
+        costs joined.
+        """
+        if self.action in (
+            "product_orders",
+            "product_series",
+            "bulk_create_product_orders",
+            "product_report",
+            "product_reports",
+            "product_report_version",
+        ):
+            # Only used to check ownership of the product
+            return Product.objects.filter(user=self.request.user)
+
+        queryset = Product.objects.filter(user=self.request.user).with_financials().with_cost_flag()
+        if self.action in ("add_product_costs", "update_product_costs"):
+            queryset = queryset.select_related("product_cost")
+        return queryset
+
+    def get_object_row(self):
+        """
+        Like ``get_object``, but return the product as a ``product_rows`` row, with its product costs.
+        """
+        queryset = product_rows(self.filter_queryset(self.get_queryset()), with_costs=True)
+        return generics.get_object_or_404(queryset, pk=self.kwargs["pk"])
+
+    def paginated_products_response(self, products):
+        """
+        Paginate products and serialize the page with the fast read path.
+
+        Answers 304 Not Modified if none of the user's products changed since the client's copy.
+        """
+        not_modified, headers = conditional_response(
+            self.request, product_list_validators(Product.objects.filter(user=self.request.user))
+        )
+        if not_modified:
+            return not_modified
+
+        page = self.paginate_queryset(product_rows(products))
+        response = self.get_paginated_response(serialize_products(page, include_orders=self.include_orders()))
+        return add_validators(response, headers)
+
+    def include_orders(self):
+        """
+        Whether the client asked for the full delivered order list via ``?include_orders=true``.
+        """
+        return self.request.query_params.get("include_orders", "").lower() in ("1", "true", "yes")
+
+    def get_serializer_context(self):
+        """
+        Add the include_orders flag to the serializer context.
         """
-        return Product.objects.filter(user=self.request.user)
+        context = super().get_serializer_context()
+        context["include_orders"] = self.include_orders()
+        return context
 
     def get_serializer_class(self):
         """
@@ -42,11 +148,13 @@ class ProductViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
 
     @extend_schema(
         summary="List products without costs",
-        description="Returns a list of all products that do not have associated product costs.",
+        description="Returns a cursor-paginated list of the products that do not have associated product costs.",
+        parameters=[INCLUDE_ORDERS_PARAMETER, *CURSOR_PARAMETERS],
         responses={
             200: OpenApiResponse(
                 response=ProductSerializer(many=True), description="List of products without product costs"
             ),
+            304: OpenApiResponse(description="No product changed since the client's copy"),
         },
     )
     @action(detail=False, methods=["get"], url_path="without-costs")
@@ -55,20 +163,21 @@ class ProductViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
         Get all products that don't have product costs.
 
         Returns:
-            200 OK: List of products without product costs
+            200 OK: Page of products without product costs
+            304 Not Modified: If the client's copy (If-None-Match / If-Modified-Since) is still current
         """
         # Get products without product costs using related name
-        products = self.get_queryset().filter(product_cost__isnull=True)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return self.paginated_products_response(self.get_queryset().filter(product_cost__isnull=True))
 
     @extend_schema(
         summary="List products with costs",
-        description="Returns a list of all products that have associated product costs.",
+        description="Returns a cursor-paginated list of the products that have associated product costs.",
+        parameters=[INCLUDE_ORDERS_PARAMETER, *CURSOR_PARAMETERS],
         responses={
             200: OpenApiResponse(
                 response=ProductSerializer(many=True), description="List of products with product costs"
             ),
+            304: OpenApiResponse(description="No product changed since the client's copy"),
         },
     )
     @action(detail=False, methods=["get"], url_path="with-costs")
@@ -77,12 +186,591 @@ class ProductViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
         Get all products that have product costs.
 
         Returns:
-            200 OK: List of products with product costs
+            200 OK: Page of products with product costs
+            304 Not Modified: If the client's copy (If-None-Match / If-Modified-Since) is still current
         """
         # Get products with product costs using related name
-        products = self.get_queryset().filter(product_cost__isnull=False)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return self.paginated_products_response(self.get_queryset().filter(product_cost__isnull=False))
+
+    @extend_schema(
+        summary="List the delivered orders of a product",
+        description="Returns the delivered orders of a product, newest first, using cursor pagination.",
+        parameters=CURSOR_PARAMETERS,
+        responses={
+            200: OpenApiResponse(response=DeliveredOrderSerializer(many=True), description="Page of delivered orders"),
+            404: OpenApiResponse(description="Product not found"),
+        },
+    )
+    @action(detail=True, methods=["get"], url_path="orders")
+    def product_orders(self, request, pk=None):
+        """
+        Get the delivered orders of a product, one page at a time.
+
+        Returns:
+            200 OK: Page of delivered orders, with links to the next and previous pages
+            404 Not Found: If product not found
+        """
+        product = self.get_object()
+
+        paginator = DeliveredOrderCursorPagination()
+        page = paginator.paginate_queryset(product.delivered_orders_list.all(), request, view=self)
+        serializer = DeliveredOrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def bulk_orders_response(self, product=None):
+        """
+        Ingest the delivered orders in the request body and build the response.
+
+        Args:
+            product (Product, optional): The product all orders belong to. If not given,
+                each row must contain the id of one of the user's products.
+
+        Returns:
+            Response: 201 with the number of created orders, or 400 with the per-row errors
+        """
+        result = OrderIngestion(self.request.user, product=product).run(read_rows(self.request))
+        if result.get("error_count"):
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    @extend_schema(
+        summary="Bulk create delivered orders for a product",
+        description="Creates many delivered orders at once from a JSON array, NDJSON or CSV body "
+        "(columns price, quantity, discount, created_at). NDJSON and CSV bodies are streamed. "
+        "Either all orders are created, or none and the per-row errors are returned.",
+        request={
+            "application/json": {"type": "array", "items": {"type": "object"}},
+            "application/x-ndjson": {"type": "string"},
+            "text/csv": {"type": "string"},
+        },
+        responses={
+            201: OpenApiResponse(description="Number of created orders"),
+            400: OpenApiResponse(description="Malformed body or invalid rows, with the per-row errors"),
+            404: OpenApiResponse(description="Product not found"),
+            415: OpenApiResponse(description="Unsupported content type"),
+        },
+        examples=[
+            OpenApiExample(
+                name="Bulk Orders Example",
+                value=[
+                    {"price": 2700, "quantity": 3, "discount": False, "created_at": "2025-04-01T10:00:00Z"},
+                    {"price": 2500, "quantity": 1, "discount": True},
+                ],
+                request_only=True,
+            ),
+        ],
+    )
+    @action(detail=True, methods=["post"], url_path="orders/bulk")
+    def bulk_create_product_orders(self, request, pk=None):
+        """
+        Create many delivered orders for a product in one request.
+
+        Returns:
+            201 Created: Number of created orders
+            400 Bad Request: If the body is malformed or any row is invalid
+            404 Not Found: If product not found
+            415 Unsupported Media Type: If the body is not JSON, NDJSON or CSV
+        """
+        return self.bulk_orders_response(self.get_object())
+
+    @extend_schema(
+        summary="Bulk create delivered orders for several products",
+        description="Creates many delivered orders at once from a JSON array, NDJSON or CSV body "
+        "(columns product, price, quantity, discount, created_at). NDJSON and CSV bodies are streamed. "
+        "Either all orders are created, or none and the per-row errors are returned.",
+        request={
+            "application/json": {"type": "array", "items": {"type": "object"}},
+            "application/x-ndjson": {"type": "string"},
+            "text/csv": {"type": "string"},
+        },
+        responses={
+            201: OpenApiResponse(description="Number of created orders"),
+            400: OpenApiResponse(description="Malformed body or invalid rows, with the per-row errors"),
+            415: OpenApiResponse(description="Unsupported content type"),
+        },
+    )
+    @action(detail=False, methods=["post"], url_path="orders/bulk")
+    def bulk_create_orders(self, request):
+        """
+        Create many delivered orders for any of the user's products in one request.
+
+        Returns:
+            201 Created: Number of created orders
+            400 Bad Request: If the body is malformed or any row is invalid
+            415 Unsupported Media Type: If the body is not JSON, NDJSON or CSV
+        """
+        return self.bulk_orders_response()
+
+    def run_catalog_import(self, catalog_import):
+        """
+        Run a catalog import and build the response from its outcome.
+        """
+        catalog_import = CatalogImporter(catalog_import).run()
+        data = CatalogImportSerializer(catalog_import).data
+        if catalog_import.status == CatalogImport.STATUS_FAILED:
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(
+        summary="Import a merchant catalogue",
+        description="Admin only. Imports products, product costs and delivered orders from CSV files for a user, "
+        "using COPY on PostgreSQL. Products are matched on their external_ref. A failed import can be resumed.",
+        request={"multipart/form-data": CatalogImportRequestSerializer},
+        responses={
+            201: OpenApiResponse(response=CatalogImportSerializer, description="Completed import"),
+            400: OpenApiResponse(response=CatalogImportSerializer, description="Invalid request or failed import"),
+            403: OpenApiResponse(description="Not an admin user"),
+        },
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        permission_classes=[permissions.IsAdminUser],
+        parser_classes=[MultiPartParser],
+    )
+    def catalog_import(self, request):
+        """
+        Import CSV files of products, product costs and delivered orders for a user.
+
+        Request body (multipart):
+            username (str): Username the imported products belong to
+            products (file, optional): CSV with external_ref, product_name, product_selling_price, ...
+            product_costs (file, optional): CSV with product_ref, product_cost, confirmation_fees, ...
+            delivered_orders (file, optional): CSV with product_ref, price, quantity, discount, created_at
+
+        Returns:
+            201 Created: The completed import
+            400 Bad Request: If validation fails, or the import failed (it can then be resumed)
+        """
+        serializer = CatalogImportRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        catalog_import = CatalogImport.objects.create(user=serializer.validated_data["username"])
+        directory = settings.CATALOG_IMPORT_DIR / str(catalog_import.pk)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ("products", "product_costs", "delivered_orders"):
+            upload = serializer.validated_data.get(name)
+            if upload:
+                path = directory / f"{name}.csv"
+                with open(path, "wb") as destination:
+                    for data in upload.chunks():
+                        destination.write(data)
+                setattr(catalog_import, f"{name}_file", str(path))
+        catalog_import.save()
+
+        return self.run_catalog_import(catalog_import)
+
+    @extend_schema(
+        summary="Get the status of a catalogue import",
+        description="Admin only. Returns the status and progress of a catalogue import.",
+        responses={
+            200: OpenApiResponse(response=CatalogImportSerializer, description="The import"),
+            404: OpenApiResponse(description="Import not found"),
+        },
+    )
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"import/(?P<import_id>\d+)",
+        permission_classes=[permissions.IsAdminUser],
+    )
+    def catalog_import_status(self, request, import_id=None):
+        """
+        Get the status and progress of a catalogue import.
+
+        Returns:
+            200 OK: The import
+            404 Not Found: If the import does not exist
+        """
+        return Response(CatalogImportSerializer(get_object_or_404(CatalogImport, pk=import_id)).data)
+
+    @extend_schema(
+        summary="Resume a catalogue import",
+        description="Admin only. Resumes a failed or interrupted catalogue import after its last committed chunk.",
+        request=None,
+        responses={
+            201: OpenApiResponse(response=CatalogImportSerializer, description="Completed import"),
+            400: OpenApiResponse(response=CatalogImportSerializer, description="The import failed again"),
+            404: OpenApiResponse(description="Import not found"),
+        },
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path=r"import/(?P<import_id>\d+)/resume",
+        permission_classes=[permissions.IsAdminUser],
+    )
+    def resume_catalog_import(self, request, import_id=None):
+        """
+        Resume a catalogue import where it stopped.
+
+        Returns:
+            201 Created: The completed import
+            400 Bad Request: If the import failed again
+            404 Not Found: If the import does not exist
+        """
+        catalog_import = get_object_or_404(CatalogImport, pk=import_id)
+        if catalog_import.status == CatalogImport.STATUS_COMPLETED:
+            return Response(CatalogImportSerializer(catalog_import).data)
+        return self.run_catalog_import(catalog_import)
+
+    @extend_schema(
+        summary="Get the agent report cache statistics",
+        description="Admin only. Returns the number of product detail requests served from the agent report cache "
+        "(hits) and the number that had to call the agents (misses).",
+        responses={
+            200: OpenApiResponse(
+                description="Cache statistics",
+                examples=[
+                    OpenApiExample("Statistics", value={"hits": 120, "misses": 30, "hit_rate": 0.8}, response_only=True)
+                ],
+            ),
+        },
+    )
+    @action(detail=False, methods=["get"], url_path="report-cache", permission_classes=[permissions.IsAdminUser])
+    def report_cache_stats(self, request):
+        """
+        Get the hit and miss counts of the agent report cache.
+
+        Returns:
+            200 OK: The hits, the misses and the hit rate (null before the first lookup)
+        """
+        return Response(report_cache.stats())
+
+    @extend_schema(
+        summary="Get the agent service client metrics",
+        description="Admin only. Returns, per agent service called by this process, the number of calls, "
+        "attempts, retries, failures, calls refused by the circuit breaker and calls coalesced with an "
+        "identical one in flight, the mean and max latency "
+        "of the attempts in seconds, and the state of the circuit breaker.",
+        responses={200: OpenApiResponse(description="Metrics per service")},
+    )
+    @action(detail=False, methods=["get"], url_path="agent-services", permission_classes=[permissions.IsAdminUser])
+    def agent_service_stats(self, request):
+        """
+        Get the metrics of the HTTP client calling the agent services.
+
+        Returns:
+            200 OK: The metrics of each service, keyed by scheme and host
+        """
+        return Response(agent_client.get_client().metrics())
+
+    @extend_schema(
+        summary="Get the agent reports of a product",
+        description="Returns the status of the latest job generating the agent reports of a product, "
+        "or of the job given by ?job=, with the reports once it completed. "
+        "Poll it after the product detail returned report_status pending.",
+        parameters=[
+            OpenApiParameter(
+                name="job",
+                type=int,
+                location=OpenApiParameter.QUERY,
+                required=False,
+                description="Id of the job, as returned in report_job by the product detail.",
+            )
+        ],
+        responses={
+            200: OpenApiResponse(response=ReportJobSerializer, description="The report job"),
+            404: OpenApiResponse(description="Product or report job not found"),
+        },
+    )
+    @action(detail=True, methods=["get"], url_path="report")
+    def product_report(self, request, pk=None):
+        """
+        Get the status and the results of the generation of a product's agent reports.
+
+        Returns:
+            200 OK: The job, with report_1 and report_2 once its status is completed
+            404 Not Found: If product not found, or no reports were requested for it
+        """
+        product = self.get_object()
+        jobs = ReportJob.objects.filter(product=product)
+        job_id = request.query_params.get("job")
+        if job_id:
+            job = generics.get_object_or_404(jobs, pk=job_id)
+        else:
+            job = jobs.order_by("-created_at").first()
+            if job is None:
+                return Response(
+                    {"detail": "No reports were requested for this product."}, status=status.HTTP_404_NOT_FOUND
+                )
+        return Response(ReportJobSerializer(job).data)
+
+    @extend_schema(
+        summary="List the report snapshots of a product",
+        description="Returns the versions of a product's agent reports, latest first, with the model, "
+        "token usage and latency of each, using cursor pagination. Get the reports of a version "
+        "at /{id}/reports/{version}/.",
+        parameters=CURSOR_PARAMETERS,
+        responses={
+            200: OpenApiResponse(response=ProductReportSerializer(many=True), description="Page of report snapshots"),
+            404: OpenApiResponse(description="Product not found"),
+        },
+    )
+    @action(detail=True, methods=["get"], url_path="reports")
+    def product_reports(self, request, pk=None):
+        """
+        Get the history of a product's agent reports, one page at a time.
+
+        Returns:
+            200 OK: Page of report snapshots, with links to the next and previous pages
+            404 Not Found: If product not found
+        """
+        product = self.get_object()
+
+        paginator = ProductReportCursorPagination()
+        page = paginator.paginate_queryset(
+            ProductReport.objects.filter(product=product).defer("report_1", "report_2"), request, view=self
+        )
+        serializer = ProductReportSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @extend_schema(
+        summary="Get a report snapshot of a product",
+        description="Returns the reports of both agents recorded under the given version.",
+        responses={
+            200: OpenApiResponse(response=ProductReportDetailSerializer, description="The report snapshot"),
+            404: OpenApiResponse(description="Product or version not found"),
+        },
+    )
+    @action(detail=True, methods=["get"], url_path=r"reports/(?P<version>\d+)")
+    def product_report_version(self, request, pk=None, version=None):
+        """
+        Get one version of a product's agent reports.
+
+        Returns:
+            200 OK: The snapshot with report_1 and report_2
+            404 Not Found: If product or version not found
+        """
+        product = self.get_object()
+        snapshot = generics.get_object_or_404(ProductReport.objects.filter(product=product), version=version)
+        return Response(ProductReportDetailSerializer(snapshot).data)
+
+    @extend_schema(
+        summary="Stream the agent reports of a product",
+        description="Server-Sent Events relaying the runs of both agents. The first event, margin, holds the "
+        "figures computed by the margin engine. Then, unless the reports are cached, the events of the "
+        "Agent 1 and Agent 2 runs follow as {agent: 1 or 2, data: ...}: tool_call_started, "
+        "calculation_results, partial_output (text deltas of the output), final_output and error. "
+        "The last event, reports, holds report_1 and report_2 as the product detail returns them.",
+        responses={
+            (200, "text/event-stream"): OpenApiResponse(description="Stream of Server-Sent Events"),
+            404: OpenApiResponse(description="Product not found"),
+        },
+    )
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="report/stream",
+        renderer_classes=[EventStreamRenderer, ORJSONRenderer],
+    )
+    def stream_product_report(self, request, pk=None):
+        """
+        Stream the generation of a product's agent reports as Server-Sent Events.
+
+        Returns:
+            200 OK: The stream of events
+            404 Not Found: If product not found
+        """
+        from .utils import agent_financial_data, order_summaries
+
+        row = self.get_object_row()
+        product_data = serialize_product_detail(row)
+        financial_data = agent_financial_data(request.user, product_data, order_summaries([row])[row["id"]])
+        response = StreamingHttpResponse(
+            self.report_events(product_data["id"], financial_data), content_type=EventStreamRenderer.media_type
+        )
+        # Proxies must forward each event as soon as it is written
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def report_events(self, product_id, financial_data):
+        """
+        Yield the Server-Sent Events of ``stream_product_report``.
+        """
+        from .utils import stream_agent_reports
+
+        yield format_event("margin", margin_summary(financial_data))
+
+        reports, cache_status = report_jobs.find_reports(product_id, financial_data)
+        if reports is None:
+            events = stream_agent_reports(financial_data)
+            while True:
+                try:
+                    agent, event, data = next(events)
+                except StopIteration as stop:
+                    reports = stop.value
+                    break
+                yield format_event(event, {"agent": agent, "data": data})
+            reports = report_jobs.store_reports(product_id, financial_data, reports)
+        yield format_event("reports", {"report_cache": cache_status, **reports})
+
+    @extend_schema(
+        summary="Get the agent reports of several products",
+        description="Analyses all the user's products, or the ones given in product_ids, in one request. "
+        "The response is streamed as newline-delimited JSON, one line per product as soon as its reports "
+        "are ready: product_id, margin, report_cache (hit, snapshot or miss), report_1, report_2 and report_version. "
+        "Cached reports and snapshots come first; "
+        "the other products are sent to the batch endpoint of the agent service, which analyses them "
+        "concurrently.",
+        request=BatchReportRequestSerializer,
+        responses={
+            200: OpenApiResponse(description="Newline-delimited JSON stream of the reports of each product"),
+            400: OpenApiResponse(description="Invalid request, or too many products"),
+            404: OpenApiResponse(description="Some of the products were not found"),
+        },
+    )
+    @action(detail=False, methods=["post"], url_path="reports/batch")
+    def batch_reports(self, request):
+        """
+        Get the reports of both agents for many products at once.
+
+        The financial data of all the products is built with four queries: the products with
+        their costs and sales aggregates, the price groups and the monthly series of their
+        orders and the user's fixed costs.
+
+        Request body:
+            product_ids (list of int, optional): The products to analyse, all the user's products by default
+
+        Returns:
+            200 OK: Stream of one JSON line per product
+            400 Bad Request: If validation fails or more than AGENT_BATCH_MAX_PRODUCTS products are selected
+            404 Not Found: If some of the products do not exist or belong to another user
+        """
+        from .utils import agent_financial_data, order_summaries
+
+        serializer = BatchReportRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product_ids = serializer.validated_data.get("product_ids")
+
+        products = Product.objects.filter(user=request.user).with_financials().with_cost_flag().order_by("id")
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        max_products = settings.AGENT_BATCH_MAX_PRODUCTS
+        rows = list(product_rows(products, with_costs=True)[: max_products + 1])
+        if len(rows) > max_products:
+            return Response(
+                {"detail": f"At most {max_products} products can be analysed at once, select them with product_ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        missing = set(product_ids or ()) - {row["id"] for row in rows}
+        if missing:
+            return Response(
+                {"detail": "Products not found.", "product_ids": sorted(missing)}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        summaries = order_summaries(rows)
+        payloads = {
+            row["id"]: agent_financial_data(request.user, serialize_product_detail(row), summaries[row["id"]])
+            for row in rows
+        }
+        return StreamingHttpResponse(self.batch_report_lines(payloads), content_type="application/x-ndjson")
+
+    def batch_report_lines(self, payloads):
+        """
+        Yield the JSON lines of a batch report response: cached reports first, then the agents' results.
+
+        Args:
+            payloads (dict): Product id to its financial data for Agent 1
+        """
+        from .utils import get_batch_reports
+
+        renderer = ORJSONRenderer()
+        found = report_jobs.find_many_reports(payloads)
+        misses = []
+        for product_id, financial_data in payloads.items():
+            if product_id not in found:
+                misses.append((product_id, financial_data))
+                continue
+            reports, cache_status = found[product_id]
+            line = {"product_id": product_id, "margin": margin_summary(financial_data), "report_cache": cache_status}
+            yield renderer.render({**line, **reports}) + b"\n"
+
+        if misses:
+            for product_id, reports in get_batch_reports(misses):
+                financial_data = payloads[product_id]
+                reports = report_jobs.store_reports(product_id, financial_data, reports)
+                line = {"product_id": product_id, "margin": margin_summary(financial_data), "report_cache": "miss"}
+                yield renderer.render({**line, **reports}) + b"\n"
+
+    def order_series_response(self, orders):
+        """
+        Build the time series response for the given delivered orders.
+
+        Args:
+            orders (QuerySet): The delivered orders to aggregate
+
+        Returns:
+            Response: The interval and the list of series points, oldest first
+        """
+        query = OrderSeriesQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        if "start" in params:
+            orders = orders.filter(created_at__gte=params["start"])
+        if "end" in params:
+            orders = orders.filter(created_at__lt=params["end"])
+
+        series = orders.time_series(params["interval"])
+        return Response({"interval": params["interval"], "series": OrderSeriesPointSerializer(series, many=True).data})
+
+    @extend_schema(
+        summary="Get the order time series of a product",
+        description="Returns the revenue, units and discount mix of a product's delivered orders "
+        "per day, week or month, aggregated by the database.",
+        parameters=[OrderSeriesQuerySerializer],
+        responses={
+            200: OpenApiResponse(description="Interval and list of series points, oldest first"),
+            400: OpenApiResponse(description="Invalid query parameters"),
+            404: OpenApiResponse(description="Product not found"),
+        },
+    )
+    @action(detail=True, methods=["get"], url_path="series")
+    def product_series(self, request, pk=None):
+        """
+        Get the order time series of a product.
+
+        Query parameters:
+            interval (str, optional): "day", "week" or "month". Defaults to "day"
+            start (datetime, optional): Only include orders recorded at or after this time
+            end (datetime, optional): Only include orders recorded before this time
+
+        Returns:
+            200 OK: Interval and list of series points
+            400 Bad Request: If the query parameters are invalid
+            404 Not Found: If product not found
+        """
+        product = self.get_object()
+        return self.order_series_response(product.delivered_orders_list.all())
+
+    @extend_schema(
+        summary="Get the order time series of all products",
+        description="Returns the revenue, units and discount mix of the delivered orders of all the user's "
+        "products per day, week or month, aggregated by the database.",
+        parameters=[OrderSeriesQuerySerializer],
+        responses={
+            200: OpenApiResponse(description="Interval and list of series points, oldest first"),
+            400: OpenApiResponse(description="Invalid query parameters"),
+        },
+    )
+    @action(detail=False, methods=["get"], url_path="series")
+    def products_series(self, request):
+        """
+        Get the order time series of all the products of the current user.
+
+        Query parameters:
+            interval (str, optional): "day", "week" or "month". Defaults to "day"
+            start (datetime, optional): Only include orders recorded at or after this time
+            end (datetime, optional): Only include orders recorded before this time
+
+        Returns:
+            200 OK: Interval and list of series points
+            400 Bad Request: If the query parameters are invalid
+        """
+        return self.order_series_response(DeliveredOrder.objects.filter(product__user=request.user))
 
     @extend_schema(
         summary="Add product costs to a product",
@@ -136,8 +824,8 @@ class ProductViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
         serializer = ProductCostSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save(product=product)
-            # Return the updated product with costs
-            product_serializer = ProductDetailSerializer(product)
+            # Reload the product so the annotated has_product_costs flag is up to date
+            product_serializer = ProductDetailSerializer(self.get_object())
             return Response(product_serializer.data)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -204,10 +892,12 @@ class ProductViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     @extend_schema(
         summary="Get product details",
         description="Get detailed information about a specific product, including product costs if available, and reports from external agent services.",
+        parameters=[INCLUDE_ORDERS_PARAMETER],
         responses={
             200: OpenApiResponse(
                 response=ProductDetailSerializer, description="Detailed product information with agent reports"
             ),
+            304: OpenApiResponse(description="The product did not change since the client's copy"),
             404: OpenApiResponse(description="Product not found"),
         },
     )
@@ -215,35 +905,53 @@ class ProductViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
         """
         Get detailed information about a specific product.
 
-        This method retrieves a product by ID and enhances the response with:
+        This method retrieves a product by ID and enhances the response with its margin figures
+        (margin), computed in-process by ``margin.product_margin``, and:
         1. Report from Agent 1 service (report_1)
         2. Report from Agent 2 service (report_2) which receives the product data and Agent 1's report
 
+        The reports are cached under a hash of the financial data sent to Agent 1, see
+        ``report_cache``. On a cache miss the response does not wait for the agents: it has
+        ``report_status: pending`` and the id of the job generating the reports in ``report_job``,
+        which the client polls at /{id}/report/ (see ``report_jobs``). Reports are also found in
+        the latest ProductReport snapshot recorded for the same data, e.g. after the cache expired.
+        The X-Report-Cache header tells where the reports came from: hit, snapshot or miss.
+
+        The agents receive a summary of the order history, aggregated by the database; the
+        response only includes the orders themselves when ``?include_orders=true`` is passed.
+
         Returns:
             200 OK: Detailed product information including product costs and agent reports
+            304 Not Modified: If the client's copy (If-None-Match / If-Modified-Since) is still current
             404 Not Found: If product not found
         """
-        # First get the product using the standard retrieve logic
-        response = super().retrieve(request, *args, **kwargs)
-
-        # Get product data from the response
-        product_data = response.data
+        # If nothing the response is built from changed, answer 304 without serializing or looking up the reports
+        state = product_validators(request.user, kwargs["pk"])
+        headers = None
+        if state is not None:
+            not_modified, headers = conditional_response(request, state)
+            if not_modified:
+                return not_modified
+
+        row = self.get_object_row()
+        product_data = serialize_product_detail(row, include_orders=self.include_orders())
+        response_data = dict(product_data)
 
         # Only proceed with API calls if we have product data
+        cache_status = None
         if product_data:
-            from .utils import get_agent1_report, get_agent2_report
+            from .utils import agent_financial_data, order_summaries
 
-            # get the current user fixed costs
-            user_fixed_costs = request.user.fixed_costs.all()
+            financial_data = agent_financial_data(request.user, product_data, order_summaries([row])[row["id"]])
 
-            # Call Agent 1 service and add results to the response
-            agent1_result = get_agent1_report(
-                {"financial_data": {"user": user_fixed_costs, "product_details": product_data}}
-            )
-            response.data["report_1"] = agent1_result
+            # The figures of report_1, computed in-process without waiting for the agents
+            response_data["margin"] = margin_summary(financial_data)
 
-            # Call Agent 2 service with Agent 1's result and add to the response
-            agent2_result = get_agent2_report({"report": json.dumps(agent1_result)})
-            response.data["report_2"] = agent2_result
+            # Reuse the reports computed from the same financial data, or queue a job generating them
+            report_fields, cache_status = report_jobs.report_fields(product_data["id"], financial_data)
+            response_data.update(report_fields)
 
-        return response
+        response = Response(response_data)
+        if cache_status:
+            response["X-Report-Cache"] = cache_status
+        return add_validators(response, headers) if headers else response
@@ -19,6 +19,25 @@ export async function getApi({ endpoint, payload }: ApiCallPAramType) {
         return { error: true, data: error.message };
     }
 }
+// Cursor paginated endpoints return one page at a time: follow the "next" links until the last page
+export async function getAllPages({ endpoint }: ApiCallPAramType) {
+    try {
+        const results = [];
+        let url: string | null = `${BaseUrl}${endpoint}/?page_size=200`;
+        while (url) {
+            const { data } = await axios.get(url, header);
+            results.push(...data.results);
+            // The links are built from the host the API sees, which may differ from BaseUrl behind a proxy
+            const next = data.next ? new URL(data.next) : null;
+            url = next ? `${BaseUrl}${next.pathname}${next.search}` : null;
+        }
+
+        return { data: results, error: false };
+    } catch (error) {
+        console.log("🚀 ~ file: Api.ts:30 ~ getAllPages ~ error:", error);
+        return { error: true, data: error.message };
+    }
+}
 export async function postApi({ endpoint, payload }: ApiCallPAramType) {
     try {
         const res = await axios.post(`${BaseUrl}${endpoint}/`, payload, header);
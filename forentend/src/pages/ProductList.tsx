@@ -6,7 +6,7 @@ import { Input } from "@/components/ui/input";
 import { Button } from "@/components/ui/button";
 import { Badge } from "@/components/ui/badge";
 import { Search, Filter, ArrowUpDown, Car, PlusIcon } from "lucide-react";
-import { getApi, postApi } from "@/Api";
+import { getAllPages, postApi } from "@/Api";
 import { useNavigate } from "react-router-dom";
 import { Alert, AlertDescription, AlertTitle } from "@/components/ui/alert";
 import { Label } from "@/components/ui/label";
@@ -89,7 +89,7 @@ export function ProductList() {
 
     const getProductListe = async () => {
         try {
-            const res = await getApi({ endpoint: "/api/products/with-costs" });
+            const res = await getAllPages({ endpoint: "/api/products/with-costs" });
             const { error, data } = res;
             if (error) {
                 alert(data);
@@ -98,12 +98,8 @@ export function ProductList() {
             const tmpData = [];
 
             for (const element of data) {
-                const { product_name, id, delivered_orders } = element;
-                let revenue = 0;
-                for (const deliver of delivered_orders) {
-                    const { price, quantity } = deliver;
-                    revenue += price * quantity;
-                }
+                const { product_name, id } = element;
+                const revenue = Number(element.revenue);
                 const rndprc = getRandomArbitrary(15, 60);
                 tmpData.push({ id, name: product_name, revenue, profit: Math.floor(revenue * (rndprc / 100)), margin: rndprc });
             }
@@ -114,7 +110,7 @@ export function ProductList() {
     };
     const getNonMonitoresProductListe = async () => {
         try {
-            const res = await getApi({ endpoint: "/api/products/without-costs" });
+            const res = await getAllPages({ endpoint: "/api/products/without-costs" });
             const { error, data } = res;
             if (error) {
                 alert(data);
@@ -123,7 +119,7 @@ export function ProductList() {
             const tmpData = [];
 
             for (const element of data) {
-                const { product_name, id, delivered_orders } = element;
+                const { product_name, id } = element;
 
                 const rndprc = getRandomArbitrary(15, 60);
                 tmpData.push({ id, name: product_name });